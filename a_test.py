@@ -276,6 +276,10 @@ def on_select(choice):
 	create_file_save_dialog()
     elif choice == 'Directory Select':
 	create_directory_select_dialog()
+    elif choice == 'Profiler':
+	kytten.DialogProfileOverlay(
+	    window=window, batch=batch, group=fg_group,
+	    theme=theme2, on_escape=on_escape)
     else:
 	print "Unexpected menu selection: %s" % choice
 
@@ -283,7 +287,7 @@ if __name__ == '__main__':
     window = pyglet.window.Window(
 	640, 480, caption='Kytten Test %s' % VERSION,
 	resizable=True, vsync=False)
-    batch = pyglet.graphics.Batch()
+    batch = kytten.KyttenBatch()
     bg_group = pyglet.graphics.OrderedGroup(0)
     fg_group = pyglet.graphics.OrderedGroup(1)
     fps = pyglet.clock.ClockDisplay()
@@ -312,7 +316,7 @@ if __name__ == '__main__':
 		kytten.Menu(options=["Document", "Form", "Scrollable",
 				     "Folding", "Dropdown",
 				     "File Load", "File Save",
-				     "Directory Select"],
+				     "Directory Select", "Profiler"],
 			    on_select=on_select),
 	    ]),
 	),
@@ -0,0 +1,29 @@
+# compile_theme.py
+# Copyrighted (C) 2009 by Conrad "Lynx" Wong
+
+# Compiles a theme directory into a theme bundle, which kytten.Theme can
+# load with a single read and one texture upload per page.
+#
+# Usage: python compile_theme.py THEME_DIR BUNDLE [--name theme.json]
+
+import optparse
+import sys
+
+import pyglet
+pyglet.options['shadow_window'] = False  # we need no display
+
+from kytten.theme import CompileTheme
+
+def main(argv):
+    parser = optparse.OptionParser(usage='%prog THEME_DIR BUNDLE')
+    parser.add_option('--name', default='theme.json',
+                      help='name of the JSON file within THEME_DIR')
+    options, args = parser.parse_args(argv)
+    if len(args) != 2:
+        parser.error('expected a theme directory and a bundle filename')
+    path, bundle = args
+    CompileTheme(path, bundle, name=options.name)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -64,6 +64,7 @@ class BaseState:
 	    self.dialog.draw()
 	if self.popup is not None:
 	    self.popup.draw()
+	kytten.ClearFrameDamage()
 
     def on_hide_state(self, window, manager):
 	if self.popup is not None:
@@ -877,11 +878,13 @@ if __name__ == '__main__':
     bg_group = pyglet.graphics.OrderedGroup(0)
     fg_group = pyglet.graphics.OrderedGroup(1)
 
-    # Update as often as possible (limited by vsync, if not disabled)
+    # Update sixty times a second, but only redraw when kytten tells us
+    # something has changed; otherwise we sleep until the next update
     window.register_event_type('on_update')
     def update(dt):
 	window.dispatch_event('on_update', dt)
-    pyglet.clock.schedule(update)
+	window.invalid = kytten.IsFrameDamaged()
+    pyglet.clock.schedule_interval(update, 1.0 / 60)
 
     # StateManager keeps track of what we're doing
     manager = StateManager(window)
@@ -33,9 +33,17 @@ class ProxyDialog(kytten.Wrapper):
         else:
             return self
 
-    def set_needs_layout(self):
+    def set_needs_layout(self, widget=None):
         if self.saved_dialog is not None:
-            self.saved_dialog.set_needs_layout()
+            self.saved_dialog.set_needs_layout(widget or self)
+
+    def subscribe_updates(self, control):
+        if self.saved_dialog is not None:
+            self.saved_dialog.subscribe_updates(control)
+
+    def unsubscribe_updates(self, control):
+        if self.saved_dialog is not None:
+            self.saved_dialog.unsubscribe_updates(control)
 
     def size(self, dialog):
         if dialog is None:
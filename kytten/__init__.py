@@ -47,14 +47,25 @@ from layout import ANCHOR_TOP_LEFT, ANCHOR_TOP, ANCHOR_TOP_RIGHT, \
 
 from button import Button
 from checkbox import Checkbox
-from dialog import Dialog, PopupMessage, PopupConfirm
-from document import Document
+from dialog import Dialog, PopupMessage, PopupConfirm, DialogProfileOverlay
+from document import Document, LogDocument, PagedDocument
 from file_dialogs import FileLoadDialog, FileSaveDialog, DirectorySelectDialog
 from frame import Frame, TitleFrame, Wrapper, SectionHeader, FoldingSection
 from layout import GridLayout, HorizontalLayout, VerticalLayout, FreeLayout
-from menu import Menu, Dropdown
+from layout import WindowedGridLayout
+from menu import Menu, Dropdown, VirtualMenu
+from override import KyttenBatch
 from scrollable import Scrollable
 from slider import Slider
 from text_input import Input
-from theme import Theme
+from theme import Theme, CompileTheme
 from widgets import Widget, Spacer, Label
+
+# GUI profiling
+
+from dialog import EnableDialogProfiling, IsDialogProfilingEnabled, \
+                   GetDialogProfile, GetDialogProfiles
+
+# Idle-aware rendering
+
+from widgets import MarkFrameDamaged, IsFrameDamaged, ClearFrameDamage
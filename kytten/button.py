@@ -66,24 +66,21 @@ class Button(Control):
     def on_lose_highlight(self):
         Control.on_lose_highlight(self)
         if self.highlight is not None:
-            self.highlight.delete()
-            self.highlight = None
+            self.highlight.set_visible(False)
 
     def on_mouse_press(self, x, y, button, modifiers):
         if not self.is_pressed and not self.is_disabled():
             self.is_pressed = True
 
-            # Delete the button to force it to be redrawn
-            self.delete()
-            self.saved_dialog.set_needs_layout()
+            # size() will restyle the button in place
+            self.saved_dialog.set_needs_layout(self)
 
     def on_mouse_release(self, x, y, button, modifiers):
         if self.is_pressed:
             self.is_pressed = False
 
-            # Delete the button to force it to be redrawn
-            self.delete()
-            self.saved_dialog.set_needs_layout()
+            # size() will restyle the button in place
+            self.saved_dialog.set_needs_layout(self)
 
             # Now, if mouse is still inside us, signal on_click
             if self.on_click is not None and self.hit_test(x, y):
@@ -92,9 +89,13 @@ class Button(Control):
                 else:
                     self.on_click()
 
+    def _restyle(self):
+        pass  # size() restyles our graphic elements in place
+
     def size(self, dialog):
         """
-        Sizes the Button.  If necessary, creates the graphic elements.
+        Sizes the Button.  If necessary, creates the graphic elements;
+        otherwise restyles them in place to suit our state.
 
         @param dialog Dialog which contains the Button
         """
@@ -109,21 +110,26 @@ class Button(Control):
             color = dialog.theme[path]['disabled_color']
         else:
             color = dialog.theme[path]['gui_color']
-        if self.button is None:
-            self.button = dialog.theme[path]['image'].generate(
-                color,
-                dialog.batch, dialog.bg_group)
-        if self.highlight is None and self.is_highlight():
+        self.button = dialog.theme[path]['image'].regenerate(
+            self.button, color,
+            dialog.batch, dialog.bg_group)
+        if self.is_highlight():
             self.highlight = dialog.theme[path]['highlight']['image'].\
-                generate(dialog.theme[path]['highlight_color'],
-                         dialog.batch,
-                         dialog.bg_group)
+                regenerate(self.highlight,
+                           dialog.theme[path]['highlight_color'],
+                           dialog.batch,
+                           dialog.bg_group)
+            self.highlight.set_visible(True)
         if self.label is None:
             self.label = KyttenLabel(self.text,
                 font_name=dialog.theme[path]['font'],
                 font_size=dialog.theme[path]['font_size'],
                 color=dialog.theme[path]['text_color'],
                 batch=dialog.batch, group=dialog.fg_group)
+        else:
+            self.label.set_style(dialog.theme[path]['font'],
+                                 dialog.theme[path]['font_size'],
+                                 dialog.theme[path]['text_color'])
 
         # Treat the height of the label as ascent + descent
         font = self.label.document.get_font()
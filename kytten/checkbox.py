@@ -91,8 +91,7 @@ class Checkbox(Control):
     def on_lose_highlight(self):
         Control.on_lose_highlight(self)
         if self.highlight is not None:
-            self.highlight.delete()
-            self.highlight = None
+            self.highlight.set_visible(False)
 
     def on_mouse_press(self, x, y, button, modifiers):
         if not self.is_disabled():
@@ -103,13 +102,16 @@ class Checkbox(Control):
                 else:
                     self.on_click(self.is_checked)
 
-            # Delete the button to force it to be redrawn
-            self.delete()
-            self.saved_dialog.set_needs_layout()
+            # size() will restyle the checkbox in place
+            self.saved_dialog.set_needs_layout(self)
+
+    def _restyle(self):
+        pass  # size() restyles our graphic elements in place
 
     def size(self, dialog):
         """
-        Sizes the Checkbox.  If necessary, creates the graphic elements.
+        Sizes the Checkbox.  If necessary, creates the graphic elements;
+        otherwise restyles them in place to suit our state.
 
         @param dialog Dialog which contains the Checkbox
         """
@@ -124,21 +126,26 @@ class Checkbox(Control):
             color = dialog.theme[path]['disabled_color']
         else:
             color = dialog.theme[path]['gui_color']
-        if self.checkbox is None:
-            self.checkbox = dialog.theme[path]['image'].generate(
-                color,
-                dialog.batch, dialog.bg_group)
-        if self.highlight is None and self.is_highlight():
-            self.highlight = dialog.theme[path]['highlight']['image'].generate(
-                    dialog.theme[path]['highlight_color'],
-                    dialog.batch,
-                    dialog.bg_group)
+        self.checkbox = dialog.theme[path]['image'].regenerate(
+            self.checkbox, color,
+            dialog.batch, dialog.bg_group)
+        if self.is_highlight():
+            self.highlight = dialog.theme[path]['highlight']['image'].\
+                regenerate(self.highlight,
+                           dialog.theme[path]['highlight_color'],
+                           dialog.batch,
+                           dialog.bg_group)
+            self.highlight.set_visible(True)
         if self.label is None:
             self.label = KyttenLabel(self.text,
                 font_name=dialog.theme[path]['font'],
                 font_size=dialog.theme[path]['font_size'],
                 color=color,
                 batch=dialog.batch, group=dialog.fg_group)
+        else:
+            self.label.set_style(dialog.theme[path]['font'],
+                                 dialog.theme[path]['font_size'],
+                                 color)
 
         # Treat the height of the label as ascent + descent
         font = self.label.document.get_font()
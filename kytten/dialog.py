@@ -1,14 +1,110 @@
 # kytten/dialog.py
 # Copyrighted (C) 2009 by Conrad "Lynx" Wong
 
+import math
+import time
+import weakref
+
 import pyglet
 from pyglet import gl
+from pyglet.graphics.vertexdomain import VertexList
 
+from override import KyttenBatch, InvalidateBatchGroup
 from widgets import Widget, Control, Label
+from widgets import BeginLayoutPass, LayoutMovedControls, MarkFrameDamaged
 from button import Button
 from frame import Wrapper, Frame
-from layout import GetRelativePoint, ANCHOR_CENTER
-from layout import VerticalLayout, HorizontalLayout
+from layout import GetRelativePoint, ANCHOR_CENTER, ANCHOR_TOP_RIGHT
+from layout import VerticalLayout, HorizontalLayout, GridLayout
+
+# Controls are bucketed into square cells of this size for hit testing.
+# Controls which would cover more than CONTROL_GRID_MAX_CELLS cells are
+# kept aside and tested against every point instead.
+CONTROL_GRID_CELL_SIZE = 64
+CONTROL_GRID_MAX_CELLS = 256
+
+class ControlGrid:
+    """
+    A uniform grid over the areas of a Dialog's controls, so that we only
+    need to hit test the few controls lying under the mouse rather than
+    every control within the Dialog.  Controls are stored with their index
+    into the Dialog's list of controls, so that when areas overlap the
+    earliest control is still found first.
+    """
+    def __init__(self, cell_size=CONTROL_GRID_CELL_SIZE):
+        """
+        Creates a new, empty ControlGrid.
+
+        @param cell_size Width and height of each cell of the grid
+        """
+        self.cell_size = cell_size
+        self.cells = {}
+        self.oversized = []
+
+    def add(self, index, control, left, right, top, bottom):
+        """
+        Adds a control to every cell which its area touches.  Controls
+        must be added in order of increasing index.
+
+        @param index Index of the control within the Dialog's controls
+        @param control The control
+        @param left Left edge of the control's area
+        @param right Right edge of the control's area
+        @param top Top edge of the control's area
+        @param bottom Bottom edge of the control's area
+        """
+        if left >= right or bottom >= top:
+            return  # control has no area, we can never hit it
+        # Edges may lie partway through a pixel, so round outward
+        cell_left = int(math.floor(left)) // self.cell_size
+        cell_right = (int(math.ceil(right)) - 1) // self.cell_size
+        cell_bottom = int(math.floor(bottom)) // self.cell_size
+        cell_top = (int(math.ceil(top)) - 1) // self.cell_size
+        if (cell_right - cell_left + 1) * (cell_top - cell_bottom + 1) > \
+           CONTROL_GRID_MAX_CELLS:
+            self.oversized.append((index, control))
+            return
+        entry = (index, control)
+        for cell_x in xrange(cell_left, cell_right + 1):
+            for cell_y in xrange(cell_bottom, cell_top + 1):
+                cell = (cell_x, cell_y)
+                if cell in self.cells:
+                    self.cells[cell].append(entry)
+                else:
+                    self.cells[cell] = [entry]
+
+    def get(self, x, y):
+        """
+        Returns the controls which may lie underneath a point, in the order
+        they appear in the Dialog's controls.
+
+        @param x X coordinate of point
+        @param y Y coordinate of point
+        """
+        cell = (int(math.floor(x)) // self.cell_size,
+                int(math.floor(y)) // self.cell_size)
+        entries = self.cells.get(cell, [])
+        if self.oversized:
+            entries = sorted(entries + self.oversized)
+        return [control for index, control in entries]
+
+def GetWidgetOffset(widget, dialog=None):
+    """
+    Returns how far a Widget is drawn from where it was laid out, by the
+    translations of the Scrollables, bands and Dialogs it lies within.
+
+    @param widget The Widget to be located
+    @param dialog If given, we count only the translations of those within
+                  this Dialog, and not its own
+    """
+    offset_x = offset_y = 0
+    container = widget.saved_dialog
+    while container is not None and container is not dialog:
+        group = getattr(container, 'root_group', None)
+        offset_x += getattr(group, 'translate_x', 0)
+        offset_y += getattr(group, 'translate_y', 0)
+        container = getattr(container, 'saved_dialog', None)
+    return offset_x, offset_y
 
 class DialogEventManager(Control):
     def __init__(self):
@@ -20,11 +116,25 @@ class DialogEventManager(Control):
         Control.__init__(self)
         self.controls = []
         self.control_areas = {}
+        self.control_offsets = {}
+        self.control_grid = ControlGrid()
         self.control_map = {}
         self.hover = None
         self.focus = None
         self.wheel_hint = None
         self.wheel_target = None
+        self.update_subscribers = []
+
+    def _to_control(self, control, x, y):
+        """
+        Converts a point into the coordinates a control was laid out in.
+
+        @param control The control to receive the point
+        @param x X coordinate of point
+        @param y Y coordinate of point
+        """
+        offset_x, offset_y = self.control_offsets.get(control, (0, 0))
+        return x - offset_x, y - offset_y
 
     def get_value(self, id):
         widget = self.get_widget(id)
@@ -38,13 +148,23 @@ class DialogEventManager(Control):
                 retval[widget.id] = widget.get_value()
         return retval
 
+    def get_control_offset(self, control):
+        """
+        Returns how far a control is drawn from where it was laid out,
+        i.e. because it lies within Scrollables which have since been
+        scrolled.  We do not count our own translation.
+
+        @param control The control to be located
+        """
+        return GetWidgetOffset(control, self)
+
     def get_widget(self, id):
         return self.control_map.get(id)
 
     def hit_control(self, x, y, control):
         left, right, top, bottom = self.control_areas[control]
         if x >= left and x < right and y >= bottom and y < top:
-            return control.hit_test(x, y)
+            return control.hit_test(*self._to_control(control, x, y))
         else:
             return False
 
@@ -108,6 +228,7 @@ class DialogEventManager(Control):
         @param modifiers Modifiers to apply to buttons
         """
         if self.focus is not None:
+            x, y = self._to_control(self.focus, x, y)
             self.focus.dispatch_event('on_mouse_drag',
                                       x, y, dx, dy, buttons, modifiers)
             return pyglet.event.EVENT_HANDLED
@@ -123,15 +244,17 @@ class DialogEventManager(Control):
         @param dy Delta Y
         """
         if self.hover is not None and not self.hit_control(x, y, self.hover):
-            self.hover.dispatch_event('on_mouse_motion', x, y, dx, dy)
+            self.hover.dispatch_event('on_mouse_motion',
+                *(self._to_control(self.hover, x, y) + (dx, dy)))
         new_hover = None
-        for control in self.controls:
+        for control in self.control_grid.get(x, y):
             if self.hit_control(x, y, control):
                 new_hover = control
                 break
         self.set_hover(new_hover)
         if self.hover is not None:
-            self.hover.dispatch_event('on_mouse_motion', x, y, dx, dy)
+            self.hover.dispatch_event('on_mouse_motion',
+                *(self._to_control(self.hover, x, y) + (dx, dy)))
 
     def on_mouse_press(self, x, y, button, modifiers):
         """
@@ -146,6 +269,7 @@ class DialogEventManager(Control):
         @param modifiers Modifiers to apply to button
         """
         if self.focus is not None and self.hit_control(x, y, self.focus):
+            x, y = self._to_control(self.focus, x, y)
             self.focus.dispatch_event('on_mouse_press',
                                       x, y, button, modifiers)
             return pyglet.event.EVENT_HANDLED
@@ -153,6 +277,7 @@ class DialogEventManager(Control):
             if self.hit_test(x, y):
                 self.set_focus(self.hover)
                 if self.focus is not None:
+                    x, y = self._to_control(self.focus, x, y)
                     self.focus.dispatch_event('on_mouse_press',
                                               x, y, button, modifiers)
                     return pyglet.event.EVENT_HANDLED
@@ -173,7 +298,7 @@ class DialogEventManager(Control):
         self.is_dragging = False
         if self.focus is not None:
             self.focus.dispatch_event('on_mouse_release',
-                                      x, y, button, modifiers)
+                *(self._to_control(self.focus, x, y) + (button, modifiers)))
         DialogEventManager.on_mouse_motion(self, x, y, 0, 0)
         return pyglet.event.EVENT_HANDLED
 
@@ -189,11 +314,13 @@ class DialogEventManager(Control):
         """
         if self.wheel_target is not None and \
            self.wheel_target in self.controls:
+            x, y = self._to_control(self.wheel_target, x, y)
             self.wheel_target.dispatch_event('on_mouse_scroll',
                                              x, y, scroll_x, scroll_y)
             return pyglet.event.EVENT_HANDLED
         elif self.wheel_hint is not None and \
              self.wheel_hint in self.controls:
+            x, y = self._to_control(self.wheel_hint, x, y)
             self.wheel_hint.dispatch_event('on_mouse_scroll',
                                            x, y, scroll_x, scroll_y)
             return pyglet.event.EVENT_HANDLED
@@ -221,14 +348,13 @@ class DialogEventManager(Control):
 
     def on_update(self, dt):
         """
-        We update our layout only when it's time to construct another frame.
-        Since we may receive several resize events within this time, this
-        ensures we don't resize too often.
+        Dispatches on_update to those controls which have subscribed to
+        updates.  Other controls are not visited at all, so an idle
+        Dialog costs next to nothing however many controls it has.
 
-        @param dialog The Dialog containing the controls
         @param dt Time passed since last update event (in seconds)
         """
-        for control in self.controls:
+        for control in list(self.update_subscribers):
             control.dispatch_event('on_update', dt)
 
     def set_focus(self, focus):
@@ -239,6 +365,7 @@ class DialogEventManager(Control):
         """
         if self.focus == focus:
             return
+        MarkFrameDamaged()
         if self.focus is not None:
             self.focus.dispatch_event('on_lose_focus')
         self.focus = focus
@@ -254,6 +381,7 @@ class DialogEventManager(Control):
         """
         if self.hover == hover:
             return
+        MarkFrameDamaged()
         if self.hover is not None:
             self.hover.dispatch_event('on_lose_highlight')
         self.hover = hover
@@ -266,23 +394,53 @@ class DialogEventManager(Control):
     def set_wheel_target(self, control):
         self.wheel_target = control
 
+    def subscribe_updates(self, control):
+        """
+        Dispatches on_update to a control every frame, until it is
+        unsubscribed.
+
+        @param control The control which needs updates
+        """
+        if control not in self.update_subscribers:
+            self.update_subscribers.append(control)
+
     def teardown(self):
         self.controls = []
+        self.control_areas = {}
+        self.control_offsets = {}
+        self.control_grid = ControlGrid()
         self.control_map = {}
         self.focus = None
         self.hover = None
         self.wheel_hint = None
         self.wheel_target = None
+        self.update_subscribers = []
+
+    def unsubscribe_updates(self, control):
+        """
+        Stops dispatching on_update to a control.
+
+        @param control The control which no longer needs updates
+        """
+        if control in self.update_subscribers:
+            self.update_subscribers.remove(control)
 
     def update_controls(self):
         """Update our list of controls which may respond to user input."""
         controls = self._get_controls()
         self.controls = []
         self.control_areas = {}
+        self.control_offsets = {}
+        self.control_grid = ControlGrid()
         self.control_map = {}
         for control, left, right, top, bottom in controls:
+            self.control_grid.add(len(self.controls), control,
+                                  left, right, top, bottom)
             self.controls.append(control)
             self.control_areas[control] = (left, right, top, bottom)
+            offset = self.get_control_offset(control)
+            if offset != (0, 0):
+                self.control_offsets[control] = offset
             if control.id is not None:
                 self.control_map[control.id] = control
 
@@ -302,6 +460,9 @@ class DialogGroup(pyglet.graphics.OrderedGroup):
     Ensure that all Widgets within a Dialog can be drawn with
     blending enabled, and that our Dialog will be drawn in a particular
     order relative to other Dialogs.
+
+    Our Widgets are also drawn translated by (translate_x, translate_y),
+    so that a Dialog may be moved without laying out its Widgets again.
     """
     def __init__(self, parent=None):
         """
@@ -312,6 +473,7 @@ class DialogGroup(pyglet.graphics.OrderedGroup):
         pyglet.graphics.OrderedGroup.__init__(
             self, GetNextDialogOrderId(), parent)
         self.real_order = self.order
+        self.translate_x = self.translate_y = 0
 
     def __cmp__(self, other):
         """
@@ -321,7 +483,7 @@ class DialogGroup(pyglet.graphics.OrderedGroup):
         if isinstance(other, DialogGroup):
             return cmp(self.real_order, other.real_order)
         else:
-            return OrderedGroup.__cmp__(self, other)
+            return pyglet.graphics.OrderedGroup.__cmp__(self, other)
 
     def is_on_top(self):
         """
@@ -338,18 +500,191 @@ class DialogGroup(pyglet.graphics.OrderedGroup):
 
     def set_state(self):
         """
-        Ensure that blending is set.
+        Ensure that blending is set, and apply our translation.
         """
         gl.glPushAttrib(gl.GL_ENABLE_BIT | gl.GL_CURRENT_BIT)
         gl.glEnable(gl.GL_BLEND)
         gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
+        gl.glPushMatrix()
+        gl.glTranslatef(self.translate_x, self.translate_y, 0)
+
+    def set_translation(self, x, y):
+        """
+        Sets how far our Widgets are drawn from where they were laid out.
+        Only the modelview matrix changes, so no vertices are touched.
+
+        @param x Distance to the right
+        @param y Distance upwards
+        """
+        self.translate_x, self.translate_y = x, y
 
     def unset_state(self):
         """
-        Restore previous blending state.
+        Restore previous blending state and translation.
         """
+        gl.glPopMatrix()
         gl.glPopAttrib()
 
+# Profiling is off unless EnableDialogProfiling() is called.  While it is
+# on, each Dialog keeps a DialogProfile of the time it spends laying out,
+# updating, drawing and handling events, and of how many vertex lists are
+# created or deleted meanwhile, for its most recent DIALOG_PROFILE_FRAMES
+# frames.  A frame runs from one on_update to the next.
+DIALOG_PROFILE_FRAMES = 60
+
+# Events which Dialogs receive from the window, timed by event type
+DIALOG_PROFILE_EVENT_TYPES = ['on_key_press', 'on_key_release',
+                              'on_mouse_drag', 'on_mouse_motion',
+                              'on_mouse_press', 'on_mouse_release',
+                              'on_mouse_scroll', 'on_resize', 'on_text',
+                              'on_text_motion', 'on_text_motion_select']
+
+kytten_dialog_profiling = False
+kytten_dialog_profiles = weakref.WeakKeyDictionary()
+kytten_next_dialog_profile_id = 0
+kytten_vertex_lists_created = 0
+kytten_vertex_lists_deleted = 0
+kytten_vertex_list_init = VertexList.__init__.im_func
+kytten_vertex_list_delete = VertexList.delete.im_func
+
+def CountingVertexListInit(self, *args):
+    global kytten_vertex_lists_created
+    kytten_vertex_lists_created += 1
+    kytten_vertex_list_init(self, *args)
+
+def CountingVertexListDelete(self):
+    global kytten_vertex_lists_deleted
+    kytten_vertex_lists_deleted += 1
+    kytten_vertex_list_delete(self)
+
+def EnableDialogProfiling(enabled=True):
+    """
+    Turns profiling of Dialogs on or off.  While it is on, pyglet's vertex
+    lists are counted as they are created and deleted.  Turning it off
+    discards all profiles.
+
+    @param enabled True to turn profiling on, False to turn it off
+    """
+    global kytten_dialog_profiling
+    kytten_dialog_profiling = enabled
+    if enabled:
+        VertexList.__init__ = CountingVertexListInit
+        VertexList.delete = CountingVertexListDelete
+    else:
+        VertexList.__init__ = kytten_vertex_list_init
+        VertexList.delete = kytten_vertex_list_delete
+        kytten_dialog_profiles.clear()
+
+def IsDialogProfilingEnabled():
+    return kytten_dialog_profiling
+
+def GetDialogProfile(dialog):
+    """
+    Returns the DialogProfile of a Dialog, creating it if necessary, or
+    None if profiling is off.
+
+    @param dialog The Dialog
+    """
+    global kytten_next_dialog_profile_id
+    if not kytten_dialog_profiling:
+        return None
+    profile = kytten_dialog_profiles.get(dialog)
+    if profile is None:
+        kytten_next_dialog_profile_id += 1
+        profile = DialogProfile('%s %d' % (dialog.__class__.__name__,
+                                           kytten_next_dialog_profile_id))
+        kytten_dialog_profiles[dialog] = profile
+    return profile
+
+def GetDialogProfiles():
+    """
+    Returns the DialogProfiles of all Dialogs which have done any work
+    since profiling was turned on, and which still exist.
+    """
+    return kytten_dialog_profiles.values()
+
+class DialogProfile:
+    """
+    Time spent by a single Dialog, split by what it was doing.  Each frame
+    is a dictionary holding seconds spent in 'size' and 'layout' (the two
+    phases of do_layout), 'update_controls', 'update' (passing on_update
+    to our controls) and 'draw', a dictionary of seconds spent handling
+    'events' by event type, and counts of 'vertex_lists_created' and
+    'vertex_lists_deleted'.
+    """
+    def __init__(self, name):
+        """
+        Creates a new, empty DialogProfile.
+
+        @param name Name by which to report the Dialog.  This may be
+                    changed to something more descriptive.
+        """
+        self.name = name
+        self.frames = []  # most recent complete frames, oldest first
+        self.current = self._new_frame()
+
+    def _new_frame(self):
+        return {'size': 0.0, 'layout': 0.0, 'update_controls': 0.0,
+                'update': 0.0, 'draw': 0.0, 'events': {},
+                'vertex_lists_created': 0, 'vertex_lists_deleted': 0}
+
+    def end_frame(self):
+        """Closes the current frame and begins another."""
+        self.frames.append(self.current)
+        if len(self.frames) > DIALOG_PROFILE_FRAMES:
+            del self.frames[0]
+        self.current = self._new_frame()
+
+    def get_average(self):
+        """
+        Returns a frame averaged over our recent frames, in which 'events'
+        is the total time spent on events, and 'total' the time spent on
+        everything.
+        """
+        average = self._new_frame()
+        average['events'] = 0.0
+        count = max(len(self.frames), 1)
+        for frame in self.frames:
+            for key, value in frame.iteritems():
+                if key == 'events':
+                    average['events'] += sum(value.itervalues())
+                else:
+                    average[key] += value
+        for key in average.keys():
+            average[key] = float(average[key]) / count
+        average['total'] = average['size'] + average['layout'] + \
+            average['update_controls'] + average['update'] + \
+            average['draw'] + average['events']
+        return average
+
+    def start(self):
+        """
+        Returns a mark from which to measure some work.
+        """
+        return (time.time(),
+                kytten_vertex_lists_created, kytten_vertex_lists_deleted)
+
+    def stop(self, key, mark, event_type=None):
+        """
+        Adds the work done since a mark to the current frame, and returns
+        a new mark so that consecutive phases may be measured in turn.
+
+        @param key The kind of work, i.e. 'size' or 'events'
+        @param mark A mark returned by start() or stop()
+        @param event_type For events, the type of event handled
+        """
+        new_mark = self.start()
+        seconds = new_mark[0] - mark[0]
+        frame = self.current
+        if event_type is not None:
+            frame[key][event_type] = frame[key].get(event_type, 0.0) + \
+                seconds
+        else:
+            frame[key] += seconds
+        frame['vertex_lists_created'] += new_mark[1] - mark[1]
+        frame['vertex_lists_deleted'] += new_mark[2] - mark[2]
+        return new_mark
+
 class Dialog(Wrapper, DialogEventManager):
     """
     Defines a new GUI.  By default it can contain only one element, but that
@@ -395,12 +730,13 @@ class Dialog(Wrapper, DialogEventManager):
         self.window = window
         self.anchor = anchor
         self.offset = offset
+        self.layout_offset = None  # offset our Widgets were laid out at
         self.theme = theme
         self.is_movable = movable
         self.on_enter = on_enter
         self.on_escape = on_escape
         if batch is None:
-            self.batch = pyglet.graphics.Batch()
+            self.batch = KyttenBatch()
             self.own_batch = True
         else:
             self.batch = batch
@@ -411,6 +747,8 @@ class Dialog(Wrapper, DialogEventManager):
         self.fg_group = pyglet.graphics.OrderedGroup(2, self.root_group)
         self.highlight_group = pyglet.graphics.OrderedGroup(3, self.root_group)
         self.needs_layout = True
+        self.needs_full_layout = True
+        self.is_full_layout = True
         self.is_dragging = False
 
         if window is None:
@@ -424,33 +762,102 @@ class Dialog(Wrapper, DialogEventManager):
         """
         We lay out the Dialog by first determining the size of all its
         chlid Widgets, then laying ourself out relative to the parent window.
+
+        Unless the whole Dialog needs to be laid out again, only those
+        Widgets which have been marked dirty, and their containers, are
+        sized again, and only those Widgets which have moved or changed
+        size are laid out again.
         """
+        BeginLayoutPass()
+        self.is_full_layout = self.needs_full_layout
+
+        # Widgets which find out while being laid out that they will need
+        # to be laid out again may ask for it, i.e. for the next frame
+        self.needs_layout = False
+        self.needs_full_layout = False
+        profile = GetDialogProfile(self)
+        if profile is not None:
+            mark = profile.start()
+
         # Determine size of all components
         self.size(self)
+        if profile is not None:
+            mark = profile.stop('size', mark)
 
         # Calculate our position relative to our containing window,
-        # making sure that we fit completely on the window.  If our offset
-        # would send us off the screen, constrain it.
+        # making sure that we fit completely on the window.
+        x, y = GetRelativePoint(self.screen, self.anchor,
+                                self, None, (0, 0))
+        self.offset = self._constrain_offset(self.offset)
+
+        # Our Widgets stay where they were last laid out, and are drawn
+        # translated to wherever we have since been moved.  Only a full
+        # layout, which moves every Widget anyway, folds the translation
+        # back into their positions.
+        if self.is_full_layout or self.layout_offset is None:
+            self.layout_offset = self.offset
+        offset_x, offset_y = self.layout_offset
+        self._update_translation()
+
+        # Perform the actual layout now!
+        self.layout(x + offset_x, y + offset_y)
+        if profile is not None:
+            mark = profile.stop('layout', mark)
+        if self.is_full_layout or LayoutMovedControls():
+            self.update_controls()
+            if profile is not None:
+                profile.stop('update_controls', mark)
+
+        self.has_dirty_child = False
+        self.is_full_layout = True
+        MarkFrameDamaged()
+
+    def _constrain_offset(self, offset):
+        """
+        Returns the offset constrained so that we fit completely on the
+        window.
+
+        @param offset Offset from the anchor point
+        """
         x, y = GetRelativePoint(self.screen, self.anchor,
                                 self, None, (0, 0))
         max_offset_x = self.screen.width - self.width - x
         max_offset_y = self.screen.height - self.height - y
-        offset_x, offset_y = self.offset
+        offset_x, offset_y = offset
         offset_x = max(min(offset_x, max_offset_x), -x)
         offset_y = max(min(offset_y, max_offset_y), -y)
-        self.offset = (offset_x, offset_y)
-        x += offset_x
-        y += offset_y
+        return (offset_x, offset_y)
 
-        # Perform the actual layout now!
-        self.layout(x, y)
-        self.update_controls()
+    def _update_translation(self):
+        """
+        Translates our group by however far we have been moved since our
+        Widgets were laid out.
+        """
+        offset_x, offset_y = self.offset
+        layout_x, layout_y = self.layout_offset or self.offset
+        self.root_group.set_translation(offset_x - layout_x,
+                                        offset_y - layout_y)
+        MarkFrameDamaged()
 
-        self.needs_layout = False
+    def _untranslate(self, x, y):
+        """
+        Converts a point on the window into the coordinates our Widgets
+        were laid out in.
+
+        @param x X coordinate on the window
+        @param y Y coordinate on the window
+        """
+        return (x - self.root_group.translate_x,
+                y - self.root_group.translate_y)
 
     def draw(self):
         assert self.own_batch
+        profile = GetDialogProfile(self)
+        if profile is not None:
+            mark = profile.start()
         self.batch.draw()
+        if profile is not None:
+            profile.stop('draw', mark)
 
     def ensure_visible(self, control):
         """
@@ -462,6 +869,14 @@ class Dialog(Wrapper, DialogEventManager):
     def get_root(self):
         return self
 
+    def get_view_region(self):
+        """
+        Returns the area of the screen within which our Widgets can be
+        seen, as a tuple of (x, y, width, height).
+        """
+        x, y = self._untranslate(0, 0)
+        return x, y, self.screen.width, self.screen.height
+
     def on_key_press(self, symbol, modifiers):
         """
         We intercept TAB, ENTER, and ESCAPE events.  TAB and ENTER will
@@ -498,14 +913,32 @@ class Dialog(Wrapper, DialogEventManager):
         @param buttons Buttons held while moving
         @param modifiers Modifiers to apply to buttons
         """
+        x, y = self._untranslate(x, y)
         if not DialogEventManager.on_mouse_drag(self, x, y, dx, dy,
                                                 buttons, modifiers):
             if self.is_movable and self.is_dragging:
                 x, y = self.offset
-                self.offset = (int(x + dx), int(y + dy))
-                self.set_needs_layout()
+                self.offset = self._constrain_offset(
+                    (int(x + dx), int(y + dy)))
+
+                # Only our position has changed, so our Widgets need not
+                # even be moved; we are simply drawn somewhere else
+                self._update_translation()
                 return pyglet.event.EVENT_HANDLED
 
+    def on_mouse_motion(self, x, y, dx, dy):
+        """
+        Handles mouse motion, in the coordinates our Widgets were laid
+        out in.
+
+        @param x X coordinate of mouse
+        @param y Y coordinate of mouse
+        @param dx Delta X
+        @param dy Delta Y
+        """
+        x, y = self._untranslate(x, y)
+        return DialogEventManager.on_mouse_motion(self, x, y, dx, dy)
+
     def on_mouse_press(self, x, y, button, modifiers):
         """
         If the focus is set, and the target lies within the focus, pass the
@@ -518,6 +951,7 @@ class Dialog(Wrapper, DialogEventManager):
         @param button Button pressed
         @param modifiers Modifiers to apply to button
         """
+        x, y = self._untranslate(x, y)
         retval = DialogEventManager.on_mouse_press(self, x, y,
                                              button, modifiers)
         if self.hit_test(x, y):
@@ -540,9 +974,30 @@ class Dialog(Wrapper, DialogEventManager):
         @param modifiers Modifiers to apply to button
         """
         self.is_dragging = False
+        x, y = self._untranslate(x, y)
         return DialogEventManager.on_mouse_release(self, x, y,
                                                    button, modifiers)
 
+    def on_mouse_scroll(self, x, y, scroll_x, scroll_y):
+        """
+        Mousewheel was scrolled, in the coordinates our Widgets were laid
+        out in.
+
+        @param x X coordinate of mouse
+        @param y Y coordinate of mouse
+        @param scroll_x Number of clicks horizontally mouse was moved
+        @param scroll_y Number of clicks vertically mouse was moved
+        """
+        x, y = self._untranslate(x, y)
+        return DialogEventManager.on_mouse_scroll(self, x, y,
+                                                  scroll_x, scroll_y)
+
+    def on_expose(self):
+        """
+        The window's contents have been lost, so we must be redrawn.
+        """
+        MarkFrameDamaged()
+
     def on_resize(self, width, height):
         """
         Update our knowledge of the window's width and height.
@@ -550,9 +1005,10 @@ class Dialog(Wrapper, DialogEventManager):
         @param width Width of the window
         @param height Height of the window
         """
+        MarkFrameDamaged()
         if self.screen.width != width or self.screen.height != height:
             self.screen.width, self.screen.height = width, height
-            self.needs_layout = True
+            self.set_needs_layout()
 
     def on_update(self, dt):
         """
@@ -562,37 +1018,100 @@ class Dialog(Wrapper, DialogEventManager):
 
         @param dt Time passed since last update event (in seconds)
         """
+        profile = GetDialogProfile(self)
+        if profile is not None:
+            profile.end_frame()
         if self.needs_layout:
             self.do_layout()
+        if profile is not None:
+            mark = profile.start()
         DialogEventManager.on_update(self, dt)
+        if profile is not None:
+            profile.stop('update', mark)
 
     def pop_to_top(self):
         """
         Pop our dialog group to the top, and force our batch to re-sort
-        the groups.  Also, puts our event handler on top of the window's
-        event handler stack.
+        the groups alongside it.  Also, puts our event handler on top of
+        the window's event handler stack.
         """
         self.root_group.pop_to_top()
-        self.batch._draw_list_dirty = True  # forces resorting groups
+        InvalidateBatchGroup(self.batch, self.root_group.parent)
+        MarkFrameDamaged()
         if self.window is not None:
             self.window.remove_handlers(self)
             self.window.push_handlers(self)
 
-    def set_needs_layout(self):
+    def set_needs_layout(self, widget=None):
         """
         True if we should redo the Dialog layout on our next update.
+
+        @param widget The Widget which has changed.  If given, only that
+                      Widget and its containers are sized again; otherwise
+                      the whole Dialog is.
         """
+        if widget is None or widget is self or \
+           widget.set_dirty() is not self:
+            self.needs_full_layout = True
         self.needs_layout = True
 
     def teardown(self):
         DialogEventManager.teardown(self)
+        if kytten_dialog_profiles.has_key(self):
+            del kytten_dialog_profiles[self]
         if self.content is not None:
             self.content.teardown()
             self.content = None
         if self.window is not None:
             self.window.remove_handlers(self)
             self.window = None
-        self.batch._draw_list_dirty = True  # forces resorting groups
+
+        # Our groups are now empty, and will be removed from the batch
+        InvalidateBatchGroup(self.batch, self.root_group, descendants=True)
+        MarkFrameDamaged()
+
+def DamageOnDialogEvent(event_type):
+    """
+    Replaces the Dialog's handler for an event type with one which marks
+    the frame damaged whenever the event is handled, since whichever
+    Control handled it may now look different.
+
+    @param event_type The event type, i.e. 'on_mouse_press'
+    """
+    handler = getattr(Dialog, event_type).im_func
+    def damaging_handler(self, *args):
+        retval = handler(self, *args)
+        if retval:
+            MarkFrameDamaged()
+        return retval
+    damaging_handler.__name__ = handler.__name__
+    damaging_handler.__doc__ = handler.__doc__
+    setattr(Dialog, event_type, damaging_handler)
+
+def ProfileDialogEvent(event_type):
+    """
+    Replaces the Dialog's handler for an event type with one which, while
+    profiling is on, adds the time spent handling it to the profile.
+
+    @param event_type The event type, i.e. 'on_mouse_press'
+    """
+    handler = getattr(Dialog, event_type).im_func
+    def profiled_handler(self, *args):
+        profile = GetDialogProfile(self)
+        if profile is None:
+            return handler(self, *args)
+        mark = profile.start()
+        try:
+            return handler(self, *args)
+        finally:
+            profile.stop('events', mark, event_type)
+    profiled_handler.__name__ = handler.__name__
+    profiled_handler.__doc__ = handler.__doc__
+    setattr(Dialog, event_type, profiled_handler)
+
+for event_type in DIALOG_PROFILE_EVENT_TYPES:
+    DamageOnDialogEvent(event_type)
+    ProfileDialogEvent(event_type)
 
 class PopupMessage(Dialog):
     """A simple fire-and-forget dialog."""
@@ -640,4 +1159,84 @@ class PopupConfirm(Dialog):
             ])),
             window=window, batch=batch, group=group,
             theme=theme, movable=True,
-            on_enter=on_ok_click, on_escape=on_cancel_click)
\ No newline at end of file
+            on_enter=on_ok_click, on_escape=on_cancel_click)
+
+class DialogProfileOverlay(Dialog):
+    """
+    Shows the DialogProfiles of all other Dialogs, averaged over their
+    recent frames, so that we can see which Dialog is eating the frame
+    budget.  Turns profiling on if it is off, and off again once we are
+    torn down, since profiling slows every batch in the process.
+    """
+    COLUMNS = [('Dialog', None), ('Total', 'total'), ('Size', 'size'),
+               ('Layout', 'layout'), ('Controls', 'update_controls'),
+               ('Update', 'update'), ('Draw', 'draw'),
+               ('Events', 'events'), ('+VL', 'vertex_lists_created'),
+               ('-VL', 'vertex_lists_deleted')]
+
+    def __init__(self, window=None, batch=None, group=None, theme=None,
+                 anchor=ANCHOR_TOP_RIGHT, interval=0.5, on_escape=None):
+        """
+        Creates a new DialogProfileOverlay.
+
+        @param interval Seconds between refreshes of the shown timings
+        @param on_escape Callback for when user presses escape
+        """
+        self.is_profiling_ours = not IsDialogProfilingEnabled()
+        if self.is_profiling_ours:
+            EnableDialogProfiling()
+        self.interval = interval
+        self.elapsed = interval  # refresh on our first update
+        self.grid = GridLayout([[Label(title)
+                                 for title, key in self.COLUMNS]])
+        Dialog.__init__(self, content=Frame(self.grid),
+                        window=window, batch=batch, group=group,
+                        anchor=anchor, theme=theme, movable=True,
+                        on_escape=on_escape)
+
+    def _get_rows(self):
+        """
+        Returns the text of each row to be shown, most expensive first.
+        Times are in milliseconds per frame.
+        """
+        own_profile = kytten_dialog_profiles.get(self)
+        averages = [(profile.get_average(), profile)
+                    for profile in GetDialogProfiles()
+                    if profile is not own_profile]
+        averages.sort(lambda a, b: cmp(b[0]['total'], a[0]['total']))
+        rows = []
+        for average, profile in averages:
+            row = [profile.name]
+            for title, key in self.COLUMNS[1:]:
+                if key.startswith('vertex_lists'):
+                    row.append('%.1f' % average[key])
+                else:
+                    row.append('%.2f' % (average[key] * 1000))
+            rows.append(row)
+        return rows
+
+    def on_update(self, dt):
+        self.elapsed += dt
+        if self.elapsed >= self.interval:
+            self.elapsed = 0.0
+            self.refresh()
+        Dialog.on_update(self, dt)
+
+    def refresh(self):
+        """Shows the latest timings, adding or removing rows as needed."""
+        rows = self._get_rows()
+        for index, row in enumerate(rows):
+            if index + 1 < len(self.grid.content):
+                for label, text in zip(self.grid.content[index + 1], row):
+                    if label.text != text:
+                        label.set_text(text)
+            else:
+                self.grid.add_row([Label(text) for text in row])
+        while len(self.grid.content) > len(rows) + 1:
+            self.grid.delete_row(len(self.grid.content) - 1)
+
+    def teardown(self):
+        if self.is_profiling_ours:
+            self.is_profiling_ours = False
+            EnableDialogProfiling(False)
+        Dialog.teardown(self)
@@ -1,9 +1,13 @@
 # kytten/document.py
 # Copyrighted (C) 2009 by Conrad "Lynx" Wong
 
+import codecs
+import collections
+import os
+
 import pyglet
 
-from widgets import Control
+from widgets import Control, MarkFrameDamaged
 from scrollbar import VScrollbar
 
 class Document(Control):
@@ -49,6 +53,18 @@ class Document(Control):
         controls += Control._get_controls(self)
         return controls
 
+    def _update_view(self):
+        """
+        Scrolls our text to wherever our scrollbar has been moved.
+        """
+        if self.scrollbar is None:
+            return
+        pos = self.scrollbar.get(self.max_height,
+                                 self.content.content_height)
+        if pos != -self.content.view_y:
+            self.content.view_y = -pos
+            MarkFrameDamaged()
+
     def delete(self):
         if self.content is not None:
             self.content.delete()
@@ -71,30 +87,30 @@ class Document(Control):
 
     def layout(self, x, y):
         self.x, self.y = x, y
-        self.content.begin_update()
-        self.content.x = x
-        self.content.y = y
-        self.content.end_update()
+        if (self.content.x, self.content.y) != (x, y):
+            # Moving the text layout rewrites its vertex lists, which we
+            # needn't do when only our scrollbar has moved
+            self.content.begin_update()
+            self.content.x = x
+            self.content.y = y
+            self.content.end_update()
         if self.scrollbar is not None:
             self.scrollbar.layout(x + self.content_width, y)
 
+        # Our scrollbar has us laid out again whenever it moves
+        self._update_view()
+
     def on_update(self, dt):
         """
-        On updates, we update the scrollbar and then set our view offset
-        if it has changed.
+        On updates, we have the Dialog laid out again if our text has
+        changed.  We need no further updates until it changes again.
 
         @param dt Time passed since last update event (in seconds)
         """
-        if self.scrollbar is not None:
-            self.scrollbar.dispatch_event('on_update', dt)
-            pos = self.scrollbar.get(self.max_height,
-                                     self.content.content_height)
-            if pos != -self.content.view_y:
-                self.content.view_y = -pos
-
         if self.needs_layout:
             self.needs_layout = False
-            self.saved_dialog.set_needs_layout()
+            self.saved_dialog.set_needs_layout(self)
+        self.stop_updates()
 
     def size(self, dialog):
         if dialog is None:
@@ -119,13 +135,456 @@ class Document(Control):
            (self.max_height and self.content.content_height > self.max_height):
             if self.scrollbar is None:
                 self.scrollbar = VScrollbar(self.max_height)
+                self.scrollbar.parent = self
             self.scrollbar.size(dialog)
             self.scrollbar.set(self.max_height, self.content.content_height)
         if self.scrollbar is not None:
             self.width = self.content_width + self.scrollbar.width
         else:
             self.width = self.content_width
+        if self.needs_layout:
+            self.start_updates()
 
     def set_text(self, text):
         self.document.text = text
-        self.needs_layout = True
\ No newline at end of file
+        self.needs_layout = True
+        self.start_updates()
+
+class LogDocument(Document):
+    """
+    A Document for logs and chat, to which text is appended as it
+    arrives.  Appended text is inserted at the end of our document once
+    per update, however many lines arrived, and only the oldest lines
+    beyond max_lines are deleted.  Once we've grown to our maximum height
+    the Dialog need not be laid out again; only our scrollbar moves.
+    While scrolled to the bottom, we stay there as text is appended.
+    """
+    def __init__(self, text='', width=1000, height=400,
+                 is_fixed_size=False, always_show_scrollbar=False,
+                 max_lines=1000):
+        """
+        Creates a new LogDocument.
+
+        @param text Initial text
+        @param width Width of the document
+        @param height Maximum height of the document
+        @param is_fixed_size True if we should always be at maximum height
+        @param always_show_scrollbar True if we should always show a
+                                     scrollbar
+        @param max_lines Number of lines to keep before dropping the oldest
+        """
+        Document.__init__(self, u'', width=width, height=height,
+                          is_fixed_size=is_fixed_size,
+                          always_show_scrollbar=always_show_scrollbar)
+        self.max_lines = max_lines
+        self.line_lengths = collections.deque()  # including line breaks
+        self.partial_length = 0  # of text after the last line break
+        self.pending = []
+        self.is_at_bottom = True
+        self.append(text)
+
+    def _flush_pending(self):
+        """
+        Inserts the text appended since the last update, and deletes the
+        oldest lines if we now have too many.
+        """
+        if not self.pending:
+            return
+        text = u''.join(self.pending)
+        self.pending = []
+        content, scrollbar = self.content, self.scrollbar
+        self.is_at_bottom = scrollbar is None or \
+                            scrollbar.pos >= 1.0 - scrollbar.bar_width
+        if content is not None:
+            old_height = content.content_height
+        self.document.insert_text(len(self.document.text), text)
+
+        pieces = text.split('\n')
+        length = self.partial_length + len(pieces[0])
+        for piece in pieces[1:]:
+            self.line_lengths.append(length + 1)
+            length = len(piece)
+        self.partial_length = length
+        trim = 0
+        while len(self.line_lengths) > self.max_lines:
+            trim += self.line_lengths.popleft()
+        removed = 0
+        if trim:
+            if content is not None:
+                removed = content.content_height
+            self.document.delete_text(0, trim)
+            if content is not None:
+                removed -= content.content_height
+
+        if content is None:
+            return  # we'll be sized soon enough
+        content_height = content.content_height
+        if self.max_height:
+            height = min(content_height, self.max_height)
+        else:
+            height = content_height
+        if (not self.is_fixed_size and height != self.height) or \
+           (scrollbar is None and height < content_height):
+            self.needs_layout = True
+        elif scrollbar is not None:
+            # Our size is unchanged, so only our scrollbar need be laid out
+            offset = scrollbar.get(self.max_height, old_height)
+            scrollbar.set(self.max_height, content_height)
+            if self.is_at_bottom:
+                scrollbar.pos = 1.0 - scrollbar.bar_width
+            else:
+                # Keep the same text in view as the lines above are dropped
+                scrollbar.pos = min(max(offset - removed, 0) /
+                                    float(max(content_height, 1)),
+                                    1.0 - scrollbar.bar_width)
+            self.saved_dialog.set_needs_layout(scrollbar)
+
+    def append(self, text):
+        """
+        Appends text to the end of our document.  Include a line break to
+        end each line.
+
+        @param text Text to append
+        """
+        if text:
+            self.pending.append(text)
+            self.start_updates()
+
+    def get_text(self):
+        self._flush_pending()
+        return Document.get_text(self)
+
+    def on_update(self, dt):
+        """
+        On updates, we insert whatever text was appended since the last.
+
+        @param dt Time passed since last update event (in seconds)
+        """
+        self._flush_pending()
+        Document.on_update(self, dt)
+
+    def set_text(self, text):
+        self.pending = []
+        self.line_lengths.clear()
+        self.partial_length = 0
+        Document.set_text(self, u'')
+        self.append(text)
+
+    def size(self, dialog):
+        if dialog is None:
+            return
+
+        # We may be sized because our scrollbar has been moved
+        scrollbar = self.scrollbar
+        if scrollbar is not None:
+            self.is_at_bottom = scrollbar.pos >= 1.0 - scrollbar.bar_width
+        self._flush_pending()
+        if self.content is not None and not self.is_fixed_size:
+            # Grow with our text, until we reach our maximum height
+            height = self.content.content_height
+            if self.max_height:
+                height = min(height, self.max_height)
+            self.height = self.content.height = height
+        Document.size(self, dialog)
+        scrollbar = self.scrollbar
+        if scrollbar is not None and self.is_at_bottom and \
+           scrollbar.pos < 1.0 - scrollbar.bar_width:
+            scrollbar.pos = 1.0
+            scrollbar.size(dialog)  # restyle its buttons for the bottom
+            scrollbar.set(self.max_height, self.content.content_height)
+        if self.pending:
+            self.start_updates()
+
+class PagedDocument(Document):
+    """
+    Shows text too long to lay out all at once, such as a large log file
+    or chat transcript.  The text is read from its source in chunks, one
+    each update or more as it is scrolled to, and only the lines around
+    those which can be seen are laid out, in a small document of their
+    own.  Until its source has been read to the end, our scrollbar is
+    sized to an estimate of its length.  Lines are assumed to be about as
+    tall as the first lines we lay out.
+    """
+    def __init__(self, source, width=1000, height=400,
+                 is_fixed_size=False, always_show_scrollbar=False,
+                 chunk_size=65536, margin=100, encoding='utf-8'):
+        """
+        Creates a new PagedDocument.
+
+        @param source The text to show: a string, an open file, or any
+                      iterable which yields strings, i.e. a generator
+        @param width Width of the document
+        @param height Maximum height of the document
+        @param is_fixed_size True if we should always be at maximum height
+        @param always_show_scrollbar True if we should always show a
+                                     scrollbar
+        @param chunk_size Number of characters to read from a file at once
+        @param margin Number of lines to lay out above and below those
+                      which can be seen
+        @param encoding Encoding of byte strings read from our source;
+                        unicode strings are used as they are
+        """
+        Document.__init__(self, pyglet.text.document.UnformattedDocument(),
+                          width=width, height=height,
+                          is_fixed_size=is_fixed_size,
+                          always_show_scrollbar=always_show_scrollbar)
+        self.chunk_size = chunk_size
+        self.margin = margin
+        self.encoding = encoding
+        self.line_height = None  # until we've laid out some lines
+        self._open_source(source)
+
+    def _get_estimated_height(self):
+        """
+        Returns how tall we would be if all our source were laid out.
+        """
+        return int(self._get_estimated_lines() * self._get_line_height())
+
+    def _get_estimated_lines(self):
+        """
+        Returns how many lines our source has, or if we have yet to read
+        all of it, an estimate based on how much of it we have read.
+        """
+        count = len(self.lines)
+        if self.is_exhausted:
+            return count
+        if self.source_size and self.size_read:
+            return max(int(count * float(self.source_size) / self.size_read),
+                       count + 1)
+        # Leave room to scroll on into what we have yet to read
+        return count + int(self.max_height / self._get_line_height()) + 1
+
+    def _get_line_height(self):
+        if self.line_height is not None:
+            return self.line_height
+        font = self.document.get_font()
+        return max(font.ascent - font.descent, 1)
+
+    def _open_source(self, source):
+        """
+        Forgets any text we have read, and prepares to read a new source.
+
+        @param source A string, an open file, or an iterable of strings
+        """
+        self.lines = []
+        self.partial = u''  # text read since the last line break
+        self.size_read = 0  # as our source measures it, i.e. in bytes
+        self.decoder = codecs.getincrementaldecoder(self.encoding)()
+        self.source_size = None
+        self.is_exhausted = False
+        self.first_line = self.last_line = 0  # lines within our document
+        self.line_starts = []  # their positions within our document
+        self.view_offset = None
+        chunk_size = self.chunk_size
+        if isinstance(source, basestring):
+            self.source_size = len(source)
+            self.reader = (source[i:i + chunk_size]
+                           for i in xrange(0, len(source), chunk_size))
+        elif hasattr(source, 'read'):
+            try:
+                self.source_size = os.fstat(source.fileno()).st_size
+            except (AttributeError, EnvironmentError, ValueError):
+                pass  # i.e. a StringIO or a pipe; we can't tell its size
+            self.reader = iter(lambda: source.read(chunk_size), '')
+        else:
+            self.reader = iter(source)
+
+    def _read_chunk(self):
+        """
+        Reads the next chunk of our source, and splits it into lines.
+
+        @returns False if there was nothing left to read
+        """
+        try:
+            chunk = self.reader.next()
+        except StopIteration:
+            self.is_exhausted = True
+            self.partial += self.decoder.decode('', True)
+            if self.partial:
+                self.lines.append(self.partial)
+                self.partial = u''
+            return False
+        self.size_read += len(chunk)
+        if isinstance(chunk, str):
+            # A character may be split between this chunk and the next
+            chunk = self.decoder.decode(chunk)
+        text = self.partial + chunk
+        if '\r' in text:
+            text = text.replace('\r\n', '\n')
+        lines = text.split('\n')
+        self.partial = lines.pop()
+        self.lines.extend(lines)
+        return True
+
+    def _read_lines(self, count):
+        """
+        Reads from our source until we have read a number of lines, or
+        there is nothing left to read.
+
+        @param count Number of lines wanted
+        """
+        while len(self.lines) < count and self._read_chunk():
+            pass
+
+    def _set_window(self, first, last):
+        """
+        Lays out a range of lines in our document.
+
+        @param first Index of the first line to be laid out
+        @param last Index after the last line to be laid out
+        """
+        lines = self.lines[first:last]
+        self.line_starts = []
+        position = 0
+        for line in lines:
+            self.line_starts.append(position)
+            position += len(line) + 1
+        self.first_line, self.last_line = first, last
+        self.document.text = u'\n'.join(lines)
+
+        # The first lines we lay out tell us how tall lines are likely to
+        # be, so we'll need to resize our scrollbar
+        if self.line_height is None and lines:
+            self.line_height = max(
+                float(self.content.content_height) / len(lines), 1.0)
+            self.needs_layout = True
+            self.start_updates()
+
+    def _update_view(self):
+        """
+        Lays out the lines around those our scrollbar has been moved to,
+        if they have not been already, and scrolls our document to them.
+        """
+        if self.content is None:
+            return  # we've been deleted
+        line_height = self._get_line_height()
+        offset = 0
+        if self.scrollbar is not None:
+            offset = self.scrollbar.get(self.max_height,
+                                        self._get_estimated_height())
+        if offset == self.view_offset:
+            return
+        scroll = float(offset) / line_height
+        top = int(scroll)
+        visible = int(self.height / line_height) + 2
+        self._read_lines(top + visible + self.margin)
+        count = len(self.lines)
+        if top >= count:
+            top = max(count - 1, 0)
+            scroll = top
+        if top < self.first_line or \
+           min(top + visible, count) > self.last_line:
+            self._set_window(max(top - self.margin, 0),
+                             min(top + visible + self.margin, count))
+        self.view_offset = offset
+        if not self.line_starts:
+            return
+
+        # Bring the top of the line we've scrolled to, plus however far
+        # we've scrolled into it, to the top of our view
+        position = self.line_starts[top - self.first_line]
+        line = self.content.lines[self.content.get_line_from_position(position)]
+        view_y = int(line.y + line.ascent - (scroll - top) * line_height)
+        if view_y != self.content.view_y:
+            self.content.view_y = view_y
+            MarkFrameDamaged()
+
+    def delete(self):
+        Document.delete(self)
+        self.stop_updates()  # until we're sized again
+        self.first_line = self.last_line = 0
+        self.line_starts = []
+        self.view_offset = None
+
+    def do_set_document_style(self, dialog):
+        # Our document is unformatted, so this is quick however long our
+        # source is
+        self.set_document_style = True
+        self.document.set_style(0, 0, {
+            'color': dialog.theme['text_color'],
+            'font_name': dialog.theme['font'],
+            'font_size': dialog.theme['font_size'],
+        })
+
+    def get_text(self):
+        """
+        Returns all our text, reading the rest of our source if need be.
+        """
+        if not self.is_exhausted:
+            while self._read_chunk():
+                pass
+            self.needs_layout = True  # to resize our scrollbar
+            self.start_updates()
+        return u'\n'.join(self.lines)
+
+    def on_update(self, dt):
+        """
+        Each update we read another chunk of our source, until we have
+        read all of it.
+
+        @param dt Time passed since last update event (in seconds)
+        """
+        if self.content is None:
+            self.stop_updates()  # we've been deleted
+            return
+
+        if not self.is_exhausted:
+            height = self._get_estimated_height()
+            self._read_chunk()
+            if self._get_estimated_height() != height:
+                self.needs_layout = True
+
+        if self.needs_layout:
+            self.needs_layout = False
+            self.saved_dialog.set_needs_layout(self)
+
+        if self.is_exhausted:
+            self.stop_updates()
+
+    def set_text(self, text):
+        """
+        Replaces our text with that of a new source.
+
+        @param text A string, an open file, or an iterable of strings
+        """
+        self._open_source(text)
+        self.document.text = u''
+        self.needs_layout = True
+        self.start_updates()
+
+    def size(self, dialog):
+        if dialog is None:
+            return
+
+        Control.size(self, dialog)
+        if not self.set_document_style:
+            self.do_set_document_style(dialog)
+        if self.content is None:
+            self.content = pyglet.text.layout.IncrementalTextLayout(
+                self.document,
+                self.content_width,
+                self.max_height,
+                multiline=True, batch=dialog.batch, group=dialog.fg_group)
+            self.view_offset = None
+        if self.line_height is None:
+            self._read_lines(int(self.max_height / self._get_line_height()))
+        estimated_height = self._get_estimated_height()
+        if self.is_fixed_size or estimated_height > self.max_height:
+            self.height = self.max_height
+        else:
+            self.height = estimated_height
+        if self.content.height != self.height:
+            self.content.height = self.height
+            self.view_offset = None
+        if self.always_show_scrollbar or estimated_height > self.max_height:
+            if self.scrollbar is None:
+                self.scrollbar = VScrollbar(self.max_height)
+                self.scrollbar.parent = self
+            self.scrollbar.size(dialog)
+            self.scrollbar.set(self.max_height, estimated_height)
+        if self.scrollbar is not None:
+            self.width = self.content_width + self.scrollbar.width
+        else:
+            self.width = self.content_width
+        if not self.is_exhausted or self.needs_layout:
+            self.start_updates()
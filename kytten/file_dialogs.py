@@ -1,8 +1,11 @@
 # kytten/file_dialogs.py
 # Copyrighted (C) 2009 by Conrad "Lynx" Wong
 
+import bisect
 import glob
 import os
+import Queue
+import threading
 import pyglet
 from pyglet import gl
 
@@ -11,21 +14,96 @@ from dialog import Dialog
 from frame import Frame, SectionHeader
 from layout import VerticalLayout, HorizontalLayout
 from layout import ANCHOR_CENTER, HALIGN_LEFT, VALIGN_BOTTOM
-from menu import Menu, Dropdown
+from menu import Menu, Dropdown, VirtualMenu, SpliceList
 from scrollable import Scrollable
 from text_input import Input
 from widgets import Label
 
+# Number of directory entries a DirectoryScan examines before handing
+# them back to the dialog
+DIRECTORY_SCAN_BATCH_SIZE = 256
+
+class DirectoryScan:
+    """
+    Lists a directory on a background thread.  Entries are handed back in
+    batches, so that a dialog can show what has been found so far while
+    the scan continues.
+    """
+    def __init__(self, path, get_entries,
+                 batch_size=DIRECTORY_SCAN_BATCH_SIZE):
+        """
+        Creates a new DirectoryScan and starts it running.
+
+        @param path The directory to be listed
+        @param get_entries Function which converts a list of filenames
+                           into a list of (menu text, filename) entries.
+                           It is called on the background thread.
+        @param batch_size Number of filenames to convert at a time
+        """
+        self.path = path
+        self.get_entries = get_entries
+        self.batch_size = batch_size
+        self.queue = Queue.Queue()
+        self.is_cancelled = False
+        self.is_done = False
+        self.thread = threading.Thread(target=self._run)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            names = [x for x in os.listdir(self.path)
+                     if not x.startswith('.')]  # as glob would do
+        except OSError:
+            names = []
+        for start in xrange(0, len(names), self.batch_size):
+            if self.is_cancelled:
+                return
+            filenames = [os.path.join(self.path, x)
+                         for x in names[start:start + self.batch_size]]
+            self.queue.put(self.get_entries(filenames))
+        self.queue.put(None)  # signals the end of the scan
+
+    def cancel(self):
+        """
+        Stops the scan as soon as it finishes its current batch.  No more
+        entries will be handed back.
+        """
+        self.is_cancelled = True
+
+    def get_entries_found(self):
+        """
+        Returns all entries found since we were last asked.  Once the
+        scan has completed, is_done will be set.
+        """
+        entries = []
+        while not self.is_cancelled:
+            try:
+                batch = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+            if batch is None:
+                self.is_done = True
+            else:
+                entries.extend(batch)
+        return entries
+
 class FileLoadDialog(Dialog):
     def __init__(self, path=os.getcwd(), extensions=[], title="Select File",
                  width=540, height=300, window=None, batch=None, group=None,
                  anchor=ANCHOR_CENTER, offset=(0, 0),
-                 theme=None, movable=True, on_select=None, on_escape=None):
+                 theme=None, movable=True, on_select=None, on_escape=None,
+                 scan_in_background=False):
         self.path = path
         self.extensions = extensions
         self.title = title
         self.on_select = on_select
         self.selected_file = None
+
+        # For very large directories or slow drives, we can list files on
+        # a background thread and show them as they are found
+        self.scan_in_background = scan_in_background
+        self.scan = None
         self._set_files()
 
         def on_parent_menu_select(choice):
@@ -38,8 +116,12 @@ class FileLoadDialog(Dialog):
                                  selected=self.parents[-1],
                                  align=VALIGN_BOTTOM,
                                  on_select=on_parent_menu_select)
-        self.menu = Menu(options=self.files, align=HALIGN_LEFT,
-                         on_select=on_menu_select)
+        if scan_in_background:
+            menu_class = VirtualMenu  # we may have a great many files
+        else:
+            menu_class = Menu
+        self.menu = menu_class(options=self.files, align=HALIGN_LEFT,
+                               on_select=on_menu_select)
         self.scrollable = Scrollable(
             VerticalLayout([self.dropdown, self.menu], align=HALIGN_LEFT),
             width=width, height=height)
@@ -69,9 +151,71 @@ class FileLoadDialog(Dialog):
             if self.on_select is not None:
                 self.on_select(filename)
 
+    def _add_files(self, entries):
+        """
+        Adds entries to our files, which are kept sorted by
+        _get_sort_key().  New files are merged in rather than sorting
+        all our files again.
+
+        @param entries List of (menu text, filename) entries
+        @returns List of (index, menu text) pairs for the new files, in
+                 order, each index being that of the file before which
+                 the new one was inserted, counted before any were
+        """
+        new_files = {}
+        for text, filename in entries:
+            if not self.files_dict.has_key(text):
+                new_files[text] = filename
+        if not new_files:
+            return []
+        self.files_dict.update(new_files)
+        new_keys = [self._get_sort_key(text) for text in new_files.iterkeys()]
+        new_keys.sort()
+        indices = [bisect.bisect(self.file_keys, key) for key in new_keys]
+        insertions = zip(indices, [key[-1] for key in new_keys])
+        self.file_keys = SpliceList(self.file_keys, zip(indices, new_keys))
+        self.files = SpliceList(self.files, insertions)
+        return insertions
+
+    def _get_entries(self, filenames):
+        """
+        Converts filenames into (menu text, filename) entries, leaving
+        out any files which don't match our extensions.
+
+        @param filenames List of filenames
+        """
+        files = [("%s (dir)" % os.path.basename(x), x) for x in filenames
+                 if os.path.isdir(x)]
+
+        # Now add the files that match the extensions
+        if self.extensions:
+            for filename in filenames:
+                if os.path.isfile(filename):
+                    ext = os.path.splitext(filename)[1]
+                    if ext in self.extensions:
+                        files.append((os.path.basename(filename), filename))
+        else:
+            files.extend([(os.path.basename(x), x) for x in filenames
+                          if os.path.isfile(x)])
+        return files
+
+    def _get_initial_entries(self):
+        return []
+
+    def _get_sort_key(self, text):
+        """
+        Returns the key by which a file's menu text is sorted, placing
+        directories before files.  The last part of the key is the text.
+
+        @param text Menu text of the file
+        """
+        return (not text.endswith(' (dir)'), text)
+
     def _set_files(self):
         # Once we have a new path, update our files
-        filenames = glob.glob(os.path.join(self.path, '*'))
+        if self.scan is not None:
+            self.scan.cancel()
+            self.scan = None
 
         # First, a list of directories
         self.parents = []
@@ -88,42 +232,42 @@ class FileLoadDialog(Dialog):
                 break
         self.parents.reverse()
 
-        files = [("%s (dir)" % os.path.basename(x), x) for x in filenames
-                 if os.path.isdir(x)]
-
-        # Now add the files that match the extensions
-        if self.extensions:
-            for filename in filenames:
-                if os.path.isfile(filename):
-                    ext = os.path.splitext(filename)[1]
-                    if ext in self.extensions:
-                        files.append((os.path.basename(filename), filename))
-        else:
-            files.extend([(os.path.basename(x), x) for x in filenames
-                          if os.path.isfile(x)])
-
         self.selected_file = None
-        self.files_dict = dict(files)
-        self.files = self.files_dict.keys()
-
-        def dir_sort(x, y):
-            if x.endswith(' (dir)') and y.endswith(' (dir)'):
-                return cmp(x, y)
-            elif x.endswith(' (dir)'):
-                return -1
-            elif y.endswith(' (dir)'):
-                return 1
-            else:
-                return cmp(x, y)
-        self.files.sort(dir_sort)
+        self.files = []
+        self.file_keys = []  # sort keys of our files, in order
+        self.files_dict = {}
+        if self.scan_in_background:
+            self._add_files(self._get_initial_entries())
+            self.scan = DirectoryScan(self.path, self._get_entries)
+        else:
+            filenames = glob.glob(os.path.join(self.path, '*'))
+            self._add_files(self._get_initial_entries() +
+                            self._get_entries(filenames))
 
     def get(self):
         return self.selected_file
 
+    def on_update(self, dt):
+        """
+        Adds any files our background scan has found to our menu.
+
+        @param dt Time passed since last update event (in seconds)
+        """
+        if self.scan is not None:
+            entries = self.scan.get_entries_found()
+            if entries:
+                self.menu.insert_options(self._add_files(entries))
+            if self.scan.is_done:
+                self.scan = None
+        Dialog.on_update(self, dt)
+
     def size(self, dialog):
         Dialog.size(self, dialog)
 
     def teardown(self):
+        if self.scan is not None:
+            self.scan.cancel()
+            self.scan = None
         self.on_select = None
         Dialog.teardown(self)
 
@@ -271,27 +415,8 @@ class DirectorySelectDialog(FileLoadDialog):
             if self.on_select is not None:
                 self.on_select(filename)
 
-    def _set_files(self):
-        # Once we have a new path, update our files
-        filenames = glob.glob(os.path.join(self.path, '*'))
-
-        # First, a list of directories
-        self.parents = []
-        self.parents_dict = {}
-        path = self.path
-        index = 1
-        while 1:
-            name = "%d %s" % (index, os.path.basename(path) or path)
-            self.parents_dict[name] = path
-            self.parents.append(name)
-            index += 1
-            path, child = os.path.split(path)
-            if not child:
-                break
-        self.parents.reverse()
-
-        files = [('(this dir)', self.path)] + \
-                [("%s (dir)" % os.path.basename(x), x) for x in filenames
+    def _get_entries(self, filenames):
+        files = [("%s (dir)" % os.path.basename(x), x) for x in filenames
                  if os.path.isdir(x)]
         # Now add the files that match the extensions
         if self.extensions:
@@ -304,20 +429,10 @@ class DirectorySelectDialog(FileLoadDialog):
         else:
             files.extend([('-%s' % os.path.basename(x), x) for x in filenames
                           if os.path.isfile(x)])
+        return files
 
-        self.selected_file = None
-        self.files_dict = dict(files)
-        self.files = self.files_dict.keys()
-
-        def dir_sort(x, y):
-            if x == '(this dir)':
-                return -1
-            elif x.endswith(' (dir)') and y.endswith(' (dir)'):
-                return cmp(x, y)
-            elif x.endswith(' (dir)') and y != '(this dir)':
-                return -1
-            elif y.endswith(' (dir)'):
-                return 1
-            else:
-                return cmp(x, y)
-        self.files.sort(dir_sort)
+    def _get_initial_entries(self):
+        return [('(this dir)', self.path)]
+
+    def _get_sort_key(self, text):
+        return (text != '(this dir)', not text.endswith(' (dir)'), text)
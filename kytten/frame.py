@@ -46,7 +46,7 @@ class Wrapper(Widget):
 
     def expand(self, width, height):
         if self.content.is_expandable():
-            self.content.expand(width, height)
+            self.content.expand_if_needed(width, height)
         self.width = width
         self.height = height
 
@@ -65,7 +65,7 @@ class Wrapper(Widget):
             x, y = GetRelativePoint(
                 self, self.anchor,
                 self.content, self.anchor, self.content_offset)
-            self.content.layout(x, y)
+            self.content.layout_if_needed(x, y)
 
     def set(self, dialog, content):
         """
@@ -77,7 +77,7 @@ class Wrapper(Widget):
         if self.content is not None:
             self.content.delete()
         self.content = content
-        dialog.set_needs_layout()
+        dialog.set_needs_layout(self)
 
     def size(self, dialog):
         """
@@ -89,7 +89,7 @@ class Wrapper(Widget):
             return
         Widget.size(self, dialog)
         if self.content is not None:
-            self.content.size(dialog)
+            self.content.size_if_needed(dialog, self)
             self.width, self.height = self.content.width, self.content.height
         else:
             self.width = self.height = 0
@@ -129,7 +129,7 @@ class Frame(Wrapper):
         if self.content.is_expandable():
             content_width, content_height = \
                          self.frame.get_content_size(width, height)
-            self.content.expand(content_width, content_height)
+            self.content.expand_if_needed(content_width, content_height)
         self.width, self.height = width, height
 
     def layout(self, x, y):
@@ -150,7 +150,7 @@ class Frame(Wrapper):
         interior.x, interior.y = x, y
         x, y = GetRelativePoint(interior, self.anchor,
                                 self.content, self.anchor, self.content_offset)
-        self.content.layout(x, y)
+        self.content.layout_if_needed(x, y)
 
     def size(self, dialog):
         """
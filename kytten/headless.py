@@ -0,0 +1,183 @@
+# kytten/headless.py
+# Copyrighted (C) 2009 by Conrad "Lynx" Wong
+
+# A measuring backend which lets Dialogs be sized and laid out without an
+# OpenGL context, i.e. for benchmarks or on machines without a GPU.
+#
+# HeadlessTheme: a Theme whose images are plain rectangles of a fixed size.
+# HeadlessLabel: stands in for KyttenLabel, using made-up font metrics.
+# HeadlessLoadFont: stands in for KyttenLoadFont, likewise.
+#
+# Call UseHeadlessBackend() before sizing any Dialog, and create Dialogs
+# with a HeadlessTheme.  Widgets which lay out text through pyglet's own
+# text layouts (Document and Input) are not supported.
+
+import button
+import checkbox
+import menu
+import widgets
+from theme import Theme, DEFAULT_THEME_SETTINGS
+
+# Besides the usual defaults, widgets look up a few settings which a real
+# theme gives only in the sections which need them
+HEADLESS_THEME_SETTINGS = dict(DEFAULT_THEME_SETTINGS)
+HEADLESS_THEME_SETTINGS.update({
+    "padding": [0, 0, 0, 0],
+    "offset": [0, 0],
+})
+
+class HeadlessGlyph:
+    def __init__(self, advance):
+        self.advance = advance
+
+class HeadlessFont:
+    """
+    Font metrics scaled from the font size, with every character given
+    the same advance.
+    """
+    def __init__(self, size):
+        size = size or DEFAULT_THEME_SETTINGS['font_size']
+        self.ascent = int(round(size * 0.8))
+        self.descent = -int(round(size * 0.25))
+        self.advance = int(round(size * 0.6))
+
+    def get_glyphs(self, text):
+        return [HeadlessGlyph(self.advance)] * len(text)
+
+class HeadlessDocument:
+    def __init__(self, font):
+        self.font = font
+
+    def get_font(self, position=None, dpi=None):
+        return self.font
+
+class HeadlessLabel(object):
+    """
+    Takes the same arguments as KyttenLabel, but only measures its text.
+    """
+    def __init__(self, text='', font_size=None, **kwargs):
+        self.document = HeadlessDocument(HeadlessFont(font_size))
+        self.font_size = font_size
+        self.x = kwargs.get('x', 0)
+        self.y = kwargs.get('y', 0)
+        self.text = text
+
+    def _get_text(self):
+        return self._text
+
+    def _set_text(self, text):
+        self._text = text
+        font = self.document.font
+        self.content_width = len(text) * font.advance
+        self.content_height = font.ascent - font.descent
+
+    text = property(_get_text, _set_text)
+
+    def delete(self):
+        pass
+
+    def set_style(self, font_name, font_size, color):
+        if font_size == self.font_size:
+            return False
+        self.document = HeadlessDocument(HeadlessFont(font_size))
+        self.font_size = font_size
+        self.text = self._text  # measure again
+        return True
+
+    def teardown(self):
+        pass
+
+def HeadlessLoadFont(name, size):
+    """
+    Takes the same arguments as KyttenLoadFont, but returns a HeadlessFont.
+    """
+    return HeadlessFont(size)
+
+class HeadlessGraphicElement:
+    """
+    Measures like a FrameTextureGraphicElement, but draws nothing.
+    """
+    def __init__(self, template):
+        self.x = self.y = 0
+        self.width, self.height = template.width, template.height
+        self.min_width, self.min_height = template.width, template.height
+        self.padding = template.padding
+        self.is_visible = True
+
+    def delete(self):
+        pass
+
+    def set_visible(self, is_visible):
+        self.is_visible = is_visible
+
+    def get_content_region(self):
+        left, right, top, bottom = self.padding
+        return (self.x + left, self.y + bottom,
+                self.width - left - right, self.height - top - bottom)
+
+    def get_content_size(self, width, height):
+        left, right, top, bottom = self.padding
+        return width - left - right, height - top - bottom
+
+    def get_needed_size(self, content_width, content_height):
+        left, right, top, bottom = self.padding
+        return (max(content_width + left + right, self.min_width),
+                max(content_height + top + bottom, self.min_height))
+
+    def update(self, x, y, width, height):
+        self.x, self.y, self.width, self.height = x, y, width, height
+
+class HeadlessGraphicElementTemplate:
+    def __init__(self, width, height, padding):
+        self.width = width
+        self.height = height
+        self.padding = padding
+        self.margins = padding
+
+    def generate(self, color, batch, group):
+        return HeadlessGraphicElement(self)
+
+    def regenerate(self, element, color, batch, group):
+        return element or HeadlessGraphicElement(self)
+
+class HeadlessTheme(Theme):
+    """
+    A Theme which needs no image files.  Every image, wherever it is
+    looked up, is a rectangle of the same size and padding, and every
+    other setting not given in override is taken from the defaults.
+    """
+    def __init__(self, override={}, image_size=(16, 16),
+                 padding=[4, 4, 4, 4]):
+        """
+        Creates a new HeadlessTheme.
+
+        @param override Replace some dictionary entries with these
+        @param image_size Width and height of every image
+        @param padding Left, right, top and bottom padding of every image
+        """
+        Theme.__init__(self, {}, override=override,
+                       default=HEADLESS_THEME_SETTINGS)
+        width, height = image_size
+        self.image_template = HeadlessGraphicElementTemplate(
+            width, height, padding)
+
+    def _get_missing(self, key):
+        if key.startswith('image'):
+            return self.image_template
+        else:
+            return self  # sections we lack use our own settings
+
+    def _get_texture(self, filename):
+        assert False, "HeadlessTheme cannot load textures"
+
+kytten_headless_modules = [button, checkbox, menu, widgets]
+
+def UseHeadlessBackend():
+    """
+    Makes the widgets which create labels create HeadlessLabels instead,
+    and those which measure text with fonts use HeadlessFonts.
+    This cannot be undone; use it in processes which never draw.
+    """
+    for module in kytten_headless_modules:
+        module.KyttenLabel = HeadlessLabel
+    menu.KyttenLoadFont = HeadlessLoadFont
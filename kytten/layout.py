@@ -6,13 +6,18 @@
 # VerticalLayout: a stack of Widgets, one on top of another.
 # HorizontalLayout: a row of Widgets, side by side.
 # GridLayout: a table of Widgets.
+# WindowedGridLayout: a GridLayout which only sizes and lays out the rows
+#                     which can currently be seen.
 # FreeLayout: an open area within which Widgets may be positioned freely,
 #             relative to one of its anchor points.
 
+import bisect
+
 import pyglet
 from pyglet import gl
 
 from widgets import Widget, Control, Spacer, Graphic, Label
+from widgets import MarkLayoutMovedControls
 
 # GUI layout constants
 
@@ -107,7 +112,7 @@ class VerticalLayout(Widget):
         @param item The Widget to be added
         """
         self.content.append(item or Spacer())
-        self.saved_dialog.set_needs_layout()
+        self.saved_dialog.set_needs_layout(self)
 
     def delete(self):
         """Deletes all graphic elements within the layout."""
@@ -124,10 +129,10 @@ class VerticalLayout(Widget):
         remainder = height - self.height - len(self.expandable) * available
         for item in self.expandable:
             if remainder > 0:
-                item.expand(item.width, item.height + available + 1)
+                item.expand_if_needed(item.width, item.height + available + 1)
                 remainder -= 1
             else:
-                item.expand(item.width, item.height + available)
+                item.expand_if_needed(item.width, item.height + available)
         self.height = height
         self.width = width
 
@@ -143,7 +148,7 @@ class VerticalLayout(Widget):
         """
         item.delete()
         self.content.remove(item)
-        self.saved_dialog.set_needs_layout()
+        self.saved_dialog.set_needs_layout(self)
 
     def layout(self, x, y):
         """
@@ -157,22 +162,22 @@ class VerticalLayout(Widget):
         # Expand any expandable content to our width
         for item in self.content:
             if item.is_expandable() and item.width < self.width:
-                item.expand(self.width, item.height)
+                item.expand_if_needed(self.width, item.height)
 
         top = y + self.height
         if self.align == HALIGN_RIGHT:
             for item in self.content:
-                item.layout(x + self.width - item.width,
-                            top - item.height)
+                item.layout_if_needed(x + self.width - item.width,
+                                      top - item.height)
                 top -= item.height + self.padding
         elif self.align == HALIGN_CENTER:
             for item in self.content:
-                item.layout(x + self.width/2 - item.width/2,
-                            top - item.height)
+                item.layout_if_needed(x + self.width/2 - item.width/2,
+                                      top - item.height)
                 top -= item.height + self.padding
         else: # HALIGN_LEFT
             for item in self.content:
-                item.layout(x, top - item.height)
+                item.layout_if_needed(x, top - item.height)
                 top -= item.height + self.padding
 
     def set(self, content):
@@ -183,7 +188,7 @@ class VerticalLayout(Widget):
         """
         self.delete()
         self.content = content
-        self.saved_dialog.set_needs_layout()
+        self.saved_dialog.set_needs_layout(self)
 
     def size(self, dialog):
         """
@@ -200,7 +205,7 @@ class VerticalLayout(Widget):
             height = -self.padding
         width = 0
         for item in self.content:
-            item.size(dialog)
+            item.size_if_needed(dialog, self)
             height += item.height + self.padding
             width = max(width, item.width)
         self.width, self.height = width, height
@@ -238,10 +243,10 @@ class HorizontalLayout(VerticalLayout):
         remainder = height - self.height - len(self.expandable) * available
         for item in self.expandable:
             if remainder > 0:
-                item.expand(item.width + available + 1, item.height)
+                item.expand_if_needed(item.width + available + 1, item.height)
                 remainder -= 1
             else:
-                item.expand(item.width + available, item.height)
+                item.expand_if_needed(item.width + available, item.height)
         self.width = width
 
     def layout(self, x, y):
@@ -256,20 +261,21 @@ class HorizontalLayout(VerticalLayout):
         # Expand any expandable content to our height
         for item in self.content:
             if item.is_expandable() and item.height < self.height:
-                item.expand(item.width, self.height)
+                item.expand_if_needed(item.width, self.height)
 
         left = x
         if self.align == VALIGN_TOP:
             for item in self.content:
-                item.layout(left, y + self.height - item.height)
+                item.layout_if_needed(left, y + self.height - item.height)
                 left += item.width + self.padding
         elif self.align == VALIGN_CENTER:
             for item in self.content:
-                item.layout(left, y + self.height/2 - item.height/2)
+                item.layout_if_needed(left,
+                                      y + self.height/2 - item.height/2)
                 left += item.width + self.padding
         else: # VALIGN_BOTTOM
             for item in self.content:
-                item.layout(left, y)
+                item.layout_if_needed(left, y)
                 left += item.width + self.padding
 
     def size(self, dialog):
@@ -287,7 +293,7 @@ class HorizontalLayout(VerticalLayout):
         else:
             width = -self.padding
         for item in self.content:
-            item.size(dialog)
+            item.size_if_needed(dialog, self)
             height = max(height, item.height)
             width += item.width + self.padding
         self.width, self.height = width, height
@@ -344,7 +350,7 @@ class GridLayout(Widget):
         assert isinstance(row, tuple) or isinstance(row, list)
         self.content.append(row)
         if self.saved_dialog is not None:
-            self.saved_dialog.set_needs_layout()
+            self.saved_dialog.set_needs_layout(self)
 
     def delete(self):
         """Deletes all graphic elements within the layout."""
@@ -366,7 +372,7 @@ class GridLayout(Widget):
             if column is not None:
                 column.delete()
         if self.saved_dialog is not None:
-            self.saved_dialog.set_needs_layout()
+            self.saved_dialog.set_needs_layout(self)
 
     def get(self, column, row):
         """
@@ -404,10 +410,11 @@ class GridLayout(Widget):
                 placement.width = self.max_widths[col_index]
                 if cell is not None:
                     if cell.is_expandable():
-                        cell.expand(placement.width, placement.height)
-                    cell.layout(*GetRelativePoint(placement, self.anchor,
-                                                  cell, self.anchor,
-                                                  self.offset))
+                        cell.expand_if_needed(placement.width,
+                                              placement.height)
+                    cell.layout_if_needed(*GetRelativePoint(
+                        placement, self.anchor, cell, self.anchor,
+                        self.offset))
                 placement.x += placement.width
                 col_index += 1
             row_index += 1
@@ -429,7 +436,7 @@ class GridLayout(Widget):
         if self.content[row][column] is not None:
             self.content[row][column].delete()
         self.content[row][column] = item
-        self.saved_dialog.set_needs_layout()
+        self.saved_dialog.set_needs_layout(self)
 
     def size(self, dialog):
         """Recalculates our size and the maximum widths and heights of
@@ -451,7 +458,7 @@ class GridLayout(Widget):
             col_index = 0
             for cell in row:
                 if cell is not None:
-                    cell.size(dialog)
+                    cell.size_if_needed(dialog, self)
                     width, height = cell.width, cell.height
                 else:
                     width = height = 0
@@ -480,6 +487,315 @@ class GridLayout(Widget):
         self.content = []
         Widget.teardown(self)
 
+class WindowedGridLayout(GridLayout):
+    """
+    A GridLayout for very long tables, i.e. within a Scrollable.  Only the
+    rows which can currently be seen, plus a few more on either side, are
+    sized and laid out; the cells of other rows have no graphic elements.
+
+    Rows may be given a fixed height.  Otherwise each row's height is
+    remembered once it has been seen, and rows not yet seen are assumed
+    to be as tall as the first row measured.  Column widths are the widest
+    cells seen so far, unless given.  The offset of each row from our top
+    is kept as a running sum, so finding the row at a point is O(log n).
+    """
+    def __init__(self, content=[[]], anchor=ANCHOR_TOP_LEFT, padding=5,
+                 offset=(0, 0), row_height=None, column_widths=None,
+                 overscan=4):
+        """
+        Defines a new WindowedGridLayout.
+
+        @param content A list of rows, each of which is a list of cells
+                       within that row.  'None' may be used for empty cells,
+                       and rows do not need to all be the same length.
+        @param anchor Alignment of Widgets within their cells
+        @param padding Space between rows and columns
+        @param offset Offset of Widgets from their anchor points
+        @param row_height Height of every row, or None to measure each row
+                          when it is first seen
+        @param column_widths List of widths of each column, or None to use
+                             the widest cells seen so far
+        @param overscan Number of rows to keep on either side of those
+                        which can be seen
+        """
+        GridLayout.__init__(self, content=content, anchor=anchor,
+                            padding=padding, offset=offset)
+        self.row_height = row_height
+        self.column_widths = column_widths
+        self.overscan = overscan
+        self.measured_heights = []  # None for rows not yet seen
+        self.estimated_height = None
+        self.row_offsets = [0]
+        self.needs_offsets = True
+        self.first_row = self.last_row = 0  # rows we have sized
+
+    def _get_controls(self):
+        """
+        Returns Controls within the rows we have laid out.
+        """
+        controls = []
+        for row in self.content[self.first_row:self.last_row]:
+            for cell in row:
+                if cell is not None:
+                    controls += cell._get_controls()
+        return controls
+
+    def _get_row_height(self, index):
+        """
+        Returns the height of a row, including padding.
+
+        @param index Index of the row
+        """
+        if self.row_height is not None:
+            return self.row_height + self.padding
+        height = self.measured_heights[index]
+        if height is None:
+            return self.estimated_height or self.padding
+        return height
+
+    def _get_visible_rows(self):
+        """
+        Returns the range of row indices which lie within the region our
+        container shows, plus our overscan.
+        """
+        count = len(self.content)
+        get_view_region = getattr(self.saved_dialog, 'get_view_region', None)
+        if get_view_region is None:
+            return 0, count
+        view_x, view_y, view_width, view_height = get_view_region()
+        top = self.y + self.height
+        first = self.get_row_at(top - view_y - view_height) - self.overscan
+        last = self.get_row_at(top - view_y) + 1 + self.overscan
+        return max(first, 0), min(last, count)
+
+    def _hide_row(self, index):
+        """
+        Deletes the graphic elements of a row which has left the view.
+        Its cells will be sized from scratch if it comes back.
+
+        @param index Index of the row
+        """
+        for cell in self.content[index]:
+            if cell is not None:
+                cell.delete()
+                cell.natural_size = None
+
+    def _size_row(self, index, dialog):
+        """
+        Sizes the cells of a row, and widens our columns to fit them.
+
+        @param index Index of the row
+        @param dialog The Dialog within which we are contained
+        @returns True if the row's height or a column's width changed
+        """
+        row = self.content[index]
+        if len(self.max_widths) < len(row):
+            self.max_widths += \
+                [self.padding] * (len(row) - len(self.max_widths))
+        changed = False
+        max_height = self.padding
+        col_index = 0
+        for cell in row:
+            if cell is not None:
+                cell.size_if_needed(dialog, self)
+                max_height = max(max_height, cell.height + self.padding)
+                if self.column_widths is None:
+                    width = cell.width + self.padding
+                    if width > self.max_widths[col_index]:
+                        self.max_widths[col_index] = width
+                        changed = True
+            col_index += 1
+        if self.row_height is None and \
+           self.measured_heights[index] != max_height:
+            self.measured_heights[index] = max_height
+            if self.estimated_height is None:
+                self.estimated_height = max_height
+            self.needs_offsets = True
+            changed = True
+        return changed
+
+    def _update_offsets(self):
+        """
+        Recalculates the running sum of row heights, if any have changed.
+        """
+        count = len(self.content)
+        if len(self.measured_heights) != count:
+            self.measured_heights = (self.measured_heights +
+                                     [None] * count)[:count]
+            self.needs_offsets = True
+        if not self.needs_offsets:
+            return
+        offsets = [0]
+        total = 0
+        for index in xrange(count):
+            total += self._get_row_height(index)
+            offsets.append(total)
+        self.row_offsets = offsets
+        self.needs_offsets = False
+
+    def add_row(self, row):
+        """
+        Adds a new row to the end of the layout
+
+        @param row An array of widgets, or None for cells without widgets
+        """
+        self.measured_heights.append(None)
+        self.needs_offsets = True
+        GridLayout.add_row(self, row)
+
+    def delete(self):
+        """Deletes all graphic elements within the rows we laid out."""
+        for index in xrange(self.first_row, self.last_row):
+            self._hide_row(index)
+        self.first_row = self.last_row = 0
+        stop_watching_view = getattr(self.saved_dialog,
+                                     'stop_watching_view', None)
+        if stop_watching_view is not None:
+            stop_watching_view(self)
+        Widget.delete(self)
+
+    def delete_row(self, row):
+        """
+        Deletes a row from the layout
+
+        @param row Index of row
+        """
+        if len(self.content) <= row:
+            return
+        self.delete()  # the rows we laid out will be renumbered
+        self.measured_heights.pop(row)
+        self.needs_offsets = True
+        GridLayout.delete_row(self, row)
+
+    def ensure_row_visible(self, row):
+        """
+        Asks our container to scroll so that a row can be seen.
+
+        @param row Index of row
+        """
+        if self.saved_dialog is None or row >= len(self.content):
+            return
+        self._update_offsets()
+        top = self.y + self.height
+        area = Widget(self.width, self._get_row_height(row))
+        area.x, area.y = self.x, top - self.row_offsets[row + 1]
+        self.saved_dialog.ensure_visible(area)
+
+    def get_row_at(self, offset):
+        """
+        Returns the index of the row at a distance below our top.
+
+        @param offset Distance below our top edge
+        """
+        index = bisect.bisect_right(self.row_offsets, offset) - 1
+        return min(max(index, 0), max(len(self.content) - 1, 0))
+
+    def get_row_offset(self, row):
+        """
+        Returns the distance of a row's top edge below our top.
+
+        @param row Index of row
+        """
+        self._update_offsets()
+        return self.row_offsets[min(row, len(self.content))]
+
+    def layout(self, x, y):
+        """
+        Sizes any rows which have come into view, and lays out all rows
+        which can be seen.
+
+        @param x X coordinate of lower left corner
+        @param y Y coordinate of lower left corner
+        """
+        Widget.layout(self, x, y)
+        self._update_offsets()
+        first, last = self._get_visible_rows()
+
+        changed = False
+        for index in xrange(self.first_row, self.last_row):
+            if index < first or index >= last:
+                self._hide_row(index)
+        for index in xrange(first, last):
+            if index < self.first_row or index >= self.last_row:
+                changed = self._size_row(index, self.saved_dialog) or changed
+        self.first_row, self.last_row = first, last
+
+        # Rows seen for the first time may not be the size we guessed; if
+        # so we'll need to be sized again, though we place them for now
+        if changed and self.saved_dialog is not None:
+            self.saved_dialog.set_needs_layout(self)
+        self._update_offsets()
+
+        placement = Widget()
+        top = y + self.height
+        for index in xrange(first, last):
+            placement.x = x
+            placement.height = self._get_row_height(index)
+            placement.y = top - self.row_offsets[index] - placement.height
+            col_index = 0
+            for cell in self.content[index]:
+                placement.width = self.max_widths[col_index]
+                if cell is not None:
+                    if cell.is_expandable():
+                        cell.expand_if_needed(placement.width,
+                                              placement.height)
+                    cell.layout_if_needed(*GetRelativePoint(
+                        placement, self.anchor, cell, self.anchor,
+                        self.offset))
+                placement.x += placement.width
+                col_index += 1
+
+    def on_view_changed(self):
+        """
+        Our container has been scrolled.  If rows have come into view, or
+        gone out of it, we lay out our rows again.
+        """
+        if (self.first_row, self.last_row) != self._get_visible_rows():
+            self.layout(self.x, self.y)
+            MarkLayoutMovedControls()
+
+    def size(self, dialog):
+        """Sizes the rows we laid out last time, and recalculates our size
+        from the heights of all rows and the widths of all columns.
+
+        @param dialog The Dialog within which we are contained
+        """
+        if dialog is None:
+            return
+        Widget.size(self, dialog)
+        watch_view = getattr(dialog, 'watch_view', None)
+        if watch_view is not None:
+            watch_view(self)
+        self._update_offsets()
+        if self.column_widths is not None:
+            self.max_widths = [width + self.padding
+                               for width in self.column_widths]
+        for index in xrange(self.first_row,
+                            min(self.last_row, len(self.content))):
+            self._size_row(index, dialog)
+        self._update_offsets()
+        if self.max_widths:
+            self.width = sum(self.max_widths) - self.padding
+        else:
+            self.width = 0
+        if self.content:
+            self.height = self.row_offsets[-1] - self.padding
+        else:
+            self.height = 0
+
+    def teardown(self):
+        for row in self.content:
+            for cell in row:
+                if cell is not None:
+                    cell.teardown()
+        self.content = []
+        self.first_row = self.last_row = 0
+        stop_watching_view = getattr(self.saved_dialog,
+                                     'stop_watching_view', None)
+        if stop_watching_view is not None:
+            stop_watching_view(self)
+        Widget.teardown(self)
+
 class FreeLayout(Spacer):
     """
     FreeLayout defines a rectangle on the screen where Widgets may be placed
@@ -525,7 +841,7 @@ class FreeLayout(Spacer):
         @param widget The Widget to be added
         """
         self.content.append( (anchor, x, y, widget) )
-        self.saved_dialog.set_needs_layout()
+        self.saved_dialog.set_needs_layout(self)
 
     def layout(self, x, y):
         """
@@ -539,7 +855,7 @@ class FreeLayout(Spacer):
         for anchor, offset_x, offset_y, widget in self.content:
             x, y = GetRelativePoint(self, anchor, widget, anchor,
                                     (offset_x, offset_y))
-            widget.layout(x, y)
+            widget.layout_if_needed(x, y)
 
     def remove(self, dialog, widget):
         """
@@ -560,7 +876,7 @@ class FreeLayout(Spacer):
             return
         Spacer.size(self, dialog)
         for anchor, offset_x, offset_y, widget in self.content:
-            widget.size(dialog)
+            widget.size_if_needed(dialog, self)
 
     def teardown(self):
         for _, _, _, item in self.content:
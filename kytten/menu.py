@@ -1,18 +1,38 @@
 # kytten/menu.py
 # Copyrighted (C) 2009 by Conrad "Lynx" Wong
 
+import bisect
+
 import pyglet
 
-from widgets import Widget, Control
-from dialog import Dialog
+from widgets import Widget, Control, MarkLayoutMovedControls
+from dialog import Dialog, GetWidgetOffset
 from frame import Frame
 from layout import GetRelativePoint, VerticalLayout
 from layout import ANCHOR_CENTER, ANCHOR_TOP_LEFT, ANCHOR_BOTTOM_LEFT
 from layout import HALIGN_CENTER
 from layout import VALIGN_TOP, VALIGN_CENTER, VALIGN_BOTTOM
-from override import KyttenLabel
+from override import KyttenLabel, KyttenLoadFont
 from scrollable import Scrollable
 
+def SpliceList(items, insertions):
+    """
+    Returns a new list of items, with new items inserted among them.
+
+    @param items List of items
+    @param insertions List of (index, item) pairs, in order, each index
+                      being that of the item before which the new one is
+                      to be inserted, counted before any are inserted
+    """
+    spliced = []
+    last = 0
+    for index, item in insertions:
+        spliced.extend(items[last:index])
+        spliced.append(item)
+        last = index
+    spliced.extend(items[last:])
+    return spliced
+
 class MenuOption(Control):
     """
     MenuOption is a choice within a menu.  When selected, it inverts
@@ -72,21 +92,20 @@ class MenuOption(Control):
     def on_lose_highlight(self):
         Control.on_lose_highlight(self)
         if self.highlight is not None:
-            self.highlight.delete()
-            self.highlight = None
+            self.highlight.set_visible(False)
 
     def on_mouse_release(self, x, y, button, modifiers):
         self.menu.select(self.text)
 
+    def _restyle(self):
+        pass  # size() restyles our graphic elements in place
+
     def select(self):
         if self.is_disabled():
             return  # disabled options can't be selected
 
         self.is_selected = True
-        if self.label is not None:
-            self.label.delete()
-            self.label = None
-        self.saved_dialog.set_needs_layout()
+        self.saved_dialog.set_needs_layout(self)
 
     def size(self, dialog):
         if dialog is None:
@@ -96,45 +115,52 @@ class MenuOption(Control):
             path = ['menuoption', 'selection']
         else:
             path = ['menuoption']
+        if self.is_disabled():
+            color = dialog.theme[path]['disabled_color']
+        else:
+            color = dialog.theme[path]['text_color']
         if self.label is None:
-            if self.is_disabled():
-                color = dialog.theme[path]['disabled_color']
-            else:
-                color = dialog.theme[path]['text_color']
             self.label = KyttenLabel(self.text,
                 color=color,
                 font_name=dialog.theme[path]['font'],
                 font_size=dialog.theme[path]['font_size'],
                 batch=dialog.batch,
                 group=dialog.fg_group)
+            is_resized = True
+        else:
+            is_resized = self.label.set_style(dialog.theme[path]['font'],
+                                              dialog.theme[path]['font_size'],
+                                              color)
+        if is_resized:
             font = self.label.document.get_font()
             self.width = self.label.content_width
             self.height = font.ascent - font.descent
 
-        if self.background is None:
-            if self.is_selected:
-                self.background = \
-                    dialog.theme[path]['highlight']['image'].generate(
-                        dialog.theme[path]['gui_color'],
-                        dialog.batch,
-                        dialog.bg_group)
-        if self.highlight is None:
-            if self.is_highlight():
-                self.highlight = \
-                    dialog.theme[path]['highlight']['image'].generate(
-                        dialog.theme[path]['highlight_color'],
-                        dialog.batch,
-                        dialog.highlight_group)
+        # Our background and highlight are hidden rather than deleted
+        # when not needed, so that selecting or pointing at options
+        # need not allocate new vertex lists
+        if self.is_selected:
+            self.background = \
+                dialog.theme[path]['highlight']['image'].regenerate(
+                    self.background,
+                    dialog.theme[path]['gui_color'],
+                    dialog.batch,
+                    dialog.bg_group)
+            self.background.set_visible(True)
+        elif self.background is not None:
+            self.background.set_visible(False)
+        if self.is_highlight():
+            self.highlight = \
+                dialog.theme[path]['highlight']['image'].regenerate(
+                    self.highlight,
+                    dialog.theme[path]['highlight_color'],
+                    dialog.batch,
+                    dialog.highlight_group)
+            self.highlight.set_visible(True)
 
     def unselect(self):
         self.is_selected = False
-        if self.label is not None:
-            self.label.delete()
-            self.label = None
-        if self.background is not None:
-            self.background.delete()
-            self.background = None
-        self.saved_dialog.set_needs_layout()
+        self.saved_dialog.set_needs_layout(self)
 
     def teardown(self):
         self.menu = None
@@ -195,12 +221,283 @@ class Menu(VerticalLayout):
         menu_options = self._make_options(options)
         self.options = dict(zip(options, menu_options))
         self.set(menu_options)
-        self.saved_dialog.set_needs_layout()
+        self.saved_dialog.set_needs_layout(self)
 
     def teardown(self):
         self.on_select = None
         VerticalLayout.teardown(self)
 
+class VirtualMenu(Widget):
+    """
+    VirtualMenu presents the same choices as a Menu, but only creates
+    MenuOptions for the entries which can currently be seen, plus a few
+    more on either side.  As we are scrolled, options which leave the view
+    are reused for those which come into it.  Place a VirtualMenu within a
+    Scrollable to present very long lists of options.
+    """
+    def __init__(self, options=[], align=HALIGN_CENTER, padding=4,
+                 on_select=None, overscan=4):
+        """
+        Creates a new VirtualMenu.
+
+        @param options List of option texts.  Options beginning with '-'
+                       are disabled.
+        @param align Horizontal alignment of the option texts
+        @param padding Vertical space between options
+        @param on_select Callback for when an option is selected
+        @param overscan Number of options to keep on either side of
+                        those which can be seen
+        """
+        Widget.__init__(self)
+        self.align = align
+        self.padding = padding
+        self.on_select = on_select
+        self.overscan = overscan
+        self.selected = None
+        self.font = None
+        self.row_height = 0
+        self.content_width = 0
+        self.rows = {}  # index of option -> MenuOption
+        self.first_row = self.last_row = 0  # range of rows laid out
+        self._set_option_texts(options)
+
+    def _get_controls(self):
+        controls = []
+        for index in sorted(self.rows.keys()):
+            controls += self.rows[index]._get_controls()
+        return controls
+
+    def _get_visible_rows(self):
+        """
+        Returns the range of option indices which lie within the region
+        our container shows, plus our overscan.
+        """
+        count = len(self.texts)
+        step = self.row_height + self.padding
+        get_view_region = getattr(self.saved_dialog, 'get_view_region', None)
+        if get_view_region is None or step <= 0:
+            return 0, count
+        view_x, view_y, view_width, view_height = get_view_region()
+        top = self.y + self.height
+        first = int((top - view_y - view_height) / step) - self.overscan
+        last = int((top - view_y) / step) + 1 + self.overscan
+        return max(first, 0), min(last, count)
+
+    def _make_row(self, index, spares):
+        """
+        Creates a MenuOption for an option, reusing one of the spare
+        MenuOptions if possible.
+
+        @param index Index of the option
+        @param spares List of MenuOptions which are no longer in view
+        """
+        text = self.texts[index]
+        disabled = self.disabled[index]
+        if spares and not disabled and text != self.selected:
+            option = spares.pop()
+            option.text = text
+            option.label.text = text
+        else:
+            option = MenuOption(text,
+                                anchor=(VALIGN_CENTER, self.align),
+                                menu=self,
+                                disabled=disabled)
+            option.is_selected = (text == self.selected)
+            option.parent = self
+            option.size(self.saved_dialog)
+        return option
+
+    def _get_index(self, text):
+        """
+        Returns the index of an option, or None if we have no such option.
+
+        @param text Text of the option
+        """
+        if self.indices is None:
+            self.indices = {}
+            for index, option in enumerate(self.texts):
+                self.indices[option] = index
+        return self.indices.get(text)
+
+    def _measure_texts(self, texts):
+        """
+        Returns the width of the widest of some option texts.
+
+        @param texts List of option texts
+        """
+        content_width = 0
+        for text in texts:
+            width = 0
+            for glyph in self.font.get_glyphs(text):
+                width += glyph.advance
+            content_width = max(content_width, width)
+        return content_width
+
+    def _set_option_texts(self, options):
+        self.texts = []
+        self.disabled = []
+        for option in options:
+            if option.startswith('-'):
+                disabled = True
+                option = option[1:]
+            else:
+                disabled = False
+            self.texts.append(option)
+            self.disabled.append(disabled)
+        self.indices = None  # until we look an option up
+        self.font = None  # we'll need to measure the texts again
+
+    def delete(self):
+        for option in self.rows.itervalues():
+            option.teardown()
+        self.rows = {}
+        self.first_row = self.last_row = 0
+        stop_watching_view = getattr(self.saved_dialog,
+                                     'stop_watching_view', None)
+        if stop_watching_view is not None:
+            stop_watching_view(self)
+
+    def expand(self, width, height):
+        self.width = width
+        self.height = height
+
+    def get_value(self):
+        return self.selected
+
+    def insert_options(self, insertions):
+        """
+        Inserts new options among those we have, without changing which
+        is selected.  Only the new options are measured.
+
+        @param insertions List of (index, option text) pairs, in order, each
+                          index being that of the option before which the
+                          new one is to be inserted, counted before any are
+                          inserted.  Options beginning with '-' are
+                          disabled.
+        """
+        if not insertions:
+            return
+        indices = [index for index, option in insertions]
+        texts = []
+        disabled = []
+        for index, option in insertions:
+            if option.startswith('-'):
+                disabled.append((index, True))
+                option = option[1:]
+            else:
+                disabled.append((index, False))
+            texts.append((index, option))
+        self.texts = SpliceList(self.texts, texts)
+        self.disabled = SpliceList(self.disabled, disabled)
+        self.indices = None
+
+        # The options we have made move down past those inserted above them
+        rows = {}
+        for index, option in self.rows.iteritems():
+            rows[index + bisect.bisect_right(indices, index)] = option
+        self.rows = rows
+
+        if self.font is not None:
+            self.content_width = max(
+                self.content_width,
+                self._measure_texts([option for index, option in texts]))
+        if self.saved_dialog is not None:
+            self.saved_dialog.set_needs_layout(self)
+
+    def is_expandable(self):
+        return True
+
+    def is_input(self):
+        return True
+
+    def layout(self, x, y):
+        Widget.layout(self, x, y)
+        first, last = self._get_visible_rows()
+        self.first_row, self.last_row = first, last
+
+        # Options which are no longer in view may be reused, unless they
+        # are drawn differently from a plain option or the user is
+        # pointing at them
+        spares = []
+        for index in self.rows.keys():
+            if index < first or index >= last:
+                option = self.rows.pop(index)
+                if option.label is None or option.is_selected or \
+                   option.is_disabled() or option.is_highlight() or \
+                   option.is_focus():
+                    option.teardown()
+                else:
+                    spares.append(option)
+        for index in xrange(first, last):
+            if not self.rows.has_key(index):
+                self.rows[index] = self._make_row(index, spares)
+        for option in spares:
+            option.teardown()
+
+        top = y + self.height
+        step = self.row_height + self.padding
+        for index, option in self.rows.iteritems():
+            option.expand(self.width, self.row_height)
+            option.layout(x, top - index * step - self.row_height)
+
+    def on_view_changed(self):
+        """
+        Our container has been scrolled.  If options have come into view,
+        or gone out of it, we lay out our options again.
+        """
+        if (self.first_row, self.last_row) != self._get_visible_rows():
+            self.layout(self.x, self.y)
+            MarkLayoutMovedControls()
+
+    def select(self, text):
+        index = self._get_index(text)
+        if index is None:
+            return
+
+        if self.selected is not None:
+            option = self.rows.get(self._get_index(self.selected))
+            if option is not None:
+                option.unselect()
+        self.selected = text
+        option = self.rows.get(index)
+        if option is not None:
+            option.select()
+
+        if self.on_select is not None:
+            self.on_select(text)
+
+    def set_options(self, options):
+        self.delete()
+        self.selected = None
+        self._set_option_texts(options)
+        self.saved_dialog.set_needs_layout(self)
+
+    def size(self, dialog):
+        if dialog is None:
+            return
+        Widget.size(self, dialog)
+        watch_view = getattr(dialog, 'watch_view', None)
+        if watch_view is not None:
+            watch_view(self)
+        if self.font is None:
+            # Measure our options without creating labels for them
+            self.font = KyttenLoadFont(
+                dialog.theme['menuoption']['font'],
+                dialog.theme['menuoption']['font_size'])
+            self.row_height = self.font.ascent - self.font.descent
+            self.content_width = self._measure_texts(self.texts)
+        for option in self.rows.itervalues():
+            option.size(dialog)
+        count = len(self.texts)
+        self.width = self.content_width
+        self.height = count * self.row_height + \
+                      max(count - 1, 0) * self.padding
+
+    def teardown(self):
+        self.on_select = None
+        self.delete()
+        Widget.teardown(self)
+
 class Dropdown(Control):
     def __init__(self, options=[], selected=None, id=None,
                  max_height=400, align=VALIGN_TOP, on_select=None,
@@ -259,7 +556,7 @@ class Dropdown(Control):
                 self.label.delete()
                 self.label = None
             self._delete_pulldown_menu()
-            self.saved_dialog.set_needs_layout()
+            self.saved_dialog.set_needs_layout(self)
 
             if self.on_select is not None:
                 if self.id is not None:
@@ -267,20 +564,24 @@ class Dropdown(Control):
                 else:
                     self.on_select(choice)
 
-        # We'll need the root window to get window size
+        # We'll need the root window to get window size, and to know how
+        # far we have been moved or scrolled since we were laid out
         width, height = root.window.get_size()
+        offset_x, offset_y = GetWidgetOffset(self)
+        left = self.x + offset_x
+        bottom = self.y + offset_y
 
         # Calculate the anchor point and location for the dialog
         if self.align == VALIGN_TOP:
             # Dropdown is at the top, pulldown appears below it
             anchor = ANCHOR_TOP_LEFT
-            x = self.x
-            y = -(height - self.y - 1)
+            x = left
+            y = -(height - bottom - 1)
         else:
             # Dropdown is at the bottom, pulldown appears above it
             anchor = ANCHOR_BOTTOM_LEFT
-            x = self.x
-            y = self.y + self.height + 1
+            x = left
+            y = bottom + self.height + 1
 
         # Now to setup the dialog
         self.pulldown_menu = Dialog(
@@ -310,7 +611,7 @@ class Dropdown(Control):
         self.delete()
         self.options = options
         self.selected = selected or self.options[0]
-        self.saved_dialog.set_needs_layout()
+        self.saved_dialog.set_needs_layout(self)
 
     def size(self, dialog):
         if dialog is None:
@@ -29,13 +29,226 @@ def ReleaseKyttenLayoutGroups(group):
         del KYTTEN_LAYOUT_GROUP_REFCOUNTS[group]
         del KYTTEN_LAYOUT_GROUPS[group]
 
+class KyttenBatch(pyglet.graphics.Batch):
+    """
+    A Batch which keeps the draw list of each group's subtree, and only
+    rebuilds, and re-sorts the children of, the groups which have changed.
+    A group changes when a vertex list is first added to it in a new
+    domain, or when it is invalidated, i.e. by a Dialog which has been
+    raised or torn down.  Setting _draw_list_dirty still rebuilds the
+    whole draw list, as for any Batch.
+
+    Groups whose is_visible attribute is False are left out of the draw
+    list, along with their children, until they are shown and invalidated
+    again.  Children are only re-sorted when groups are added among them,
+    or their parent is invalidated itself, so hiding or showing one of
+    many children costs little.
+    """
+    def __init__(self):
+        pyglet.graphics.Batch.__init__(self)
+        self.group_draw_lists = {}
+        self.dirty_groups = set()
+        self.unsorted_groups = set()
+
+    def _add_group(self, group):
+        pyglet.graphics.Batch._add_group(self, group)
+        self.unsorted_groups.add(group.parent)
+
+    def _get_domain(self, indexed, mode, group, formats):
+        was_dirty = self._draw_list_dirty
+        self._draw_list_dirty = False
+        domain = pyglet.graphics.Batch._get_domain(
+            self, indexed, mode, group, formats)
+        if self._draw_list_dirty:
+            self.invalidate_group(group or pyglet.graphics.null_group)
+        self._draw_list_dirty = was_dirty
+        return domain
+
+    def _update_draw_list(self):
+        if self._draw_list_dirty:
+            self.group_draw_lists.clear()
+            self.unsorted_groups.update(self.group_children.keys())
+        self._draw_list = []
+        self.top_groups.sort()
+        for group in list(self.top_groups):
+            self._draw_list.extend(self._visit(group))
+        self.dirty_groups.clear()
+        self.unsorted_groups.clear()
+        self._draw_list_dirty = False
+
+    def _visit(self, group):
+        """
+        Returns the draw list of a group and its children, rebuilding it
+        only if the group has changed.  Domains and groups which have
+        become empty are removed from the batch, as by Batch.
+        """
+        if not getattr(group, 'is_visible', True):
+            return []
+        if group not in self.dirty_groups and \
+           self.group_draw_lists.has_key(group):
+            return self.group_draw_lists[group]
+
+        draw_list = []
+        domain_map = self.group_map[group]
+        for key, domain in domain_map.items():
+            if domain._is_empty():
+                del domain_map[key]
+                continue
+            formats, mode, indexed = key
+            draw_list.append((lambda d, m: lambda: d.draw(m))(domain, mode))
+        children = self.group_children.get(group)
+        if children:
+            if group in self.unsorted_groups:
+                children.sort()
+            for child in list(children):
+                draw_list.extend(self._visit(child))
+
+        if children or domain_map:
+            draw_list = [group.set_state] + draw_list + [group.unset_state]
+            self.group_draw_lists[group] = draw_list
+            return draw_list
+
+        # Remove unused group from batch
+        del self.group_map[group]
+        if self.group_draw_lists.has_key(group):
+            del self.group_draw_lists[group]
+        if group.parent:
+            self.group_children[group.parent].remove(group)
+        if self.group_children.has_key(group):
+            del self.group_children[group]
+        if group in self.top_groups:
+            self.top_groups.remove(group)
+        return []
+
+    def draw(self):
+        if self._draw_list_dirty or self.dirty_groups:
+            self._update_draw_list()
+        for func in self._draw_list:
+            func()
+
+    def invalidate_group(self, group, descendants=False):
+        """
+        Marks a group, and each group containing it, as needing its draw
+        list rebuilt before we are next drawn.
+
+        @param group The group which has changed, or None if only the
+                     order of the top groups has
+        @param descendants True if the groups within the group have also
+                           changed, i.e. had their vertex lists deleted
+        """
+        if group is None:
+            self.dirty_groups.add(None)  # just re-sort the top groups
+        elif descendants:
+            for child in self.group_children.get(group, []):
+                self.invalidate_group(child, descendants=True)
+        self.unsorted_groups.add(group)
+        while group is not None and group not in self.dirty_groups:
+            self.dirty_groups.add(group)
+            group = group.parent
+
+def InvalidateBatchGroup(batch, group, descendants=False):
+    """
+    Asks a batch to rebuild the draw list of a group before it is next
+    drawn.  Batches other than KyttenBatches rebuild their whole draw list.
+
+    @param batch The batch containing the group
+    @param group The group which has changed
+    @param descendants True if the groups within the group have also changed
+    """
+    if isinstance(batch, KyttenBatch):
+        batch.invalidate_group(group, descendants=descendants)
+    else:
+        batch._draw_list_dirty = True
+
+# Laying out a label's text, that is looking up the glyph of each character
+# and flowing the glyphs into lines, depends only upon the text and its
+# style, so labels which show the same text in the same style share the
+# lines laid out for the first of them.  Colors are only applied when the
+# lines are turned into vertex lists, so they are not part of the key.
+# The cache is emptied whenever it grows past KYTTEN_LABEL_CACHE_SIZE.
+KYTTEN_LABEL_CACHE_SIZE = 1024
+KYTTEN_LABEL_UNCACHED_STYLES = ['color', 'background_color']
+kytten_label_cache = {}
+
+def ClearKyttenLabelCache():
+    kytten_label_cache.clear()
+
+def KyttenLoadFont(name, size):
+    """
+    Loads a font with which to measure text without creating labels.
+
+    @param name Name of the font
+    @param size Size of the font
+    """
+    return pyglet.font.load(name, size)
+
 class KyttenLabel(pyglet.text.Label):
+    def _get_lines(self):
+        """
+        Returns the lines of glyphs which pyglet.text.Label would lay out
+        for our text, reusing those laid out for an earlier label with the
+        same text and style if possible.
+        """
+        key = self._get_lines_key()
+        if key is None:
+            return pyglet.text.Label._get_lines(self)
+        entry = kytten_label_cache.get(key)
+        if entry is None:
+            lines = pyglet.text.Label._get_lines(self)
+            if len(kytten_label_cache) >= KYTTEN_LABEL_CACHE_SIZE:
+                kytten_label_cache.clear()
+            kytten_label_cache[key] = \
+                (lines, self.content_width, self.content_height)
+        else:
+            lines, self.content_width, self.content_height = entry
+        return lines
+
+    def _get_lines_key(self):
+        """
+        Returns the key under which our lines are cached, or None if our
+        document is not uniformly styled.
+        """
+        styles = getattr(self._document, 'styles', None)
+        if styles is None:
+            return None
+        style = []
+        for name, value in styles.iteritems():
+            if name not in KYTTEN_LABEL_UNCACHED_STYLES:
+                if isinstance(value, list):
+                    value = tuple(value)
+                style.append((name, value))
+        style.sort()
+        return (self._document.text, tuple(style), self._multiline,
+                self._width, self._dpi)
+
     def _init_groups(self, group):
         if not group:
             return # use the default groups
         self.top_group, self.background_group, self.foreground_group, \
             self.foreground_decoration_group = GetKyttenLayoutGroups(group)
 
+    def set_style(self, font_name, font_size, color):
+        """
+        Changes our font and color in place.  Our text is only laid out
+        again if the font has changed; a new color is simply written into
+        our vertex lists.
+
+        @param font_name Name of the font
+        @param font_size Size of the font
+        @param color Color of the text
+        @return True if our text was laid out again, and so may have
+                changed size
+        """
+        if tuple(self.color) != tuple(color):
+            self.color = color
+        if self.font_name != font_name or self.font_size != font_size:
+            self.begin_update()
+            self.font_name = font_name
+            self.font_size = font_size
+            self.end_update()
+            return True
+        return False
+
     def teardown(self):
         pyglet.text.Label.teardown(self)
         group = self.top_group.parent
@@ -66,38 +279,51 @@ class KyttenInputLabel(KyttenLabel):
     def _update(self):
         pyglet.text.Label._update(self)
 
-        # Iterate through our vertex lists and break if we need to clip
+        # Clip away whatever lies to the left of our area.  Each vertex
+        # list is read and written back in one piece, and the lists which
+        # lie wholly within our area are left untouched.
         remove = []
         if self.width and not self._multiline:
+            left = self._x
             for vlist in self._vertex_lists:
-                num_quads = len(vlist.vertices) / 8
-                remove_quads = 0
-                has_quads = False
-                for n in xrange(0, num_quads):
-                    x1, y1, x2, y2, x3, y3, x4, y4 = vlist.vertices[n*8:n*8+8]
-                    tx1, ty1, tz1, tx2, ty2, tz2, \
-                       tx3, ty3, tz3, tx4, ty4, tz4 = \
-                       vlist.tex_coords[n*12:n*12+12]
-                    if x2 >= self._x:
-                        has_quads = True
-                        m = n - remove_quads  # shift quads left
-                        if x1 < self._x:  # clip on left side
-                            percent = (float(self._x) - float(x1)) / \
-                                      (float(x2) - float(x1))
-                            x1 = x4 = max(self._x, x1)
-                            tx1 = tx4 = (tx2 - tx1) * percent + tx1
-                        vlist.vertices[m*8:m*8+8] = \
-                            [x1, y1, x2, y2, x3, y3, x4, y4]
-                        vlist.tex_coords[m*12:m*12+12] = \
-                             [tx1, ty1, tz1, tx2, ty2, tz2,
-                              tx3, ty3, tz3, tx4, ty4, tz4]
-                    else:
-                        # We'll delete quads entirely not visible
-                        remove_quads = remove_quads + 1
-                if remove_quads == num_quads:
+                vertices = vlist.vertices[:]
+                if vertices and min(vertices[0::8]) >= left:
+                    continue  # nothing to clip
+                num_quads = len(vertices) / 8
+                visible = [n for n in xrange(num_quads)
+                           if vertices[n*8+2] >= left]
+                if not visible:  # includes empty lists
+                    # We'll delete quads entirely not visible
                     remove.append(vlist)
-                elif remove_quads > 0:
-                    vlist.resize((num_quads - remove_quads) * 4)
+                    continue
+
+                # Shift the visible quads left over those we removed
+                tex_coords = vlist.tex_coords[:]
+                first = visible[0]
+                if len(visible) == num_quads - first:
+                    vertices = vertices[first*8:]
+                    tex_coords = tex_coords[first*12:]
+                else:
+                    vertices = [v for n in visible
+                                  for v in vertices[n*8:n*8+8]]
+                    tex_coords = [t for n in visible
+                                    for t in tex_coords[n*12:n*12+12]]
+
+                # Clip the quads which straddle our left side
+                for m in [m for m in xrange(len(visible))
+                          if vertices[m*8] < left]:
+                    x1, x2 = vertices[m*8], vertices[m*8+2]
+                    percent = (float(left) - float(x1)) / \
+                              (float(x2) - float(x1))
+                    vertices[m*8] = vertices[m*8+6] = max(left, x1)
+                    tx1, tx2 = tex_coords[m*12], tex_coords[m*12+3]
+                    tex_coords[m*12] = tex_coords[m*12+9] = \
+                        (tx2 - tx1) * percent + tx1
+
+                vlist.vertices[0:len(vertices)] = vertices
+                vlist.tex_coords[0:len(tex_coords)] = tex_coords
+                if len(visible) < num_quads:
+                    vlist.resize(len(visible) * 4)
         for vlist in remove:
             vlist.delete()
             self._vertex_lists.remove(vlist)
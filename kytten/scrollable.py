@@ -4,15 +4,17 @@
 import pyglet
 from pyglet import gl
 
-from dialog import DialogEventManager
+from dialog import DialogEventManager, GetWidgetOffset
 from frame import Wrapper
+from override import KyttenBatch, InvalidateBatchGroup
 from scrollbar import HScrollbar, VScrollbar
-from widgets import Widget
+from widgets import Widget, LayoutMovedControls, MarkLayoutMovedControls
 
 class ScrollableGroup(pyglet.graphics.Group):
     """
     We restrict what's shown within a Scrollable by performing a scissor
-    test.
+    test.  Content is drawn translated by however far it has been scrolled
+    since it was laid out.
     """
     def __init__(self, x, y, width, height, parent=None):
         """Create a new ScrollableGroup
@@ -25,27 +27,117 @@ class ScrollableGroup(pyglet.graphics.Group):
         """
         pyglet.graphics.Group.__init__(self, parent)
         self.x, self.y, self.width, self.height = x, y, width, height
+        self.translate_x = self.translate_y = 0
         self.was_scissor_enabled = False
 
     def set_state(self):
         """
-        Enables a scissor test on our region
+        Enables a scissor test on our region, and translates our content
         """
         gl.glPushAttrib(gl.GL_ENABLE_BIT | gl.GL_TRANSFORM_BIT |
                         gl.GL_CURRENT_BIT)
         self.was_scissor_enabled = gl.glIsEnabled(gl.GL_SCISSOR_TEST)
         gl.glEnable(gl.GL_SCISSOR_TEST)
-        gl.glScissor(int(self.x), int(self.y),
-                     int(self.width), int(self.height))
+
+        # The scissor box is in window coordinates, so it must be moved
+        # along with any Dialog translating us
+        x, y = self.x, self.y
+        group = self.parent
+        while group is not None:
+            x += getattr(group, 'translate_x', 0)
+            y += getattr(group, 'translate_y', 0)
+            group = group.parent
+        gl.glScissor(int(x), int(y), int(self.width), int(self.height))
+
+        gl.glPushMatrix()
+        gl.glTranslatef(self.translate_x, self.translate_y, 0)
+
+    def set_translation(self, x, y):
+        """
+        Sets how far our content is to be drawn from where it was laid out.
+
+        @param x Horizontal translation
+        @param y Vertical translation
+        """
+        self.translate_x, self.translate_y = x, y
 
     def unset_state(self):
         """
         Disables the scissor test
         """
+        gl.glPopMatrix()
         if not self.was_scissor_enabled:
             gl.glDisable(gl.GL_SCISSOR_TEST)
         gl.glPopAttrib()
 
+class ScrollableBandGroup(pyglet.graphics.OrderedGroup):
+    """
+    One of the groups of a ScrollableBand.  A KyttenBatch leaves it out
+    of the draw list while it is hidden.
+    """
+    def __init__(self, order, parent=None):
+        pyglet.graphics.OrderedGroup.__init__(self, order, parent)
+        self.is_visible = True
+
+class ScrollableBand(object):
+    """
+    Each Widget directly within a Scrollable's content is sized within a
+    band of its own, with its own groups beneath those of the Scrollable,
+    so that it can be left out of the batch while it is scrolled out of
+    view.  In every other respect the band stands in for the Scrollable.
+    """
+    def __init__(self, scrollable, widget, order):
+        """
+        Creates a new ScrollableBand.
+
+        @param scrollable The Scrollable we stand in for
+        @param widget The Widget which is sized within us
+        @param order Order of our groups among those of other bands
+        """
+        self.scrollable = scrollable
+        self.widget = widget
+        self.saved_dialog = scrollable
+        self.theme = scrollable.theme
+        self.batch = scrollable.batch
+        self.root_group = None  # we are never translated ourself
+        self.panel_group = ScrollableBandGroup(order, scrollable.panel_group)
+        self.bg_group = ScrollableBandGroup(order, scrollable.bg_group)
+        self.fg_group = ScrollableBandGroup(order, scrollable.fg_group)
+        self.highlight_group = ScrollableBandGroup(
+            order, scrollable.highlight_group)
+        self.is_visible = True
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.scrollable, name)
+
+    def _get_is_full_layout(self):
+        return self.scrollable.is_full_layout
+
+    def _set_is_full_layout(self, is_full_layout):
+        # Widgets sizing their subtree set this while they do so
+        self.scrollable.is_full_layout = is_full_layout
+
+    is_full_layout = property(_get_is_full_layout, _set_is_full_layout)
+
+    def get_child_dialog(self, widget, parent):
+        return None  # Widgets within ours are sized within us
+
+    def set_visible(self, is_visible):
+        """
+        Shows or hides everything drawn by our Widget.
+
+        @param is_visible True to show our Widget, False to hide it
+        """
+        if is_visible == self.is_visible:
+            return
+        self.is_visible = is_visible
+        for group in [self.panel_group, self.bg_group,
+                      self.fg_group, self.highlight_group]:
+            group.is_visible = is_visible
+            InvalidateBatchGroup(self.scrollable.batch, group)
+
 class Scrollable(Wrapper):
     """
     Wraps a layout or widget and limits it to a maximum, or fixed, size.
@@ -80,6 +172,23 @@ class Scrollable(Wrapper):
         self.hscrollbar_height = 0
         self.vscrollbar_width = 0
 
+        # Our content stays where it was last laid out, and is drawn
+        # translated to wherever it has since been scrolled.  Widgets which
+        # only create what can be seen watch for the view to change.
+        self.layout_scroll = None
+        self.layout_area = None
+        self.view_watchers = []
+
+        # If our batch can hide groups, Widgets directly within our content
+        # are sized within bands, which are hidden while out of view.  Bands
+        # are kept by the id of their Widget, which is quicker to hash.
+        # pyglet considers OrderedGroups of the same order and parent to be
+        # the same group, so no two bands may ever share an order.
+        self.bands = {}
+        self.band_order = 0
+        self.is_content_sized = False
+        self.culled_view = None
+
         # We emulate some aspects of Dialog here.  We cannot just inherit
         # from Dialog because pyglet event handling won't allow keyword
         # arguments to be passed through.
@@ -91,6 +200,7 @@ class Scrollable(Wrapper):
         self.fg_group = None
         self.highlight_group = None
         self.needs_layout = False
+        self.is_full_layout = True
 
     def _get_controls(self):
         """
@@ -103,18 +213,55 @@ class Scrollable(Wrapper):
         our_right = our_left + self.content_width
         our_bottom = self.content_y
         our_top = our_bottom + self.content_height
+        if self.root_group is not None:
+            dx = self.root_group.translate_x
+            dy = self.root_group.translate_y
+        else:
+            dx = dy = 0
         for control, left, right, top, bottom in base_controls:
             controls.append((control,
-                             max(left, our_left),
-                             min(right, our_right),
-                             min(top, our_top),
-                             max(bottom, our_bottom)))
+                             max(left + dx, our_left),
+                             min(right + dx, our_right),
+                             min(top + dy, our_top),
+                             max(bottom + dy, our_bottom)))
         if self.hscrollbar is not None:
             controls += self.hscrollbar._get_controls()
         if self.vscrollbar is not None:
             controls += self.vscrollbar._get_controls()
         return controls
 
+    def _cull_bands(self):
+        """
+        Hides the bands of Widgets which lie entirely outside our view,
+        and shows those of Widgets which can be seen.
+        """
+        view = self.get_view_region()
+        if view == self.culled_view and not LayoutMovedControls():
+            return  # nothing has moved into or out of view
+        self.culled_view = view
+        view_x, view_y, view_width, view_height = view
+        view_right = view_x + view_width
+        view_top = view_y + view_height
+        for band in self.bands.itervalues():
+            widget = band.widget
+            band.set_visible(widget.x < view_right and
+                             widget.x + widget.width > view_x and
+                             widget.y < view_top and
+                             widget.y + widget.height > view_y)
+
+    def _get_scroll(self):
+        """
+        Returns how far our content is scrolled from our top left corner.
+        """
+        scroll_x = scroll_y = 0
+        if self.hscrollbar:
+            scroll_x = self.hscrollbar.get(self.content_width,
+                                           self.content.width)
+        if self.vscrollbar:
+            scroll_y = self.vscrollbar.get(self.content_height,
+                                           self.content.height)
+        return scroll_x, scroll_y
+
     def delete(self):
         """
         Delete all graphical elements associated with the Scrollable
@@ -131,6 +278,10 @@ class Scrollable(Wrapper):
         self.bg_group = None
         self.fg_group = None
         self.highlight_group = None
+        self.layout_scroll = None
+        self.layout_area = None
+        self.bands = {}
+        self.culled_view = None
 
     def ensure_visible(self, control):
         """
@@ -145,9 +296,13 @@ class Scrollable(Wrapper):
             offset_y = self.content.height - self.content_height - \
                      self.vscrollbar.get(self.content_height,
                                          self.content.height)
-        control_left = control.x - self.content_x - offset_x
+        # Where the control is drawn, counting our own translation
+        translate_x, translate_y = GetWidgetOffset(control, self.saved_dialog)
+        control_x = control.x + translate_x
+        control_y = control.y + translate_y
+        control_left = control_x - self.content_x - offset_x
         control_right = control_left + control.width
-        control_bottom = control.y - self.content_y + offset_y
+        control_bottom = control_y - self.content_y + offset_y
         control_top = control_bottom + control.height
         if self.hscrollbar is not None:
             self.hscrollbar.ensure_visible(control_left, control_right,
@@ -168,16 +323,49 @@ class Scrollable(Wrapper):
                 self.content_height = height - self.hscrollbar_height
             else:
                 self.content_height = height
-            self.content.expand(max(self.content_width, self.content.width),
-                                max(self.content_height, self.content.height))
+            self.content.expand_if_needed(
+                max(self.content_width, self.content.width),
+                max(self.content_height, self.content.height))
         self.width, self.height = width, height
 
+    def get_child_dialog(self, widget, parent):
+        """
+        Returns the band within which a Widget directly within our content
+        is to be sized, or None if it is to be sized within us.
+
+        @param widget The Widget about to be sized
+        @param parent The Widget which contains it
+        """
+        if parent is not self.content or self.content is None or \
+           not isinstance(self.batch, KyttenBatch):
+            return None
+        if self.content in self.view_watchers:
+            return None  # it only creates what can be seen already
+        band = self.bands.get(id(widget))
+        if band is None:
+            self.band_order += 1
+            band = ScrollableBand(self, widget, self.band_order)
+            self.bands[id(widget)] = band
+        return band
+
     def get_root(self):
         if self.saved_dialog:
             return self.saved_dialog.get_root()
         else:
             return self
 
+    def get_view_region(self):
+        """
+        Returns the area within which our content can be seen, as a tuple
+        of (x, y, width, height), in the coordinates our content was laid
+        out in.
+        """
+        x, y = self.content_x, self.content_y
+        if self.root_group is not None:
+            x -= self.root_group.translate_x
+            y -= self.root_group.translate_y
+        return x, y, self.content_width, self.content_height
+
     def hit_test(self, x, y):
         """
         We only intercept events for the content region, not for
@@ -212,17 +400,39 @@ class Scrollable(Wrapper):
         self.root_group.width = self.content_width + 1
         self.root_group.height = self.content_height + 1
 
-        # Work out the content layout
+        # Work out the content layout.  If only our scrollbars have moved
+        # since our content was laid out, it is merely translated.
         self.content_x, self.content_y = x, y
-        left = x
-        top = y + self.content_height - self.content.height
-        if self.hscrollbar:
-            left -= self.hscrollbar.get(self.content_width,
-                                        self.content.width)
-        if self.vscrollbar:
-            top += self.vscrollbar.get(self.content_height,
-                                       self.content.height)
-        self.content.layout(left, top)
+        scroll = self._get_scroll()
+        area = (x, y, self.content_width, self.content_height,
+                self.content.width, self.content.height)
+        if self.is_full_layout or area != self.layout_area:
+            self.layout_scroll = scroll
+            self.layout_area = area
+        scroll_x, scroll_y = scroll
+        layout_x, layout_y = self.layout_scroll
+        translation = (layout_x - scroll_x, scroll_y - layout_y)
+        if translation != (self.root_group.translate_x,
+                           self.root_group.translate_y):
+            self.root_group.set_translation(*translation)
+            MarkLayoutMovedControls()
+        left = x - layout_x
+        top = y + self.content_height - self.content.height + layout_y
+        self.content.layout_if_needed(left, top)
+
+        # Widgets which show only what can be seen may have more to show
+        for widget in self.view_watchers[:]:
+            widget.on_view_changed()
+
+        # Forget the bands of Widgets removed from our content.  Whenever
+        # our content is sized, it visits every Widget still within it.
+        # Then hide what can't be seen.
+        if self.is_content_sized:
+            self.is_content_sized = False
+            for key, band in self.bands.items():
+                if band.widget.layout_pass != self.layout_pass:
+                    del self.bands[key]
+        self._cull_bands()
 
         self.needs_layout = False
 
@@ -238,10 +448,10 @@ class Scrollable(Wrapper):
             self.expand(width, height)
             self.layout(self.x, self.y)
 
-    def set_needs_layout(self):
+    def set_needs_layout(self, widget=None):
         self.needs_layout = True
         if self.saved_dialog is not None:
-            self.saved_dialog.set_needs_layout()
+            self.saved_dialog.set_needs_layout(widget or self)
 
     def set_wheel_hint(self, control):
         if self.saved_dialog is not None:
@@ -268,6 +478,11 @@ class Scrollable(Wrapper):
         self.vscrollbar_width = \
             dialog.theme['vscrollbar']['up']['image'].width
 
+        # Our children must all be sized again if the Dialog is being laid
+        # out from scratch, or if we're about to give them new groups
+        self.is_full_layout = self.root_group is None or \
+                              getattr(dialog, 'is_full_layout', True)
+
         if self.root_group is None: # do we need to re-clone dialog groups?
             self.theme = dialog.theme
             self.batch = dialog.batch
@@ -282,13 +497,18 @@ class Scrollable(Wrapper):
             self.highlight_group = pyglet.graphics.OrderedGroup(
                 3, self.root_group)
             Wrapper.delete(self)  # force children to abandon old groups
+            self.bands = {}
+            self.culled_view = None
 
         Wrapper.size(self, self)  # all children are to use our groups
+        self.is_content_sized = self.content is not None and \
+                                self.content.is_live
 
         if self.always_show_scrollbars or \
            (self.max_width and self.width > self.max_width):
             if self.hscrollbar is None:
                 self.hscrollbar = HScrollbar(self.max_width)
+                self.hscrollbar.parent = self
         else:
             if self.hscrollbar is not None:
                 self.hscrollbar.delete()
@@ -298,6 +518,7 @@ class Scrollable(Wrapper):
            (self.max_height and self.height > self.max_height):
             if self.vscrollbar is None:
                 self.vscrollbar = VScrollbar(self.max_height)
+                self.vscrollbar.parent = self
         else:
             if self.vscrollbar is not None:
                 self.vscrollbar.delete()
@@ -319,3 +540,36 @@ class Scrollable(Wrapper):
             self.vscrollbar.set(self.max_height, max(self.content.height,
                                                      self.max_height))
             self.width += self.vscrollbar.width
+
+    def stop_watching_view(self, widget):
+        """
+        Stops telling a widget when our view has been scrolled.
+
+        @param widget The widget which no longer watches our view
+        """
+        if widget in self.view_watchers:
+            self.view_watchers.remove(widget)
+
+    def subscribe_updates(self, control):
+        if self.saved_dialog is not None:
+            self.saved_dialog.subscribe_updates(control)
+
+    def teardown(self):
+        self.view_watchers = []
+        Wrapper.teardown(self)
+        self.bands = {}
+
+    def unsubscribe_updates(self, control):
+        if self.saved_dialog is not None:
+            self.saved_dialog.unsubscribe_updates(control)
+
+    def watch_view(self, widget):
+        """
+        Tells a widget, by calling its on_view_changed(), whenever we are
+        laid out, so it can show what has been scrolled into view without
+        our content being laid out again.
+
+        @param widget The widget which watches our view
+        """
+        if widget not in self.view_watchers:
+            self.view_watchers.append(widget)
@@ -1,9 +1,22 @@
 # kytten/scrollbar.py
 # Copyrighted (C) 2009 by Conrad "Lynx" Wong
 
+import math
+
 import pyglet
 from widgets import Control
 
+# Scrolling is kinetic: each click of the mousewheel, or bit of trackpad
+# motion, adds to the speed at which the bar moves, and the bar slows
+# down over time.  The bar only moves in on_update, once per frame, no
+# matter how many scroll events arrived since the last frame.  Distances
+# and speeds are measured in pixels along the scrollbar's space.
+SCROLLBAR_WHEEL_DISTANCE = 10.0  # how far each click eventually moves us
+SCROLLBAR_FRICTION = 8.0  # our speed decays as exp(-friction * time)
+SCROLLBAR_MIN_VELOCITY = 1.0  # we stop when slower than this
+SCROLLBAR_ARROW_SPEED = 50.0  # speed while an arrow button is held
+SCROLLBAR_MAX_STEP = 0.1  # longest time we'll integrate over at once
+
 class HScrollbar(Control):
     """
     A horizontal scrollbar.  Position is measured from 0.0 to 1.0, and bar
@@ -41,6 +54,16 @@ class HScrollbar(Control):
         self.is_dragging = False
         self.is_scrolling = False
         self.scroll_delta = 0
+        self.velocity = 0.0
+
+    def _move_bar(self, distance):
+        """
+        Moves the bar towards the right by a distance, or towards the
+        left if the distance is negative.
+
+        @param distance Distance to move, along our space
+        """
+        self.drag_bar(distance, 0)
 
     def _get_left_region(self):
         """
@@ -118,6 +141,17 @@ class HScrollbar(Control):
         self.pos = min(max(self.pos + float(dx) / space_width, 0.0),
                        1.0 - float(bar_width)/space_width)
 
+    def fling(self, distance):
+        """
+        Adds to the speed at which we're scrolling, so that we travel
+        a further distance before coming to rest.
+
+        @param distance Further distance to travel, along our space.
+                        Positive distances scroll right, or down.
+        """
+        self.velocity += distance * SCROLLBAR_FRICTION
+        self.start_updates()
+
     def ensure_visible(self, left, right, max_width):
         """
         Ensure that the area of space between left and right is completely
@@ -136,8 +170,7 @@ class HScrollbar(Control):
         elif pos_x + pos_width < right:
             self.pos = (right - pos_width) / max_width  # Shift to the right
         self.pos = min(max(self.pos, 0.0), 1.0 - self.bar_width)
-        self.delete()
-        self.saved_dialog.set_needs_layout()
+        self.saved_dialog.set_needs_layout(self)
 
     def get(self, width, max_width):
         """
@@ -183,9 +216,9 @@ class HScrollbar(Control):
         @param modifiers Modifiers to apply to buttons
         """
         if self.is_dragging:
+            self.velocity = 0.0
             self.drag_bar(dx, dy)
-            self.delete()
-            self.saved_dialog.set_needs_layout()
+            self.saved_dialog.set_needs_layout(self)
             return pyglet.event.EVENT_HANDLED
 
     def on_mouse_press(self, x, y, button, modifiers):
@@ -198,19 +231,20 @@ class HScrollbar(Control):
         @param button Button being pressed
         @param modifiers Modifiers to apply to button
         """
+        self.velocity = 0.0
         space_x, space_y, space_width, space_height = self._get_space_region()
         if x >= space_x and x < space_x + space_width and \
            y >= space_y and y < space_y + space_height:
             self.set_bar_pos(x, y)
             self.is_dragging = True
-            self.delete()
-            self.saved_dialog.set_needs_layout()
+            self.saved_dialog.set_needs_layout(self)
         else:
             left_x, left_y, left_width, left_height = self._get_left_region()
             if x >= left_x and x < left_x + left_width and \
                y >= left_y and y < left_y + left_height:
                 self.is_scrolling = True
                 self.scroll_delta = -1
+                self.start_updates()
             else:
                 right_x, right_y, right_width, right_height = \
                        self._get_right_region()
@@ -218,6 +252,7 @@ class HScrollbar(Control):
                    y >= right_y and y < right_y + right_height:
                     self.is_scrolling = True
                     self.scroll_delta = 1
+                    self.start_updates()
 
     def on_mouse_release(self, x, y, button, modifiers):
         """
@@ -229,7 +264,10 @@ class HScrollbar(Control):
         @param modifiers Modifiers to apply to button
         """
         self.is_dragging = False
-        self.is_scrolling = False
+        if self.is_scrolling:
+            self.is_scrolling = False
+            if not self.velocity:
+                self.stop_updates()
         self.scroll_delta = 0
 
     def on_mouse_scroll(self, x, y, scroll_x, scroll_y):
@@ -241,19 +279,34 @@ class HScrollbar(Control):
         @param scroll_x Number of clicks horizontally mouse was moved
         @param scroll_y Number of clicks vertically mouse was moved
         """
-        self.drag_bar(scroll_y * 10, 0)
-        self.delete()
-        self.saved_dialog.set_needs_layout()
+        self.fling(scroll_y * SCROLLBAR_WHEEL_DISTANCE)
 
     def on_update(self, dt):
         """
-        When scrolling, we increment our position each update
+        We move the bar steadily while an arrow button is held, and by
+        our velocity after being flung, slowing down as we go.  Reaching
+        either end stops us.
 
         @param dt Time delta, in seconds
         """
+        dt = min(dt, SCROLLBAR_MAX_STEP)
+        distance = 0.0
         if self.is_scrolling:
-            self.drag_bar(self.scroll_delta * 50.0 * dt, 0)
-            self.saved_dialog.set_needs_layout()
+            distance += self.scroll_delta * SCROLLBAR_ARROW_SPEED * dt
+        if self.velocity:
+            distance += self.velocity * dt
+            self.velocity *= math.exp(-SCROLLBAR_FRICTION * dt)
+            if abs(self.velocity) < SCROLLBAR_MIN_VELOCITY:
+                self.velocity = 0.0
+        if distance:
+            pos = self.pos
+            self._move_bar(distance)
+            if self.pos != pos:
+                self.saved_dialog.set_needs_layout(self)
+            else:
+                self.velocity = 0.0  # we've hit the end
+        if not self.is_scrolling and not self.velocity:
+            self.stop_updates()
 
     def set(self, width, max_width):
         """
@@ -287,23 +340,23 @@ class HScrollbar(Control):
 
     def size(self, dialog):
         """
-        Creates scrollbar components.
+        Creates scrollbar components.  The buttons are restyled in place
+        as the bar reaches or leaves either end.
         """
         if dialog is None:
             return
         Control.size(self, dialog)
         dialog.set_wheel_hint(self)
-        if self.left is None:
-            if self.pos > 0.0:
-                path = self.IMAGE_LEFT
-            else:
-                path = self.IMAGE_LEFTMAX
-            self.left = dialog.theme[path]['image'].generate(
-                dialog.theme[path]['gui_color'],
-                dialog.batch, dialog.fg_group)
+        if self.pos > 0.0:
+            path = self.IMAGE_LEFT
+        else:
+            path = self.IMAGE_LEFTMAX
+        self.left = dialog.theme[path]['image'].regenerate(
+            self.left, dialog.theme[path]['gui_color'],
+            dialog.batch, dialog.fg_group)
 
-            # Left button is our basis for minimum dimension
-            self.width, self.height = self.left.width, self.left.height
+        # Left button is our basis for minimum dimension
+        self.width, self.height = self.left.width, self.left.height
         if self.space is None:
             path = self.IMAGE_SPACE
             self.space = dialog.theme[path]['image'].generate(
@@ -314,14 +367,13 @@ class HScrollbar(Control):
             self.bar = dialog.theme[path]['image'].generate(
                 dialog.theme[path]['gui_color'],
                 dialog.batch, dialog.fg_group)
-        if self.right is None:
-            if self.pos < 1.0 - self.bar_width:
-                path = self.IMAGE_RIGHT
-            else:
-                path = self.IMAGE_RIGHTMAX
-            self.right = dialog.theme[path]['image'].generate(
-                dialog.theme[path]['gui_color'],
-                dialog.batch, dialog.fg_group)
+        if self.pos < 1.0 - self.bar_width:
+            path = self.IMAGE_RIGHT
+        else:
+            path = self.IMAGE_RIGHTMAX
+        self.right = dialog.theme[path]['image'].regenerate(
+            self.right, dialog.theme[path]['gui_color'],
+            dialog.batch, dialog.fg_group)
 
 class VScrollbar(HScrollbar):
     """
@@ -346,6 +398,15 @@ class VScrollbar(HScrollbar):
         Control.__init__(self, width=0, height=height)
         self.__init2__(height)
 
+    def _move_bar(self, distance):
+        """
+        Moves the bar downward by a distance, or upward if the distance
+        is negative.
+
+        @param distance Distance to move, along our space
+        """
+        self.drag_bar(0, -distance)
+
     def _get_left_region(self):
         """Returns the area occupied by the up button
         (x, y, width, height)"""
@@ -418,8 +479,7 @@ class VScrollbar(HScrollbar):
             # Shift downward
             self.pos = 1.0 - float(bottom) / max_height - self.bar_width
         self.pos = min(max(self.pos, 0.0), 1.0 - self.bar_width)
-        self.delete()
-        self.saved_dialog.set_needs_layout()
+        self.saved_dialog.set_needs_layout(self)
 
     def on_mouse_scroll(self, x, y, scroll_x, scroll_y):
         """
@@ -430,20 +490,7 @@ class VScrollbar(HScrollbar):
         @param scroll_x Number of clicks horizontally mouse was moved
         @param scroll_y Number of clicks vertically mouse was moved
         """
-        self.drag_bar(0, scroll_y * 10)
-        self.delete()
-        self.saved_dialog.set_needs_layout()
-
-    def on_update(self, dt):
-        """
-        When scrolling, we increment our position each update
-
-        @param dialog Dialog in which we're contained
-        @param dt Time delta, in seconds
-        """
-        if self.is_scrolling:
-            self.drag_bar(0, -self.scroll_delta * 50.0 * dt)
-            self.saved_dialog.set_needs_layout()
+        self.fling(-scroll_y * SCROLLBAR_WHEEL_DISTANCE)
 
     def set(self, height, max_height):
         """Sets the new height of the scrollbar, and the height of
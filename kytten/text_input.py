@@ -2,9 +2,17 @@
 # Copyrighted (C) 2009 by Conrad "Lynx" Wong
 
 import pyglet
-from widgets import Control
+from widgets import Control, MarkFrameDamaged
 from override import KyttenInputLabel
 
+class KyttenCaret(pyglet.text.caret.Caret):
+    """
+    A Caret which marks the frame damaged each time it blinks.
+    """
+    def _blink(self, dt):
+        pyglet.text.caret.Caret._blink(self, dt)
+        MarkFrameDamaged()
+
 class Input(Control):
     """A text input field."""
     def __init__(self, id=None, text="", length=20, max_length=None, padding=0,
@@ -25,6 +33,20 @@ class Input(Control):
 
     def delete(self):
         Control.delete(self)
+        self.delete_text()
+        if self.field is not None:
+            self.field.delete()
+            self.field = None
+        if self.highlight is not None:
+            self.highlight.delete()
+            self.highlight = None
+
+    def delete_text(self):
+        """
+        Deletes the caret and whichever of the text layout or label shows
+        our text, since we change between them on gaining or losing focus.
+        Our field and highlight are kept.
+        """
         if self.caret is not None:
             self.caret.delete()
             self.caret = None
@@ -35,12 +57,6 @@ class Input(Control):
         if self.label is not None:
             self.label.delete()
             self.label = None
-        if self.field is not None:
-            self.field.delete()
-            self.field = None
-        if self.highlight is not None:
-            self.highlight.delete()
-            self.highlight = None
 
     def disable(self):
         Control.disable(self)
@@ -89,7 +105,7 @@ class Input(Control):
 
     def on_gain_focus(self):
         Control.on_gain_focus(self)
-        self.delete()
+        self.delete_text()
         if self.saved_dialog is not None:
             self.size(self.saved_dialog)
             self.layout(self.x, self.y)
@@ -99,7 +115,8 @@ class Input(Control):
 
     def on_lose_focus(self):
         Control.on_lose_focus(self)
-        self.delete()
+        self.delete_text()
+        self.remove_highlight()
         if self.saved_dialog is not None:
             self.size(self.saved_dialog)
             self.layout(self.x, self.y)
@@ -140,16 +157,17 @@ class Input(Control):
     def remove_highlight(self):
         if not self.is_highlight() and not self.is_focus():
             if self.highlight is not None:
-                self.highlight.delete()
-                self.highlight = None
+                self.highlight.set_visible(False)
 
     def set_highlight(self):
         path = ['input', 'highlight']
-        if self.highlight is None:
-            self.highlight = self.saved_dialog.theme[path]['image'].generate(
-                color=self.saved_dialog.theme[path]['highlight_color'],
-                batch=self.saved_dialog.batch,
-                group=self.saved_dialog.highlight_group)
+        if self.highlight is None or not self.highlight.is_visible:
+            self.highlight = self.saved_dialog.theme[path]['image'].\
+                regenerate(self.highlight,
+                           self.saved_dialog.theme[path]['highlight_color'],
+                           self.saved_dialog.batch,
+                           self.saved_dialog.highlight_group)
+            self.highlight.set_visible(True)
             self.highlight.update(self.x, self.y, self.width, self.height)
 
     def set_text(self, text):
@@ -195,7 +213,7 @@ class Input(Control):
                 assert self.caret is None
             assert self.label is None
             if self.caret is None:
-                self.caret = pyglet.text.caret.Caret(
+                self.caret = KyttenCaret(
                     self.text_layout,
                     color=dialog.theme['input']['gui_color'][0:3])
                 self.caret.visible = True
@@ -219,7 +237,7 @@ class Input(Control):
                 color=color,
                 batch=dialog.batch,
                 group=dialog.bg_group)
-        if self.highlight is None and self.is_highlight():
+        if self.is_highlight():
             self.set_highlight()
 
         self.width, self.height = self.field.get_needed_size(
@@ -1,10 +1,14 @@
 # kytten/theme.py
 # Copyrighted (C) 2009 by Conrad "Lynx" Wong
 
+import marshal
+import mmap
 import os
+import struct
 
 import pyglet
 from pyglet import gl
+from pyglet.image.atlas import TextureBin, Allocator, AllocatorException
 
 try:
     import json
@@ -33,17 +37,31 @@ DEFAULT_THEME_SETTINGS = {
     "disabled_color": [160, 160, 160, 255],
 }
 
+# Size of the texture pages which theme images are packed into, when a
+# Theme is created with use_atlas=True
+THEME_ATLAS_SIZE = 512
+
+# A theme bundle, written by CompileTheme(), begins with this line.  It
+# is followed by the length of a marshalled header, the header itself,
+# which holds the theme's dictionary and the placement of each image
+# within the bundle's pages, and then by the RGBA pixels of each page in
+# turn.  Since marshal's format may change between Python versions,
+# bundles should be compiled by the Python which will load them.
+THEME_BUNDLE_MAGIC = 'KYTTEN THEME BUNDLE 1\n'
+
 class ThemeTextureGroup(pyglet.graphics.TextureGroup):
     """
     ThemeTextureGroup, in addition to setting the texture, also ensures that
     we map to the nearest texel instead of trying to interpolate from nearby
-    texels.  This prevents 'blooming' along the edges.
+    texels.  This prevents 'blooming' along the edges.  pyglet considers
+    TextureGroups of the same texture and parent group to be equal, so a
+    batch draws every element showing the same texture together.
     """
     def set_state(self):
 	pyglet.graphics.TextureGroup.set_state(self)
-	gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER,
+	gl.glTexParameteri(self.texture.target, gl.GL_TEXTURE_MAG_FILTER,
 			   gl.GL_NEAREST)
-	gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER,
+	gl.glTexParameteri(self.texture.target, gl.GL_TEXTURE_MIN_FILTER,
 			   gl.GL_NEAREST)
 
 class UndefinedGraphicElementTemplate:
@@ -57,6 +75,35 @@ class UndefinedGraphicElementTemplate:
     def generate(self, color, batch, group):
 	return UndefinedGraphicElement(self.theme, color, batch, group)
 
+    def regenerate(self, element, color, batch, group):
+	"""
+	Returns an element as generate() would, but reuses the vertex list
+	of an element we or another template generated earlier where we can,
+	so that widgets changing state need not reallocate their graphics.
+
+	@param element The element to reuse or delete, or None
+	@param color Color to give the element
+	@param batch Batch the element should be in
+	@param group Group the element should be in
+	"""
+	if element is not None:
+	    if element.template is self and element.color == color:
+		return element
+	    if element.batch is batch and element.parent_group is group and \
+	       self._reuse(element, color):
+		element.template, element.color = self, color
+		return element
+	    element.delete()
+	element = self.generate(color, batch, group)
+	element.template, element.color = self, color
+	return element
+
+    def _reuse(self, element, color):
+	if element.__class__ is not UndefinedGraphicElement:
+	    return False
+	element.set_color(color)
+	return True
+
     def write(self, f, indent=0):
         f.write('None')
 
@@ -71,6 +118,12 @@ class TextureGraphicElementTemplate(UndefinedGraphicElementTemplate):
 	return TextureGraphicElement(self.theme, self.texture,
 				     color, batch, group)
 
+    def _reuse(self, element, color):
+	if element.__class__ is not TextureGraphicElement:
+	    return False
+	element.set_texture(self.texture, color)
+	return True
+
     def write(self, f, indent=0):
 	f.write('{\n')
 	f.write(' ' * (indent + 2) + '"src": "%s"' % self.texture.src)
@@ -95,6 +148,13 @@ class FrameTextureGraphicElementTemplate(TextureGraphicElementTemplate):
 	    self.theme, self.texture, self.stretch_texture,
 	    self.margins, self.padding, color, batch, group)
 
+    def _reuse(self, element, color):
+	if element.__class__ is not FrameTextureGraphicElement:
+	    return False
+	element.set_frame(self.texture, self.stretch_texture,
+			  self.margins, self.padding, color)
+	return True
+
     def write(self, f, indent=0):
 	f.write('{\n')
 	f.write(' ' * (indent + 2) + '"src": "%s"' % self.texture.src)
@@ -112,10 +172,65 @@ class FrameTextureGraphicElementTemplate(TextureGraphicElementTemplate):
 		    repr(list(self.padding)))
 	f.write('\n' + ' ' * indent + '}')
 
+class LazyGraphicElementTemplate(UndefinedGraphicElementTemplate):
+    """
+    Stands in for the template of an image entry in a lazy Theme.  The
+    first time we are used to generate an element, or asked for anything
+    which depends upon our texture, we load the texture and become the
+    template we stood in for.
+    """
+    def __init__(self, theme, spec):
+	"""
+	Creates a new LazyGraphicElementTemplate.  Unlike other templates,
+	we set no width, height, margins or padding until loaded.
+
+	@param theme The Theme which we belong to
+	@param spec The image entry; either a filename or a dictionary
+	"""
+	self.theme = theme
+	self.spec = spec
+
+    def __getattr__(self, name):
+	if name.startswith('__'):
+	    raise AttributeError(name)
+	self.load()
+	return getattr(self, name)
+
+    def generate(self, color, batch, group):
+	self.load()
+	return self.generate(color, batch, group)
+
+    def load(self):
+	"""Loads our texture, and becomes the template we stood in for."""
+	template = self.theme._make_template(self.spec)
+	self.__class__ = template.__class__
+	self.__dict__ = template.__dict__
+
+    def regenerate(self, element, color, batch, group):
+	self.load()
+	return self.regenerate(element, color, batch, group)
+
+    def write(self, f, indent=0):
+	if isinstance(self.spec, dict):
+	    spec = self.spec
+	else:
+	    spec = {'src': self.spec}
+	f.write('{\n')
+	f.write(' ' * (indent + 2) + '"src": "%s"' % spec['src'])
+	for key in ['region', 'stretch', 'padding']:
+	    if spec.has_key(key):
+		f.write(',\n' + ' ' * (indent + 2) + '"%s": %s' %
+			(key, repr(list(spec[key]))))
+	f.write('\n' + ' ' * indent + '}')
+
 class TextureGraphicElement:
     def __init__(self, theme, texture, color, batch, group):
 	self.x = self.y = 0
 	self.width, self.height = texture.width, texture.height
+	self.batch = batch
+	self.parent_group = group
+	self.template = self.color = None  # set by regenerate()
+	self.is_visible = True
 	self.group = ThemeTextureGroup(texture, group)
 	self.vertex_list = batch.add(4, gl.GL_QUADS, self.group,
 				     ('v2i', self._get_vertices()),
@@ -127,6 +242,18 @@ class TextureGraphicElement:
 	x2, y2 = x1 + int(self.width), y1 + int(self.height)
 	return (x1, y1, x2, y1, x2, y2, x1, y2)
 
+    def _set_texture_group(self, texture):
+	"""
+	Moves our vertex list to the group for another texture, unless
+	the texture shares our current one, as atlased images do.
+	"""
+	current = self.group.texture
+	if texture.id == current.id and texture.target == current.target:
+	    return
+	group = ThemeTextureGroup(texture, self.parent_group)
+	self.batch.migrate(self.vertex_list, gl.GL_QUADS, group, self.batch)
+	self.group = group
+
     def delete(self):
 	self.vertex_list.delete()
 	self.vertex_list = None
@@ -141,16 +268,58 @@ class TextureGraphicElement:
     def get_needed_size(self, content_width, content_height):
 	return content_width, content_height
 
+    def set_color(self, color):
+	self.vertex_list.colors = color * (len(self.vertex_list.colors) / 4)
+
+    def set_texture(self, texture, color):
+	"""
+	Shows another texture in place.  As when we were generated, we take
+	its size until we are next updated.
+
+	@param texture The new texture
+	@param color The new color
+	"""
+	self._set_texture_group(texture)
+	self.width, self.height = texture.width, texture.height
+	self.vertex_list.tex_coords = texture.tex_coords
+	if self.is_visible:
+	    self.vertex_list.vertices = self._get_vertices()
+	self.set_color(color)
+
+    def set_visible(self, is_visible):
+	"""
+	Hides or shows us without giving up our vertex list.  While hidden,
+	our vertices are collapsed to a point, so we draw nothing.
+
+	@param is_visible True to show us, False to hide us
+	"""
+	if is_visible == self.is_visible:
+	    return
+	self.is_visible = is_visible
+	if self.vertex_list is not None:
+	    if is_visible:
+		self.vertex_list.vertices = self._get_vertices()
+	    else:
+		self.vertex_list.vertices = \
+		    [0] * len(self.vertex_list.vertices)
+
     def update(self, x, y, width, height):
+	if x == self.x and y == self.y and \
+	   width == self.width and height == self.height:
+	    return  # our vertices are already in place
 	self.x, self.y, self.width, self.height = x, y, width, height
-	if self.vertex_list is not None:
+	if self.vertex_list is not None and self.is_visible:
 	    self.vertex_list.vertices = self._get_vertices()
 
-class FrameTextureGraphicElement:
+class FrameTextureGraphicElement(TextureGraphicElement):
     def __init__(self, theme, texture, inner_texture, margins, padding,
 		 color, batch, group):
 	self.x = self.y = 0
 	self.width, self.height = texture.width, texture.height
+	self.batch = batch
+	self.parent_group = group
+	self.template = self.color = None  # set by regenerate()
+	self.is_visible = True
 	self.group = ThemeTextureGroup(texture, group)
 	self.outer_texture = texture
 	self.inner_texture = inner_texture
@@ -207,19 +376,35 @@ class FrameTextureGraphicElement:
 	return (max(content_width + left + right, self.outer_texture.width),
 	        max(content_height + top + bottom, self.outer_texture.height))
 
-    def delete(self):
-	self.vertex_list.delete()
-	self.vertex_list = None
-	self.group = None
-
-    def update(self, x, y, width, height):
-	self.x, self.y, self.width, self.height = x, y, width, height
-	if self.vertex_list is not None:
+    def set_frame(self, texture, inner_texture, margins, padding, color):
+	"""
+	Shows another frame in place.  As when we were generated, we take
+	its size until we are next updated.
+
+	@param texture The new outer texture
+	@param inner_texture The new stretchable inner texture
+	@param margins The new margins
+	@param padding The new padding
+	@param color The new color
+	"""
+	self._set_texture_group(texture)
+	self.width, self.height = texture.width, texture.height
+	self.outer_texture = texture
+	self.inner_texture = inner_texture
+	self.margins = margins
+	self.padding = padding
+	self.vertex_list.tex_coords = self._get_tex_coords()
+	if self.is_visible:
 	    self.vertex_list.vertices = self._get_vertices()
+	self.set_color(color)
 
 class UndefinedGraphicElement(TextureGraphicElement):
     def __init__(self, theme, color, batch, group):
 	self.x = self.y = self.width = self.height = 0
+	self.batch = batch
+	self.parent_group = group
+	self.template = self.color = None  # set by regenerate()
+	self.is_visible = True
 	self.group = group
 	self.vertex_list = batch.add(12, gl.GL_LINES, self.group,
 				     ('v2i', self._get_vertices()),
@@ -232,6 +417,18 @@ class UndefinedGraphicElement(TextureGraphicElement):
 		x2, y2, x1, y2, x1, y2, x1, y1,
 		x1, y1, x2, y2, x1, y2, x2, y1)
 
+# Incremented whenever any ScopedDict is changed.  ScopedDicts remember
+# the values they have looked up, which may have come from parent scopes,
+# and forget them all when this changes.
+kytten_scoped_dict_version = 0
+
+# Remembered in place of keys which could not be found
+KYTTEN_MISSING_KEY = object()
+
+def InvalidateScopedDictLookups():
+    global kytten_scoped_dict_version
+    kytten_scoped_dict_version += 1
+
 class ScopedDict(dict):
     """
     ScopedDicts differ in several useful ways from normal dictionaries.
@@ -245,39 +442,85 @@ class ScopedDict(dict):
 
     This would return the highlight color assigned to the highlight a button
     should have when it is clicked.
+
+    Lookups are remembered, so that asking again for the same key or path
+    does not walk the paths and parent scopes again.  Changing any
+    ScopedDict through its own methods forgets all remembered lookups.
     """
     def __init__(self, arg={}, parent=None):
 	self.parent = parent
+	self.lookups = {}
+	self.lookups_version = kytten_scoped_dict_version
 	for k, v in arg.iteritems():
 	    if isinstance(v, dict):
 		self[k] = ScopedDict(v, self)
 	    else:
 		self[k] = v
 
+    def __delitem__(self, key):
+	dict.__delitem__(self, key)
+	InvalidateScopedDictLookups()
+
     def __getitem__(self, key):
 	if key is None:
 	    return self
-	elif isinstance(key, list) or isinstance(key, tuple):
-	    if len(key) > 1:
-		return self.__getitem__(key[0]).__getitem__(key[1:])
-	    elif len(key) == 1:
-		return self.__getitem__(key[0])
-	    else:
-		return self  # theme[][key] should return theme[key]
-	else:
+	elif isinstance(key, list):
+	    key = tuple(key)  # so that we can remember it
+	if self.lookups_version != kytten_scoped_dict_version:
+	    self.lookups = {}
+	    self.lookups_version = kytten_scoped_dict_version
+	value = self.lookups.get(key, KYTTEN_MISSING_KEY)
+	if value is KYTTEN_MISSING_KEY:
+	    if key in self.lookups:
+		raise KeyError(key)  # we remembered that it's missing
 	    try:
-		return dict.__getitem__(self, key)
+		value = self._lookup(key)
 	    except KeyError:
-		if self.parent is not None:
-		    return self.parent.__getitem__(key)
-		else:
-		    raise
+		self.lookups[key] = KYTTEN_MISSING_KEY
+		raise
+	    self.lookups[key] = value
+	return value
 
     def __setitem__(self, key, value):
 	if isinstance(value, dict):
 	    dict.__setitem__(self, key, ScopedDict(value, self))
 	else:
 	    dict.__setitem__(self, key, value)
+	InvalidateScopedDictLookups()
+
+    def _get_missing(self, key):
+	"""
+	Called when a key can be found neither in us nor in any parent
+	scope.  Subclasses may return a value to use instead.
+
+	@param key The missing key
+	"""
+	raise KeyError(key)
+
+    def _lookup(self, key):
+	"""
+	Looks up a key or path without remembering it.
+
+	@param key A key, or a tuple of keys forming a path
+	"""
+	if isinstance(key, tuple):
+	    if len(key) > 1:
+		return self.__getitem__(key[0]).__getitem__(key[1:])
+	    elif len(key) == 1:
+		return self.__getitem__(key[0])
+	    else:
+		return self  # theme[][key] should return theme[key]
+	value = dict.get(self, key, KYTTEN_MISSING_KEY)
+	if value is not KYTTEN_MISSING_KEY:
+	    return value
+	elif self.parent is not None:
+	    return self.parent.__getitem__(key)
+	else:
+	    return self._get_missing(key)
+
+    def clear(self):
+	dict.clear(self)
+	InvalidateScopedDictLookups()
 
     def get(self, key, default=None):
 	if isinstance(key, list) or isinstance(key, tuple):
@@ -309,6 +552,10 @@ class ScopedDict(dict):
 	else:
 	    return self.__getitem__(path[0]).set_path(path[1:], value)
 
+    def update(self, *args, **kwargs):
+	dict.update(self, *args, **kwargs)
+	InvalidateScopedDictLookups()
+
     def write(self, f, indent=0):
 	f.write('{\n')
 	first = True
@@ -336,9 +583,15 @@ class Theme(ScopedDict):
     Theme is a dictionary-based class that converts any elements beginning
     with 'image' into a GraphicElementTemplate.  This allows us to specify
     both simple textures and 9-patch textures, and more complex elements.
+
+    If use_atlas is set, every image file is packed into a few shared
+    texture pages.  Regions and 9-patch stretch areas are taken from the
+    same pages, so widgets drawn with this Theme rarely need to switch
+    textures.
     """
     def __init__(self, arg, override={}, default=DEFAULT_THEME_SETTINGS,
-		 allow_empty_theme=False, name='theme.json'):
+		 allow_empty_theme=False, name='theme.json', use_atlas=False,
+		 use_mmap=False, lazy=False):
 	"""
 	Creates a new Theme.
 
@@ -347,10 +600,18 @@ class Theme(ScopedDict):
 	                      apply an override for its dictionary.
 	    * a dictionary - interpret any subdirectories where the key
 			     begins with 'image' as a GraphicElementTemplate
+	    * a theme bundle written by CompileTheme()
 	    * a filename - read the JSON file as a dictionary
 	@param override Replace some dictionary entries with these
 	@param default Initial dictionary entries before handling input
 	@param allow_empty_theme True if we should allow creating a new theme
+	@param use_atlas True if we should pack our images into shared
+			 texture pages.  Ignored if arg is another Theme or
+			 a theme bundle, whose images are packed already.
+	@param use_mmap True if a theme bundle should be memory-mapped
+			rather than read
+	@param lazy True if image entries should not load their textures
+		    until they are first used.  See preload().
 	"""
 	ScopedDict.__init__(self, default, None)
 
@@ -358,14 +619,24 @@ class Theme(ScopedDict):
 
 	if isinstance(arg, Theme):
 	    self.textures = arg.textures
+	    self.atlas = arg.atlas
+	    self.lazy = arg.lazy
 	    for k, v in arg.iteritems():
 		self.__setitem__(k, v)
 	    self.update(override)
 	    return
 
+	self.textures = {}
+	self.atlas = None
+	self.lazy = lazy
 	if isinstance(arg, dict):
 	    self.loader = pyglet.resource.Loader(os.getcwd())
 	    input = arg
+	elif IsThemeBundle(arg):
+	    self.loader = pyglet.resource.Loader(
+		os.path.dirname(os.path.abspath(arg)))
+	    input = self._load_bundle(arg, use_mmap)
+	    use_atlas = False
 	else:
 	    if os.path.isfile(arg) or os.path.isdir(arg):
 		self.loader = pyglet.resource.Loader(path=arg)
@@ -378,32 +649,88 @@ class Theme(ScopedDict):
 	    else:
 		input = {}
 
-	self.textures = {}
+	if use_atlas:
+	    self.atlas = TextureBin(THEME_ATLAS_SIZE, THEME_ATLAS_SIZE)
 	self._update_with_images(self, input)
 	self.update(override)
 
-    def __getitem__(self, key):
-	try:
-	    return ScopedDict.__getitem__(self, key)
-	except KeyError, e:
-	    if key.startswith('image'):
-		return UndefinedGraphicElementTemplate(self)
-	    else:
-		raise e
+    def _get_missing(self, key):
+	if key.startswith('image'):
+	    return UndefinedGraphicElementTemplate(self)
+	else:
+	    raise KeyError(key)
 
     def _get_texture(self, filename):
 	"""
 	Returns the texture associated with a filename.  Loads it from
-	resources if we haven't previously fetched it.
+	resources if we haven't previously fetched it.  If we are using an
+	atlas, this is a region of one of its pages.
 
 	@param filename The filename of the texture
 	"""
 	if not self.textures.has_key(filename):
-	    texture = self.loader.texture(filename)
+	    if self.atlas is not None:
+		texture = self._get_atlas_texture(filename)
+	    else:
+		texture = self.loader.texture(filename)
 	    texture.src = filename
 	    self.textures[filename] = texture
 	return self.textures[filename]
 
+    def _get_atlas_texture(self, filename):
+	"""
+	Loads an image and packs it into our atlas.  Images too large for
+	an atlas page are given a texture of their own.
+
+	@param filename The filename of the texture
+	"""
+	image = pyglet.image.load(filename, file=self.loader.file(filename))
+	if image.width > THEME_ATLAS_SIZE or image.height > THEME_ATLAS_SIZE:
+	    return image.get_texture()
+	try:
+	    return self.atlas.add(image)
+	except AllocatorException:
+	    return image.get_texture()
+
+    def _load_bundle(self, filename, use_mmap):
+	"""
+	Reads a theme bundle.  Each of its pages is uploaded as a single
+	texture, and the textures of its images are regions of those pages.
+
+	@param filename The filename of the bundle
+	@param use_mmap True if we should memory-map the bundle
+	@return The theme's dictionary
+	"""
+	f = open(filename, 'rb')
+	try:
+	    if use_mmap:
+		data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	    else:
+		data = f.read()
+	finally:
+	    f.close()
+	try:
+	    offset = len(THEME_BUNDLE_MAGIC)
+	    length, = struct.unpack('<I', data[offset:offset + 4])
+	    offset += 4
+	    header = marshal.loads(data[offset:offset + length])
+	    offset += length
+	    pages = []
+	    for width, height in header['pages']:
+		length = width * height * 4
+		image = pyglet.image.ImageData(width, height, 'RGBA',
+					       data[offset:offset + length])
+		pages.append(image.get_texture())
+		offset += length
+	finally:
+	    if use_mmap:
+		data.close()
+	for src, (page, x, y, width, height) in header['images'].iteritems():
+	    texture = pages[page].get_region(x, y, width, height)
+	    texture.src = src
+	    self.textures[src] = texture
+	return header['theme']
+
     def _get_texture_region(self, filename, x, y, width, height):
 	"""
 	Returns a texture region.
@@ -420,37 +747,49 @@ class Theme(ScopedDict):
 	retval.region = [x, y, width, height]
 	return retval
 
+    def _make_template(self, v):
+	"""
+	Creates the template for an image entry, loading its texture.
+
+	@param v The image entry; either a filename or a dictionary
+	"""
+	if isinstance(v, dict):
+	    width = height = None
+	    if v.has_key('region'):
+		x, y, width, height = v['region']
+		texture = self._get_texture_region(
+			v['src'], x, y, width, height)
+	    else:
+		texture = self._get_texture(v['src'])
+	    if v.has_key('stretch'):
+		return FrameTextureGraphicElementTemplate(
+		    self,
+		    texture,
+		    v['stretch'],
+		    v.get('padding', [0, 0, 0, 0]),
+		    width=width, height=height)
+	    else:
+		return TextureGraphicElementTemplate(
+		    self, texture, width=width, height=height)
+	else:
+	    return TextureGraphicElementTemplate(
+		self, self._get_texture(v))
+
     def _update_with_images(self, target, input):
 	"""
 	Update a ScopedDict with the input dictionary.  Translate
-	images into texture templates.
+	images into texture templates, or into LazyGraphicElementTemplates
+	if we are lazy.
 
 	@param target The ScopedDict which is to be populated
 	@param input The input dictionary
 	"""
 	for k, v in input.iteritems():
 	    if k.startswith('image'):
-		if isinstance(v, dict):
-		    width = height = None
-		    if v.has_key('region'):
-			x, y, width, height = v['region']
-			texture = self._get_texture_region(
-				v['src'], x, y, width, height)
-		    else:
-			texture = self._get_texture(v['src'])
-		    if v.has_key('stretch'):
-			target[k] = FrameTextureGraphicElementTemplate(
-			    self,
-			    texture,
-			    v['stretch'],
-			    v.get('padding', [0, 0, 0, 0]),
-			width=width, height=height)
-		    else:
-			target[k] = TextureGraphicElementTemplate(
-			    self, texture, width=width, height=height)
+		if self.lazy:
+		    target[k] = LazyGraphicElementTemplate(self, v)
 		else:
-		    target[k] = TextureGraphicElementTemplate(
-			self, self._get_texture(v))
+		    target[k] = self._make_template(v)
 	    elif isinstance(v, dict):
 		temp = ScopedDict(parent=target)
 		self._update_with_images(temp, v)
@@ -458,6 +797,132 @@ class Theme(ScopedDict):
 	    else:
 		target[k] = v
 
+    def preload(self, paths=None):
+	"""
+	Loads the textures of a lazy Theme's image entries before they are
+	first needed, i.e. while a loading screen is shown.
+
+	@param paths A list of paths, each leading to a section of the
+		     Theme, all of whose image entries are loaded, or to a
+		     single image entry.  If None, the whole Theme is loaded.
+	"""
+	if paths is None:
+	    targets = [self]
+	else:
+	    targets = [self[path] for path in paths]
+	while targets:
+	    target = targets.pop()
+	    if isinstance(target, LazyGraphicElementTemplate):
+		target.load()
+	    elif isinstance(target, ScopedDict):
+		targets.extend(target.itervalues())
+
     def write(self, f, indent=0):
 	ScopedDict.write(self, f, indent)
 	f.write('\n')
+
+def IsThemeBundle(filename):
+    """
+    Returns True if a file is a theme bundle written by CompileTheme().
+
+    @param filename The filename to check
+    """
+    if not os.path.isfile(filename):
+	return False
+    f = open(filename, 'rb')
+    try:
+	return f.read(len(THEME_BUNDLE_MAGIC)) == THEME_BUNDLE_MAGIC
+    finally:
+	f.close()
+
+def GetThemeImageFiles(input, files=None):
+    """
+    Returns the filenames of every image used in a theme's dictionary.
+
+    @param input The theme's dictionary, as read from its JSON file
+    @param files A set to which the filenames are to be added
+    """
+    if files is None:
+	files = set()
+    for k, v in input.iteritems():
+	if k.startswith('image'):
+	    if isinstance(v, dict):
+		files.add(v['src'])
+	    else:
+		files.add(v)
+	elif isinstance(v, dict):
+	    GetThemeImageFiles(v, files)
+    return files
+
+def CompileTheme(path, bundle, name='theme.json'):
+    """
+    Writes a theme bundle, from which a Theme may be created with a single
+    read and one texture upload per page.  The theme's JSON file is parsed
+    now, and its images packed into pages of THEME_ATLAS_SIZE; images too
+    large for a page are given a page of their own.  No OpenGL context is
+    needed.
+
+    @param path Directory or zip file containing the theme
+    @param bundle Filename of the bundle to write
+    @param name Name of the theme's JSON file within path
+    """
+    loader = pyglet.resource.Loader(path=path)
+    theme_file = loader.file(name)
+    input = json_load(theme_file.read())
+    theme_file.close()
+
+    # Pack the tallest images first, which suits the Allocator best
+    images = []
+    for src in GetThemeImageFiles(input):
+	image = pyglet.image.load(src, file=loader.file(src))
+	images.append((image.height, image.width, src, image))
+    images.sort(reverse=True)
+
+    pages = []  # lists of [width, height, pixels, allocator]
+    placements = {}
+    for height, width, src, image in images:
+	pixels = image.get_data('RGBA', width * 4)
+	for index, page in enumerate(pages):
+	    if page[3] is None:
+		continue  # the page is a single oversized image
+	    try:
+		x, y = page[3].alloc(width, height)
+		break
+	    except AllocatorException:
+		pass
+	else:
+	    index = len(pages)
+	    if width > THEME_ATLAS_SIZE or height > THEME_ATLAS_SIZE:
+		pages.append([width, height, None, None])
+	    else:
+		pages.append([THEME_ATLAS_SIZE, THEME_ATLAS_SIZE, None,
+			      Allocator(THEME_ATLAS_SIZE, THEME_ATLAS_SIZE)])
+	    page = pages[index]
+	    page[2] = bytearray(page[0] * page[1] * 4)
+	    if page[3] is None:
+		x, y = 0, 0
+	    else:
+		x, y = page[3].alloc(width, height)
+
+	# Copy the image into its page row by row
+	page_width, page_pixels = page[0], page[2]
+	row_length = width * 4
+	for row in xrange(height):
+	    start = ((y + row) * page_width + x) * 4
+	    page_pixels[start:start + row_length] = \
+		pixels[row * row_length:(row + 1) * row_length]
+	placements[src] = (index, x, y, width, height)
+
+    header = marshal.dumps({
+	'theme': input,
+	'pages': [(page[0], page[1]) for page in pages],
+	'images': placements})
+    f = open(bundle, 'wb')
+    try:
+	f.write(THEME_BUNDLE_MAGIC)
+	f.write(struct.pack('<I', len(header)))
+	f.write(header)
+	for page in pages:
+	    f.write(str(page[2]))
+    finally:
+	f.close()
@@ -16,6 +16,52 @@ import pyglet
 from pyglet import gl
 from override import KyttenLabel
 
+# Dialogs lay out their widgets in passes.  Widgets note which pass they
+# last took part in, so that a widget which was not sized in this pass
+# can tell whether its parent is asking it for the same size and position
+# as it received in the previous pass.  We also note whether any widget
+# was moved, so the Dialog knows if it needs to rebuild its control areas.
+kytten_layout_pass = 0
+kytten_layout_moved_controls = False
+kytten_layout_is_moving = False
+
+def BeginLayoutPass():
+    global kytten_layout_pass, kytten_layout_moved_controls
+    kytten_layout_pass += 1
+    kytten_layout_moved_controls = False
+
+def LayoutMovedControls():
+    return kytten_layout_moved_controls
+
+def MarkLayoutMovedControls():
+    """
+    Call from within a layout pass if Controls were moved without being
+    laid out again, i.e. by translating the group they are drawn in.
+    """
+    global kytten_layout_moved_controls
+    kytten_layout_moved_controls = True
+
+# Anything which changes what the GUI looks like marks the frame damaged:
+# Dialogs when they are laid out, moved, raised or torn down, or handle an
+# event, and Controls which change their graphics outside of layout, i.e.
+# a blinking caret.  Applications whose window shows only kytten Dialogs
+# may skip redrawing, and sleep, until the frame is damaged again.
+kytten_frame_damaged = True
+
+def MarkFrameDamaged():
+    global kytten_frame_damaged
+    kytten_frame_damaged = True
+
+def IsFrameDamaged():
+    return kytten_frame_damaged
+
+def ClearFrameDamage():
+    """
+    Call once the frame has been redrawn.
+    """
+    global kytten_frame_damaged
+    kytten_frame_damaged = False
+
 class Widget:
     """
     The base of all Kytten GUI elements.  Widgets correspond to areas on the
@@ -28,6 +74,12 @@ class Widget:
     layout() method to place them on the screen.  When their size is gotten
     for the first time, they initialize any requisite graphic elements
     that could not be done at creation time.
+
+    Containers size, expand and lay out their children through
+    size_if_needed(), expand_if_needed() and layout_if_needed().  Once a
+    widget has been laid out, these skip it entirely until it or one of its
+    children is marked dirty with set_dirty(), or its parent gives it a
+    different size or position.
     """
     def __init__(self, width=0, height=0):
         """
@@ -41,6 +93,37 @@ class Widget:
         self.height = height
         self.saved_dialog = None
 
+        # State for incremental layout
+        self.parent = None
+        self.is_dirty = True
+        self.has_dirty_child = False
+        self.natural_size = None
+        self.sized_dialog = None
+        self.layout_pass = 0
+        self.is_live = True
+        self.is_moving = False
+        self.expand_log = []
+        self.last_expand_log = []
+        self.last_area = None
+
+    def _begin_layout_pass(self):
+        """
+        If this is the first we've heard of the current layout pass, start
+        a new expansion log, keeping the last one to compare against.
+        If our parent is only being moved, we keep the size we ended up
+        with last time.
+        """
+        if self.layout_pass != kytten_layout_pass:
+            self.layout_pass = kytten_layout_pass
+            self.is_moving = kytten_layout_is_moving and \
+                             self.natural_size is not None
+            self.is_live = not self.is_moving
+            self.last_expand_log = self.expand_log
+            if self.is_moving:
+                self.expand_log = list(self.last_expand_log)
+            else:
+                self.expand_log = []
+
     def _get_controls(self):
         """
         Return this widget if it is a Control, or any children which
@@ -68,6 +151,30 @@ class Widget:
         """
         assert False, "Widget does not support expand"
 
+    def expand_if_needed(self, width, height):
+        """
+        Expands the widget on behalf of its parent.  If we skipped sizing
+        ourself in this pass and are asked for the same expansion as in the
+        previous pass, we simply take on the size we had then.
+
+        @param width Available width
+        @param height Available height
+        """
+        self._begin_layout_pass()
+        if not self.is_live:
+            if self.is_moving:
+                return
+            index = len(self.expand_log)
+            if index < len(self.last_expand_log) and \
+               self.last_expand_log[index][0:2] == (width, height):
+                entry = self.last_expand_log[index]
+                self.width, self.height = entry[2:4]
+                self.expand_log.append(entry)
+                return
+            self.resync()
+        self.expand(width, height)
+        self.expand_log.append((width, height, self.width, self.height))
+
     def hit_test(self, x, y):
         """
         True if the given point lies within our area.
@@ -107,6 +214,69 @@ class Widget:
         """
         self.x, self.y = x, y
 
+    def layout_if_needed(self, x, y):
+        """
+        Lays out the widget on behalf of its parent.  If we skipped sizing
+        ourself in this pass, and are being placed exactly as we were in
+        the previous pass, there is nothing to be done.  If we kept our size
+        but were moved, our children are moved along with us without being
+        sized again.
+
+        @param x X coordinate of our lower left corner
+        @param y Y coordinate of our lower left corner
+        """
+        global kytten_layout_moved_controls, kytten_layout_is_moving
+        self._begin_layout_pass()
+        is_moving = False
+        if not self.is_live:
+            if self.is_moving or \
+               len(self.expand_log) == len(self.last_expand_log):
+                if self.last_area is not None and \
+                   (x, y) == self.last_area[0:2]:
+                    return
+                is_moving = True
+            else:
+                self.resync()
+        was_moving = kytten_layout_is_moving
+        kytten_layout_is_moving = is_moving
+        try:
+            self.layout(x, y)
+        finally:
+            kytten_layout_is_moving = was_moving
+        area = (x, y, self.width, self.height)
+        if area != self.last_area:
+            self.last_area = area
+            kytten_layout_moved_controls = True
+
+    def resync(self):
+        """
+        We skipped sizing ourself earlier in this pass, but our parent has
+        since asked for a different size or position than last time.  Size
+        ourself and our children from scratch, then replay the expansions
+        we have been asked for so far in this pass.
+        """
+        expansions = self.expand_log
+        self.expand_log = []
+        self.is_live = True
+        self.size_subtree(self.sized_dialog)
+        for width, height, _, _ in expansions:
+            self.expand(width, height)
+            self.expand_log.append((width, height, self.width, self.height))
+
+    def set_dirty(self):
+        """
+        Marks this widget as needing to be sized again, and each of its
+        ancestors as containing such a widget.
+
+        @returns The outermost ancestor of this widget
+        """
+        self.is_dirty = True
+        widget = self
+        while widget.parent is not None:
+            widget = widget.parent
+            widget.has_dirty_child = True
+        return widget
+
     def size(self, dialog):
         """
         Constructs any graphic elements needed, and recalculates our size
@@ -117,6 +287,62 @@ class Widget:
         if dialog != self and dialog is not None:
             self.saved_dialog = dialog
 
+    def size_if_needed(self, dialog, parent):
+        """
+        Sizes the widget on behalf of its parent.  If neither we nor any of
+        our children have changed since we were last sized, we keep our
+        previous size without visiting our children at all.
+
+        @param dialog The Dialog which contains this Widget
+        @param parent The Widget which contains this Widget
+        """
+        global kytten_layout_moved_controls
+        if dialog is None:
+            return
+
+        # A Dialog may have some of its Widgets sized within a stand-in of
+        # its own, i.e. a Scrollable which gives each row its own groups
+        get_child_dialog = getattr(dialog, 'get_child_dialog', None)
+        if get_child_dialog is not None:
+            dialog = get_child_dialog(self, parent) or dialog
+
+        self._begin_layout_pass()
+        self.parent = parent
+        self.sized_dialog = dialog
+        if self.is_dirty or self.natural_size is None or \
+           getattr(dialog, 'is_full_layout', True):
+            self.is_live = True
+            self.size_subtree(dialog)
+
+            # A container which changed may have gained or lost Controls
+            # without changing its area
+            if self.is_dirty and not isinstance(self, Control) and \
+               self._get_controls():
+                kytten_layout_moved_controls = True
+        elif self.has_dirty_child:
+            self.is_live = True
+            self.size(dialog)
+            self.natural_size = (self.width, self.height)
+        else:
+            self.width, self.height = self.natural_size
+            self.is_live = False
+        self.is_dirty = self.has_dirty_child = False
+
+    def size_subtree(self, dialog):
+        """
+        Sizes the widget along with all of its children, whether or not
+        they have changed.
+
+        @param dialog The Dialog which contains this Widget
+        """
+        was_full_layout = getattr(dialog, 'is_full_layout', True)
+        dialog.is_full_layout = True
+        try:
+            self.size(dialog)
+        finally:
+            dialog.is_full_layout = was_full_layout
+        self.natural_size = (self.width, self.height)
+
     def teardown(self):
         """
         Removes all resources and pointers to other GUI widgets.
@@ -161,15 +387,24 @@ class Control(Widget, pyglet.event.EventDispatcher):
 
     def disable(self):
         self.disabled_flag = True
-        self.delete()
+        self._restyle()
         if self.saved_dialog is not None:
-            self.saved_dialog.set_needs_layout()
+            self.saved_dialog.set_needs_layout(self)
 
     def enable(self):
         self.disabled_flag = False
-        self.delete()
+        self._restyle()
         if self.saved_dialog is not None:
-            self.saved_dialog.set_needs_layout()
+            self.saved_dialog.set_needs_layout(self)
+
+    def _restyle(self):
+        """
+        Called when we are disabled or enabled.  We delete our graphic
+        elements so that size() recreates them in their new colors.
+        Controls which restyle their elements in place within size()
+        override this to keep them.
+        """
+        self.delete()
 
     def get_cursor(self, x, y):
         return self.cursor
@@ -177,6 +412,26 @@ class Control(Widget, pyglet.event.EventDispatcher):
     def is_disabled(self):
         return self.disabled_flag
 
+    def start_updates(self):
+        """
+        Asks our Dialog to dispatch on_update to us every frame, until
+        stop_updates() is called.  Controls which only need updates now
+        and then, i.e. while scrolling, should stop them when done.
+        """
+        if self.saved_dialog is not None:
+            self.saved_dialog.subscribe_updates(self)
+
+    def stop_updates(self):
+        """
+        Asks our Dialog to stop dispatching on_update to us.
+        """
+        if self.saved_dialog is not None:
+            self.saved_dialog.unsubscribe_updates(self)
+
+    def teardown(self):
+        self.stop_updates()
+        Widget.teardown(self)
+
     def is_focus(self):
         return self.focus_flag
 
@@ -316,7 +571,7 @@ class Label(Widget):
         self.text = text
         self.delete()
         if self.saved_dialog is not None:
-            self.saved_dialog.set_needs_layout()
+            self.saved_dialog.set_needs_layout(self)
 
     def size(self, dialog):
         if dialog is None:
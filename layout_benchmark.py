@@ -0,0 +1,244 @@
+# layout_benchmark.py
+# Copyrighted (C) 2009 by Conrad "Lynx" Wong
+
+# Times Dialog layout for synthetic Dialogs of various sizes, without
+# needing an OpenGL context.  Results may be saved, and later runs
+# compared against them, failing if any case has become slower.
+#
+# Usage: python layout_benchmark.py [--sizes 10,100,1000]
+#                                   [--save FILE] [--compare FILE]
+
+import math
+import optparse
+import sys
+import time
+
+import pyglet
+pyglet.options['shadow_window'] = False  # we may have no display
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import kytten
+from kytten.headless import HeadlessTheme, UseHeadlessBackend
+
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+MIN_SECONDS_PER_CASE = 0.2  # repeat each case for at least this long
+
+def make_flat(count):
+    """A VerticalLayout of Labels."""
+    labels = [kytten.Label("Label %d" % i) for i in xrange(count)]
+    return kytten.VerticalLayout(labels), labels[-1]
+
+def make_nested(count):
+    """Alternating Vertical and HorizontalLayouts, four children each."""
+    labels = []
+    def make_level(count, depth):
+        if count <= 4:
+            items = []
+            for i in xrange(count):
+                label = kytten.Label("Item %d" % len(labels))
+                labels.append(label)
+                items.append(label)
+        else:
+            share = int(math.ceil(count / 4.0))
+            items = []
+            while count > 0:
+                items.append(make_level(min(share, count), depth + 1))
+                count -= share
+        if depth % 2:
+            return kytten.HorizontalLayout(items)
+        else:
+            return kytten.VerticalLayout(items)
+    return make_level(count, 0), labels[-1]
+
+def make_grid(count):
+    """A square GridLayout of Labels and Checkboxes."""
+    columns = max(int(math.sqrt(count)), 1)
+    rows = []
+    labels = []
+    for row in xrange(int(math.ceil(float(count) / columns))):
+        cells = []
+        for column in xrange(min(columns, count - row * columns)):
+            if column % 2:
+                cells.append(kytten.Checkbox("Check %d" % column))
+            else:
+                label = kytten.Label("Cell %d, %d" % (row, column))
+                labels.append(label)
+                cells.append(label)
+        rows.append(cells)
+    return kytten.GridLayout(rows), labels[-1]
+
+def make_scrollable(count):
+    """A framed Scrollable of rows, each a Label, Button and Slider."""
+    rows = []
+    labels = []
+    for i in xrange((count + 2) / 3):
+        label = kytten.Label("Row %d" % i)
+        labels.append(label)
+        rows.append(kytten.HorizontalLayout([
+            label, kytten.Button("Press"), kytten.Slider(width=80)]))
+    return kytten.Frame(kytten.Scrollable(kytten.VerticalLayout(rows),
+                                          height=400)), labels[-1]
+
+def make_windowed(count):
+    """A Scrollable WindowedGridLayout of rows, each two Labels."""
+    rows = []
+    labels = []
+    for i in xrange((count + 1) / 2):
+        label = kytten.Label("Row %d" % i)
+        labels.append(label)
+        rows.append([label, kytten.Label("Value %d" % i)])
+    return kytten.Scrollable(kytten.WindowedGridLayout(rows),
+                             height=400), labels[0]
+
+BENCHMARK_CASES = [
+    ('flat', make_flat),
+    ('nested', make_nested),
+    ('grid', make_grid),
+    ('scrollable', make_scrollable),
+    ('windowed', make_windowed),
+]
+
+def find_scrollable(widget):
+    """
+    Returns the outermost Scrollable within a widget, or None.
+    """
+    while widget is not None:
+        if isinstance(widget, kytten.Scrollable):
+            return widget
+        widget = getattr(widget, 'content', None)
+    return None
+
+def time_repeatedly(function):
+    """
+    Calls a function until enough time has passed to time it reliably.
+
+    @param function The function to be timed
+    @returns Average seconds per call
+    """
+    count = 0
+    start = time.time()
+    while True:
+        function()
+        count += 1
+        elapsed = time.time() - start
+        if elapsed >= MIN_SECONDS_PER_CASE:
+            return elapsed / count
+
+def run_case(name, make_content, size, theme):
+    """
+    Builds a Dialog and times its first, full and incremental layouts,
+    and if it contains a Scrollable, how long scrolling it takes.
+
+    @returns Dictionary of timings in seconds, keyed by
+             'name/size/kind'
+    """
+    content, label = make_content(size)
+    dialog = kytten.Dialog(content, theme=theme)
+    dialog.screen.width, dialog.screen.height = 1024, 768
+
+    start = time.time()
+    dialog.do_layout()
+    first = time.time() - start
+
+    def full_layout():
+        dialog.set_needs_layout()
+        dialog.do_layout()
+
+    # The label's text changes, but not its size
+    texts = [label.text.upper(), label.text]
+    def incremental_layout():
+        texts.reverse()
+        label.set_text(texts[0])
+        dialog.do_layout()
+
+    # The Dialog is dragged back and forth by the mouse
+    deltas = [(-1, -1), (1, 1)]
+    def moved_layout():
+        deltas.reverse()
+        dx, dy = deltas[0]
+        dialog.is_dragging = True
+        dialog.on_mouse_drag(-1, -1, dx, dy, pyglet.window.mouse.LEFT, 0)
+        if dialog.needs_layout:
+            dialog.do_layout()
+
+    results = {
+        '%s/%d/first' % (name, size): first,
+        '%s/%d/full' % (name, size): time_repeatedly(full_layout),
+        '%s/%d/incremental' % (name, size):
+            time_repeatedly(incremental_layout),
+        '%s/%d/moved' % (name, size): time_repeatedly(moved_layout),
+    }
+
+    # The Scrollable's vertical scrollbar is dragged up and down
+    scrollable = find_scrollable(content)
+    if scrollable is not None and scrollable.vscrollbar is not None:
+        scrollbar = scrollable.vscrollbar
+        positions = [0.0, 1.0 - scrollbar.bar_width]
+        def scrolled_layout():
+            positions.reverse()
+            scrollbar.pos = positions[0]
+            scrollbar.saved_dialog.set_needs_layout(scrollbar)
+            dialog.do_layout()
+        results['%s/%d/scrolled' % (name, size)] = \
+            time_repeatedly(scrolled_layout)
+    dialog.teardown()
+    return results
+
+def main(argv):
+    parser = optparse.OptionParser()
+    parser.add_option('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                      help='comma-separated widget counts to try')
+    parser.add_option('--save', metavar='FILE',
+                      help='save timings to FILE')
+    parser.add_option('--compare', metavar='FILE',
+                      help='compare timings against those saved in FILE')
+    parser.add_option('--tolerance', type='float', default=1.5,
+                      help='fail if a case is this many times slower '
+                           'than the saved timing')
+    options, args = parser.parse_args(argv)
+    sizes = [int(x) for x in options.sizes.split(',')]
+
+    UseHeadlessBackend()
+    theme = HeadlessTheme()
+
+    baseline = {}
+    if options.compare:
+        f = open(options.compare)
+        baseline = json.loads(f.read())
+        f.close()
+
+    results = {}
+    failures = []
+    print '%-32s %12s %12s' % ('case', 'ms', 'baseline')
+    for name, make_content in BENCHMARK_CASES:
+        for size in sizes:
+            timings = run_case(name, make_content, size, theme)
+            for key in sorted(timings.keys()):
+                seconds = timings[key]
+                if baseline.has_key(key):
+                    saved = '%12.3f' % (baseline[key] * 1000)
+                    if seconds > baseline[key] * options.tolerance:
+                        failures.append(key)
+                        saved += ' SLOWER'
+                else:
+                    saved = '%12s' % '-'
+                print '%-32s %12.3f %s' % (key, seconds * 1000, saved)
+            results.update(timings)
+
+    if options.save:
+        f = open(options.save, 'w')
+        f.write(json.dumps(results, indent=2, sort_keys=True))
+        f.close()
+
+    if failures:
+        print '%d cases were slower than %.2f times their saved timing' % \
+              (len(failures), options.tolerance)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,42 @@
+# tests/test_dialog.py
+# Copyrighted (C) 2009 by Conrad "Lynx" Wong
+
+# Checks the ControlGrid which Dialogs use to find the controls under
+# the mouse.
+#
+# Usage: python -m unittest discover tests
+
+import unittest
+
+import pyglet
+pyglet.options['shadow_window'] = False  # we may have no display
+
+from kytten.dialog import ControlGrid
+
+class ControlGridTest(unittest.TestCase):
+    def setUp(self):
+        self.grid = ControlGrid(cell_size=10)
+
+    def assertFound(self, control, x, y):
+        self.assertTrue(control in self.grid.get(x, y),
+                        "control not found at (%s, %s)" % (x, y))
+
+    def test_integer_edges(self):
+        self.grid.add(0, 'a', 0, 10, 10, 0)
+        self.assertFound('a', 0, 0)
+        self.assertFound('a', 9.9, 9.9)
+        self.assertFalse('a' in self.grid.get(10, 5))
+
+    def test_fractional_edges(self):
+        # The right and top edges lie partway into the next cells
+        self.grid.add(0, 'a', 5, 10.5, 20.5, 5)
+        self.assertFound('a', 10.2, 20.2)
+
+    def test_negative_edges(self):
+        self.grid.add(0, 'a', -0.5, 5, 5, -0.5)
+        self.assertFound('a', -0.2, -0.2)
+        self.grid.add(1, 'b', -25, -15, -15, -25)
+        self.assertFound('b', -24.5, -15.5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+# tests/test_file_dialogs.py
+# Copyrighted (C) 2009 by Conrad "Lynx" Wong
+
+# Checks that a FileLoadDialog scanning in the background adds files to
+# its menu as they are found.  Runs without an OpenGL context, using
+# kytten.headless.
+#
+# Usage: python -m unittest discover tests
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import pyglet
+pyglet.options['shadow_window'] = False  # we may have no display
+
+import kytten
+from kytten.headless import HeadlessTheme, UseHeadlessBackend
+
+UseHeadlessBackend()
+
+class BackgroundScanTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        for i in xrange(1000):
+            open(os.path.join(self.path, 'file%04d.txt' % i), 'w').close()
+        for i in xrange(20):
+            os.mkdir(os.path.join(self.path, 'dir%02d' % i))
+        self.dialog = kytten.FileLoadDialog(
+            path=self.path, theme=HeadlessTheme(), scan_in_background=True)
+        self.dialog.screen.width, self.dialog.screen.height = 1024, 768
+        self.dialog.do_layout()
+
+    def tearDown(self):
+        self.dialog.teardown()
+        shutil.rmtree(self.path)
+
+    def update(self):
+        self.dialog.on_update(0.01)
+        if self.dialog.needs_layout:
+            self.dialog.do_layout()
+
+    def finish_scan(self):
+        deadline = time.time() + 10.0
+        while self.dialog.scan is not None and time.time() < deadline:
+            time.sleep(0.001)
+            self.update()
+        self.assertEqual(self.dialog.scan, None)
+
+    def test_files_sorted(self):
+        self.finish_scan()
+        menu = self.dialog.menu
+        expected = ['dir%02d (dir)' % i for i in xrange(20)] + \
+                   ['file%04d.txt' % i for i in xrange(1000)]
+        self.assertEqual(menu.texts, expected)
+        self.assertEqual(self.dialog.files, expected)
+
+    def test_selection_kept(self):
+        menu = self.dialog.menu
+        files = []
+        while not files:
+            time.sleep(0.001)
+            self.update()
+            files = [x for x in menu.texts if not x.endswith(' (dir)')]
+        text = files[0]
+        menu.select(text)  # selecting a directory would open it
+        self.finish_scan()
+        self.assertEqual(menu.selected, text)
+        index = menu.texts.index(text)
+        if menu.rows.has_key(index):
+            self.assertTrue(menu.rows[index].is_selected)
+        for index, option in menu.rows.iteritems():
+            self.assertEqual(option.text, menu.texts[index])
+
+    def test_only_new_texts_measured(self):
+        menu = self.dialog.menu
+        measured = []
+        measure_texts = menu._measure_texts
+        def count_measured(texts):
+            measured.extend(texts)
+            return measure_texts(texts)
+        menu._measure_texts = count_measured
+        self.finish_scan()
+        self.assertTrue(len(measured) <= len(menu.texts))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+# tests/test_layout.py
+# Copyrighted (C) 2009 by Conrad "Lynx" Wong
+
+# Checks that laying out only what has changed puts every Widget where a
+# full layout of the Dialog would, after labels change, Scrollables are
+# scrolled, rows are added and removed, and the Dialog is dragged.  Runs
+# without an OpenGL context, using kytten.headless.
+#
+# Usage: python -m unittest discover tests
+
+import random
+import unittest
+
+import pyglet
+pyglet.options['shadow_window'] = False  # we may have no display
+
+import kytten
+from kytten.dialog import GetWidgetOffset
+from kytten.headless import HeadlessTheme, UseHeadlessBackend
+
+UseHeadlessBackend()
+
+def get_children(widget):
+    """
+    Returns the Widgets directly within a Widget.
+    """
+    children = []
+    content = getattr(widget, 'content', None)
+    if isinstance(content, kytten.Widget):
+        children.append(content)
+    elif isinstance(content, (list, tuple)):
+        for item in content:
+            if isinstance(item, (list, tuple)):
+                children.extend([x for x in item if x is not None])
+            elif item is not None:
+                children.append(item)
+    for name in ['hscrollbar', 'vscrollbar']:
+        scrollbar = getattr(widget, name, None)
+        if scrollbar is not None:
+            children.append(scrollbar)
+    return children
+
+def get_areas(dialog):
+    """
+    Returns the area each Widget of a Dialog is drawn within, in the order
+    the Widgets are found.
+    """
+    areas = []
+    widgets = [dialog.content]
+    while widgets:
+        widget = widgets.pop()
+        offset_x, offset_y = GetWidgetOffset(widget)
+        areas.append((widget.__class__.__name__,
+                      widget.x + offset_x, widget.y + offset_y,
+                      widget.width, widget.height))
+        widgets.extend(get_children(widget))
+    return areas
+
+class IncrementalLayoutTest(unittest.TestCase):
+    def setUp(self):
+        self.random = random.Random(1)
+        self.labels = []
+        self.rows = [self.make_row() for i in xrange(40)]
+        self.rows_layout = kytten.VerticalLayout(self.rows)
+        self.scrollable = kytten.Scrollable(self.rows_layout, height=300)
+        self.header = self.make_label()
+        self.grid = kytten.GridLayout(
+            [[self.make_label(), self.make_label()] for i in xrange(4)])
+        self.dialog = kytten.Dialog(
+            kytten.Frame(kytten.VerticalLayout([
+                self.header,
+                kytten.HorizontalLayout([self.scrollable, self.grid]),
+            ])), theme=HeadlessTheme())
+        self.dialog.screen.width, self.dialog.screen.height = 1024, 768
+        self.dialog.do_layout()
+
+    def tearDown(self):
+        self.dialog.teardown()
+
+    def make_label(self):
+        label = kytten.Label(self.make_text())
+        self.labels.append(label)
+        return label
+
+    def make_row(self):
+        return kytten.HorizontalLayout([self.make_label(),
+                                        kytten.Checkbox("Check"),
+                                        self.make_label()])
+
+    def make_text(self):
+        return 'x' * self.random.randint(1, 30)
+
+    def assertMatchesFullLayout(self):
+        self.dialog.do_layout()
+        incremental = get_areas(self.dialog)
+        controls = set(self.dialog.controls)
+        self.dialog.set_needs_layout()
+        self.dialog.do_layout()
+        self.assertEqual(incremental, get_areas(self.dialog))
+        self.assertEqual(controls, set(self.dialog.controls))
+
+    def change_labels(self, count):
+        for label in self.random.sample(self.labels, count):
+            if label.saved_dialog is not None:
+                label.set_text(self.make_text())
+
+    def drag_dialog(self, dx, dy):
+        self.dialog.is_dragging = True
+        self.dialog.on_mouse_drag(0, 0, dx, dy, pyglet.window.mouse.LEFT, 0)
+        self.dialog.is_dragging = False
+
+    def scroll_to(self, pos):
+        scrollbar = self.scrollable.vscrollbar
+        scrollbar.pos = min(pos, 1.0 - scrollbar.bar_width)
+        scrollbar.saved_dialog.set_needs_layout(scrollbar)
+
+    def test_change_labels(self):
+        for i in xrange(20):
+            self.change_labels(3)
+            self.assertMatchesFullLayout()
+
+    def test_scroll(self):
+        for i in xrange(20):
+            self.scroll_to(self.random.random())
+            if i % 2:
+                self.change_labels(2)
+            self.assertMatchesFullLayout()
+
+    def test_remove_and_add_rows(self):
+        self.scroll_to(0.5)
+        self.assertMatchesFullLayout()
+        for i in xrange(20):
+            rows = self.rows_layout.content
+            if i % 3 == 2:
+                self.rows_layout.add(self.make_row())
+            else:
+                self.rows_layout.remove(self.random.choice(rows))
+            if i % 4 == 0:
+                self.scroll_to(self.random.random())
+            self.assertMatchesFullLayout()
+
+    def test_drag_dialog(self):
+        for i in xrange(10):
+            self.drag_dialog(self.random.randint(-20, 20),
+                             self.random.randint(-20, 20))
+            if i % 2:
+                self.change_labels(2)
+            if i % 3:
+                self.scroll_to(self.random.random())
+            self.assertMatchesFullLayout()
+
+class WindowedGridLayoutTest(unittest.TestCase):
+    def setUp(self):
+        self.rows = [[kytten.Label("Row %d" % i),
+                      kytten.Label("x" * (i % 7 + 1))] for i in xrange(500)]
+        self.grid = kytten.WindowedGridLayout(self.rows)
+        self.scrollable = kytten.Scrollable(self.grid, height=300)
+        self.dialog = kytten.Dialog(kytten.Frame(self.scrollable),
+                                    theme=HeadlessTheme())
+        self.dialog.screen.width, self.dialog.screen.height = 1024, 768
+        self.dialog.do_layout()
+
+    def tearDown(self):
+        self.dialog.teardown()
+
+    def get_row_areas(self):
+        areas = []
+        for index in xrange(self.grid.first_row, self.grid.last_row):
+            for cell in self.grid.content[index]:
+                offset_x, offset_y = GetWidgetOffset(cell)
+                areas.append((index, cell.x + offset_x, cell.y + offset_y,
+                              cell.width, cell.height))
+        return areas
+
+    def settle(self):
+        for i in xrange(3):
+            if self.dialog.needs_layout:
+                self.dialog.do_layout()
+
+    def test_scroll(self):
+        scrollbar = self.scrollable.vscrollbar
+        for pos in [0.1, 0.11, 0.5, 0.9, 0.3, 0.0]:
+            scrollbar.pos = pos * (1.0 - scrollbar.bar_width)
+            scrollbar.saved_dialog.set_needs_layout(scrollbar)
+            self.settle()
+            incremental = self.get_row_areas()
+            self.dialog.set_needs_layout()
+            self.settle()
+            self.assertEqual(incremental, self.get_row_areas())
+
+if __name__ == '__main__':
+    unittest.main()
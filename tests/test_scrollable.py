@@ -0,0 +1,98 @@
+# tests/test_scrollable.py
+# Copyrighted (C) 2009 by Conrad "Lynx" Wong
+
+# Checks the bands a Scrollable sizes the Widgets of its content within.
+# Runs without an OpenGL context, using kytten.headless.
+#
+# Usage: python -m unittest discover tests
+
+import unittest
+
+import pyglet
+pyglet.options['shadow_window'] = False  # we may have no display
+
+import kytten
+from kytten.headless import HeadlessTheme, UseHeadlessBackend
+from kytten.scrollable import ScrollableBand
+
+UseHeadlessBackend()
+
+def make_row(text):
+    return kytten.HorizontalLayout([kytten.Label(text),
+                                    kytten.Checkbox("Check")])
+
+class ScrollableBandTest(unittest.TestCase):
+    def setUp(self):
+        self.rows = [make_row("Row %d" % i) for i in xrange(50)]
+        self.layout = kytten.VerticalLayout(self.rows)
+        self.scrollable = kytten.Scrollable(self.layout, height=400)
+        self.dialog = kytten.Dialog(kytten.Frame(self.scrollable),
+                                    theme=HeadlessTheme())
+        self.dialog.screen.width, self.dialog.screen.height = 1024, 768
+        self.dialog.do_layout()
+
+    def tearDown(self):
+        self.dialog.teardown()
+
+    def assertBandsMatchRows(self):
+        bands = self.scrollable.bands.values()
+        self.assertEqual(sorted([id(band.widget) for band in bands]),
+                         sorted([id(row) for row in self.layout.content]))
+        for row in self.layout.content:
+            self.assertTrue(isinstance(row.saved_dialog, ScrollableBand))
+
+        # pyglet merges OrderedGroups of the same order and parent
+        groups = set([band.fg_group for band in bands])
+        self.assertEqual(len(groups), len(bands))
+
+    def test_bands(self):
+        self.assertBandsMatchRows()
+
+    def test_remove_rows(self):
+        self.layout.remove(self.rows[2])
+        self.layout.remove(self.rows[30])
+        self.dialog.do_layout()
+        self.assertBandsMatchRows()
+
+    def test_add_after_remove(self):
+        self.layout.remove(self.rows[5])
+        self.dialog.do_layout()
+        self.layout.add(make_row("New row"))
+        self.dialog.do_layout()
+        self.assertBandsMatchRows()
+
+class EnsureVisibleTest(unittest.TestCase):
+    def setUp(self):
+        self.rows = [make_row("Row %d" % i) for i in xrange(50)]
+        self.scrollable = kytten.Scrollable(kytten.VerticalLayout(self.rows),
+                                            height=400)
+        self.dialog = kytten.Dialog(kytten.Frame(self.scrollable),
+                                    theme=HeadlessTheme())
+        self.dialog.screen.width, self.dialog.screen.height = 1024, 768
+        self.dialog.do_layout()
+
+    def tearDown(self):
+        self.dialog.teardown()
+
+    def assertVisible(self, widget):
+        view_x, view_y, view_width, view_height = \
+            self.scrollable.get_view_region()
+        self.assertTrue(widget.y >= view_y and
+                        widget.y + widget.height <= view_y + view_height)
+
+    def scroll_to(self, pos):
+        scrollbar = self.scrollable.vscrollbar
+        scrollbar.pos = min(pos, 1.0 - scrollbar.bar_width)
+        scrollbar.saved_dialog.set_needs_layout(scrollbar)
+        self.dialog.do_layout()
+
+    def test_ensure_visible(self):
+        for pos, index in [(0.9, 3), (0.0, 45), (0.5, 0), (0.2, 49)]:
+            self.scroll_to(pos)
+            checkbox = self.rows[index].content[1]
+            self.scrollable.ensure_visible(checkbox)
+            self.dialog.do_layout()
+            self.assertVisible(checkbox)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# tests/test_virtual_menu.py
+# Copyrighted (C) 2009 by Conrad "Lynx" Wong
+
+# Checks that a VirtualMenu has options for every row in view as it is
+# scrolled.  Runs without an OpenGL context, using kytten.headless.
+#
+# Usage: python -m unittest discover tests
+
+import unittest
+
+import pyglet
+pyglet.options['shadow_window'] = False  # we may have no display
+
+import kytten
+from kytten.headless import HeadlessTheme, UseHeadlessBackend
+
+UseHeadlessBackend()
+
+class VirtualMenuTest(unittest.TestCase):
+    def setUp(self):
+        self.menu = kytten.VirtualMenu(
+            options=["Option %d" % i for i in xrange(1000)])
+        self.scrollable = kytten.Scrollable(self.menu, height=400)
+        self.dialog = kytten.Dialog(self.scrollable, theme=HeadlessTheme())
+        self.dialog.screen.width, self.dialog.screen.height = 1024, 768
+        self.dialog.do_layout()
+
+    def tearDown(self):
+        self.dialog.teardown()
+
+    def assertRowsInView(self):
+        menu = self.menu
+        step = menu.row_height + menu.padding
+        view_x, view_y, view_width, view_height = \
+            self.scrollable.get_view_region()
+        top = menu.y + menu.height
+        for index in xrange(len(menu.texts)):
+            row_top = top - index * step
+            row_bottom = row_top - menu.row_height
+            if row_top > view_y and row_bottom < view_y + view_height:
+                self.assertTrue(menu.rows.has_key(index),
+                                "row %d is in view but has no option" %
+                                index)
+
+    def scroll_to(self, pos):
+        scrollbar = self.scrollable.vscrollbar
+        scrollbar.pos = pos
+        scrollbar.saved_dialog.set_needs_layout(scrollbar)
+        self.dialog.do_layout()
+
+    def test_scroll_slowly(self):
+        scrollbar = self.scrollable.vscrollbar
+        self.assertRowsInView()
+        pos = 0.0
+        while pos < 1.0 - scrollbar.bar_width:
+            pos = min(pos + 0.001, 1.0 - scrollbar.bar_width)
+            self.scroll_to(pos)
+            self.assertRowsInView()
+
+    def test_scroll_back(self):
+        self.scroll_to(0.5)
+        self.assertRowsInView()
+        for i in xrange(50):
+            self.scroll_to(0.5 - i * 0.001)
+            self.assertRowsInView()
+
+if __name__ == '__main__':
+    unittest.main()